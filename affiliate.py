@@ -1,9 +1,15 @@
 import asyncio
 import json
 import re
+import time
 from pathlib import Path
-from urllib.parse import urlparse, urlunparse, urlencode, parse_qs
+from urllib.parse import urljoin, urlparse, urlunparse, urlencode, parse_qs
 from playwright.async_api import TimeoutError as PWTimeout
+import affiliate_cache
+from csrf_store import CsrfTokenStore
+from selector_registry import registry as selector_registry
+from waits import wait_for_network_idle
+from config import HTTP_RESOLVE_ENABLED, HTTP_RESOLVE_MAX_REDIRECTS, ML_WARM_PRODUCT_PAGE
 
 # ==============================================================================
 # CONFIGURAÇÕES E CONSTANTES - MERCADO LIVRE
@@ -17,15 +23,13 @@ ML_SEC_RE = re.compile(
     re.IGNORECASE,
 )
 
-# Cache de CSRF com Lock para evitar race condition no ML
-_CACHED_CSRF: str | None = None
-_CSRF_LOCK = asyncio.Lock()
+# Tokens CSRF por perfil ML (TTL + persistência + refresh em background)
+_CSRF_STORE = CsrfTokenStore()
 
 
-def clear_csrf_cache():
-    """Limpa cache de CSRF (chamado ao rotacionar perfil ML)."""
-    global _CACHED_CSRF
-    _CACHED_CSRF = None
+def clear_csrf_cache(profile: str | None = None):
+    """Invalida o CSRF de um perfil ML (ou de todos, se profile=None)."""
+    _CSRF_STORE.invalidate(profile)
 
 # ==============================================================================
 # CONFIGURAÇÕES E CONSTANTES - AMAZON
@@ -56,7 +60,8 @@ def _is_sec(url: str) -> bool:
 
 def _is_product_page(url: str) -> bool:
     url_lower = (url or "").lower()
-    has_mlb = bool(re.search(r"mlb\d+", url_lower, re.IGNORECASE))
+    # Mesmo critério do cache de afiliados: MLB123... e MLB-123... (produto.mercadolivre)
+    has_mlb = (affiliate_cache.product_key_from_url(url) or "").startswith("MLB")
     is_not_sec = "/sec/" not in url_lower
     is_not_review = (
         "/social/" not in url_lower and "/minutoreview" not in url_lower
@@ -66,72 +71,111 @@ def _is_product_page(url: str) -> bool:
 
 async def _click_ir_para_produto(page) -> bool:
     """Clica no botão 'Ir para produto' em páginas minutoreview"""
-    candidates = [
-        page.get_by_role("button", name="Ir para produto").first,
-        page.get_by_role("link", name="Ir para produto").first,
-        page.locator("a:has-text('Ir para produto')").first,
-        page.locator("button:has-text('Ir para produto')").first,
-        page.locator("text=Ir para produto").first,
-        page.get_by_text("Ir para produto", exact=False).first,
-    ]
-
-    for loc in candidates:
-        try:
-            if await loc.count() == 0:
-                continue
-
-            await loc.scroll_into_view_if_needed(timeout=2000)
-            await loc.click(timeout=8000)
-            return True
+    # Rótulo estável (chave no registro de seletores) -> locator
+    candidates = {
+        "role=button": lambda: page.get_by_role("button", name="Ir para produto").first,
+        "role=link": lambda: page.get_by_role("link", name="Ir para produto").first,
+        "a:has-text": lambda: page.locator("a:has-text('Ir para produto')").first,
+        "button:has-text": lambda: page.locator("button:has-text('Ir para produto')").first,
+        "text=": lambda: page.locator("text=Ir para produto").first,
+        "get_by_text": lambda: page.get_by_text("Ir para produto", exact=False).first,
+    }
 
+    for label in selector_registry.ordered("ml.ir_para_produto", list(candidates)):
+        started = time.perf_counter()
+        clicked = False
+        try:
+            loc = candidates[label]()
+            if await loc.count() > 0:
+                await loc.scroll_into_view_if_needed(timeout=2000)
+                await loc.click(timeout=8000)
+                clicked = True
         except Exception:
-            continue
+            pass
+        selector_registry.record("ml.ir_para_produto", label, clicked, time.perf_counter() - started)
+        if clicked:
+            return True
 
     return False
 
 
-async def _ensure_csrf_token_from_affiliates(page) -> str | None:
+AFFILIATES_URL = "https://www.mercadolivre.com.br/afiliados"
+
+CSRF_META_RE = re.compile(
+    r"""<meta[^>]+name=["']csrf[-_]?token["'][^>]*content=["']([^"']+)["']"""
+    r"""|<meta[^>]+content=["']([^"']+)["'][^>]*name=["']csrf[-_]?token["']""",
+    re.IGNORECASE,
+)
+
+
+async def _fetch_csrf_via_http(page) -> str | None:
+    """Lê o token do HTML de /afiliados via page.context.request (sem navegar)."""
+    resp = await page.context.request.get(AFFILIATES_URL, timeout=20000)
+    if resp.status != 200:
+        return None
+    m = CSRF_META_RE.search(await resp.text())
+    if not m:
+        return None
+    return (m.group(1) or m.group(2) or "").strip() or None
+
+
+async def _fetch_csrf_via_page(page) -> str | None:
+    """Navega para /afiliados e lê a meta tag (fallback)."""
+    current_url = page.url
+    print(
+        f" → Navegando para página de afiliados ML (URL atual: {current_url[:60]}...)..."
+    )
+
+    await page.goto(
+        AFFILIATES_URL,
+        wait_until="domcontentloaded",
+        timeout=60000,
+    )
+    await wait_for_network_idle(page, timeout_ms=2000)
+
+    token = await page.evaluate(
+        """
+        () => {
+            const m =
+                document.querySelector('meta[name="csrf-token"]') ||
+                document.querySelector('meta[name="csrf_token"]') ||
+                document.querySelector('meta[name="csrfToken"]');
+            return m ? (m.content || '') : '';
+        }
+        """
+    )
+    return (token or "").strip() or None
+
+
+async def _ensure_csrf_token_from_affiliates(page, profile: str) -> str | None:
     """
-    🔥 Navega para página de AFILIADOS e captura token de lá
+    🔥 Token CSRF do perfil, capturado de /afiliados
     (token precisa ser do mesmo domínio da API)
-    COM LOCK para evitar race condition
+    COM LOCK por perfil para evitar race condition
     """
-    global _CACHED_CSRF
-
-    async with _CSRF_LOCK:
-        if _CACHED_CSRF:
-            return _CACHED_CSRF
+    async with _CSRF_STORE.lock(profile):
+        token = _CSRF_STORE.get(profile)
+        if token:
+            if _CSRF_STORE.needs_refresh(profile):
+                _CSRF_STORE.schedule_refresh(profile, lambda: _fetch_csrf_via_http(page))
+            return token
 
         try:
-            current_url = page.url
-            print(
-                f" → Navegando para página de afiliados ML (URL atual: {current_url[:60]}...)..."
-            )
-
-            await page.goto(
-                "https://www.mercadolivre.com.br/afiliados",
-                wait_until="domcontentloaded",
-                timeout=60000,
-            )
-            await page.wait_for_timeout(2000)
-
-            token = await page.evaluate(
-                """
-                () => {
-                    const m =
-                        document.querySelector('meta[name="csrf-token"]') ||
-                        document.querySelector('meta[name="csrf_token"]') ||
-                        document.querySelector('meta[name="csrfToken"]');
-                    return m ? (m.content || '') : '';
-                }
-                """
-            )
+            try:
+                token = await _fetch_csrf_via_http(page)
+            except Exception as e:
+                print(f" ⚠️ Falha ao ler CSRF via HTTP: {e}")
+                token = None
 
-            token = (token or "").strip()
+            if token:
+                print(f" ⚡ [{profile}] CSRF token capturado via HTTP: {token[:20]}...")
+            else:
+                token = await _fetch_csrf_via_page(page)
+                if token:
+                    print(f" ✓ [{profile}] CSRF token capturado de /afiliados: {token[:20]}...")
 
             if token:
-                _CACHED_CSRF = token
-                print(f" ✓ CSRF token capturado de /afiliados: {token[:20]}...")
+                _CSRF_STORE.put(profile, token)
                 return token
 
             print(" ⚠️ Não encontrei CSRF token na página de afiliados")
@@ -142,13 +186,97 @@ async def _ensure_csrf_token_from_affiliates(page) -> str | None:
             return None
 
 
+def _is_review_page(url: str) -> bool:
+    url_lower = (url or "").lower()
+    return "/social/" in url_lower or "/minutoreview" in url_lower
+
+
+async def _follow_redirects_http(page, url: str, max_redirects: int = HTTP_RESOLVE_MAX_REDIRECTS) -> str | None:
+    """
+    Segue a cadeia de redirects lendo os headers Location via
+    page.context.request (mesmos cookies do perfil), sem renderizar a página.
+    Retorna a última URL alcançada ou None se a requisição falhar.
+    """
+    request = page.context.request
+    current = url
+
+    for _ in range(max_redirects):
+        try:
+            resp = await request.get(current, max_redirects=0, timeout=15000)
+        except Exception as e:
+            print(f" ⚠️ Falha HTTP ao resolver {current[:80]}: {e}")
+            return None
+
+        location = resp.headers.get("location")
+        status = resp.status
+        try:
+            await resp.dispose()
+        except Exception:
+            pass
+
+        if not (300 <= status < 400 and location):
+            return current
+
+        current = urljoin(current, location)
+        if _is_product_page(current) or _is_review_page(current):
+            return current
+
+    return current
+
+
 async def _resolve_product_url(page, sec_url: str) -> str | None:
-    """Resolve link /sec/ para URL do produto (MLB-xxxxx)"""
+    """
+    Resolve link /sec/ para URL do produto (MLB-xxxxx).
+    Primeiro só segue os redirects HTTP; a página só é carregada quando cai
+    em minutoreview/social (precisa do clique em 'Ir para produto').
+    """
+    if not HTTP_RESOLVE_ENABLED:
+        return await _resolve_product_url_via_page(page, sec_url)
+
+    final_url = await _follow_redirects_http(page, sec_url)
+    if final_url and _is_product_page(final_url):
+        print(f" ⚡ Resolvido via HTTP (sem abrir página): {final_url[:100]}")
+        return final_url
+
+    if final_url and _is_review_page(final_url):
+        print(" → Redirect leva a minutoreview, abrindo página...")
+        return await _resolve_product_url_via_page(page, final_url)
+
+    return await _resolve_product_url_via_page(page, sec_url)
+
+
+async def resolve_product_url_cached(page, url: str) -> str | None:
+    """
+    URL do produto para um link de oferta SEM abrir página: a própria URL
+    (se já tem MLB/ASIN), a resolução em cache (O(1) em repostagens) ou só
+    os redirects HTTP. Usado para a chave de dedup; minutoreview e afins
+    ficam sem resolver (retorna None).
+    """
+    url = (url or "").strip()
+    if not url:
+        return None
+    if affiliate_cache.product_key_from_url(url):
+        return url
+    cached = affiliate_cache.get_resolved(url)
+    if cached:
+        return cached
+    if not HTTP_RESOLVE_ENABLED or not (_is_sec(url) or AMZN_SHORT_RE.search(url)):
+        return None
+
+    final_url = await _follow_redirects_http(page, url)
+    if final_url and affiliate_cache.product_key_from_url(final_url):
+        affiliate_cache.put_resolved(url, final_url)
+        return final_url
+    return None
+
+
+async def _resolve_product_url_via_page(page, sec_url: str) -> str | None:
+    """Resolve navegando (fallback para páginas que exigem renderização)"""
     try:
         print(f" → Abrindo: {sec_url[:80]}...")
 
         await page.goto(sec_url, wait_until="domcontentloaded", timeout=60000)
-        await page.wait_for_timeout(2000)
+        await wait_for_network_idle(page, timeout_ms=2000)
 
         url_inicial = page.url
         print(f" → Página inicial: {url_inicial[:100]}...")
@@ -157,7 +285,7 @@ async def _resolve_product_url(page, sec_url: str) -> str | None:
             print(" ✓ Já está na página do produto!")
             return url_inicial
 
-        if "/social/" in url_inicial.lower() or "/minutoreview" in url_inicial.lower():
+        if _is_review_page(url_inicial):
             print(" → Detectado minutoreview, clicando 'Ir para produto'...")
 
             clicked = await _click_ir_para_produto(page)
@@ -176,7 +304,7 @@ async def _resolve_product_url(page, sec_url: str) -> str | None:
             except Exception as e:
                 print(f" ⚠️ Timeout esperando navegação: {e}")
 
-            await page.wait_for_timeout(2000)
+            await wait_for_network_idle(page, timeout_ms=2000)
 
         url_final = page.url
         print(f" → URL final: {url_final[:120]}")
@@ -202,11 +330,11 @@ async def _resolve_product_url(page, sec_url: str) -> str | None:
         return None
 
 
-async def _create_sec_via_api(page, product_url: str, tag: str) -> str | None:
+async def _create_sec_via_api(page, product_url: str, tag: str, profile: str) -> str | None:
     """
     🔥 Captura CSRF do domínio correto (afiliados) e chama API
     """
-    csrf = await _ensure_csrf_token_from_affiliates(page)
+    csrf = await _ensure_csrf_token_from_affiliates(page, profile)
 
     if not csrf:
         print(" ✗ Não consegui obter x-csrf-token válido")
@@ -244,10 +372,9 @@ async def _create_sec_via_api(page, product_url: str, tag: str) -> str | None:
 
         print(f" ✗ API retornou {resp.status}. Body: {body[:300]}")
 
-        global _CACHED_CSRF
         if resp.status in (401, 403):
-            async with _CSRF_LOCK:
-                _CACHED_CSRF = None
+            # Só o token deste perfil é afetado
+            _CSRF_STORE.invalidate(profile)
 
         return None
 
@@ -345,15 +472,53 @@ def _fallback_replace_tag(original_url: str, tag: str) -> str:
     return urlunparse(parsed._replace(query=new_query))
 
 
+# ==============================================================================
+# WARM PRODUCT PAGE (OPCIONAL, EM BACKGROUND)
+# ==============================================================================
+
+# Navegação de volta para o produto, por page. Nunca bloqueia o retorno do
+# link e é cancelada assim que a page for usada de novo.
+_WARM_TASKS: dict = {}
+
+
+async def _warm_product_page(page, product_url: str):
+    try:
+        await page.goto(product_url, wait_until="domcontentloaded", timeout=30000)
+        print(" ✓ (background) Voltou para página do produto")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f" ⚠️ (background) Erro ao voltar para produto: {e}")
+
+
+def _cancel_warm_product_page(page):
+    task = _WARM_TASKS.pop(page, None)
+    if task is not None and not task.done():
+        task.cancel()
+
+
+def _schedule_warm_product_page(page, product_url: str):
+    _cancel_warm_product_page(page)
+    task = asyncio.create_task(_warm_product_page(page, product_url))
+    _WARM_TASKS[page] = task
+
+    def _forget(t):
+        if _WARM_TASKS.get(page) is t:
+            _WARM_TASKS.pop(page, None)
+
+    task.add_done_callback(_forget)
+
+
 # ==============================================================================
 # FUNÇÕES PRINCIPAIS DE GERAÇÃO
 # ==============================================================================
 
 async def generate_affiliate_link(
-    page_m, any_url: str, tag: str, max_retries: int = 2
+    page_m, any_url: str, tag: str, max_retries: int = 2, profile: str | None = None
 ) -> tuple[str | None, str | None]:
     """
     🔥 (MERCADO LIVRE)
+    profile: nome do perfil ML (chave do token CSRF); padrão = tag
     RETORNA: (link_afiliado, product_url)
     """
     any_url = (any_url or "").strip()
@@ -365,13 +530,22 @@ async def generate_affiliate_link(
         print(" ✗ Tag do afiliado ML vazia")
         return None, None
 
+    _cancel_warm_product_page(page_m)
+    profile = profile or tag
+
     for attempt in range(max_retries):
         try:
             print(
                 f"\n 🔄 [ML] Gerando link afiliado (tentativa {attempt+1}/{max_retries})"
             )
 
-            product_url = await _resolve_product_url(page_m, any_url)
+            product_url = affiliate_cache.get_resolved(any_url)
+            if product_url:
+                print(f" ⚡ Resolução em cache: {product_url[:100]}")
+            else:
+                product_url = await _resolve_product_url(page_m, any_url)
+                if product_url:
+                    affiliate_cache.put_resolved(any_url, product_url)
 
             if not product_url:
                 print(" ✗ Não consegui chegar na página do produto")
@@ -380,21 +554,13 @@ async def generate_affiliate_link(
                     continue
                 return None, None
 
-            sec = await _create_sec_via_api(page_m, product_url, tag)
+            sec = await _create_sec_via_api(page_m, product_url, tag, profile)
 
             if sec:
                 print(f" ✅ Link afiliado ML gerado: {sec}")
 
-                try:
-                    await page_m.goto(
-                        product_url,
-                        wait_until="domcontentloaded",
-                        timeout=30000,
-                    )
-                    await page_m.wait_for_timeout(1500)
-                    print(" ✓ Voltou para página do produto")
-                except Exception as e:
-                    print(f" ⚠️ Erro ao voltar para produto: {e}")
+                if ML_WARM_PRODUCT_PAGE:
+                    _schedule_warm_product_page(page_m, product_url)
 
                 return sec, product_url
 
@@ -402,9 +568,7 @@ async def generate_affiliate_link(
                 print(" ✗ API ML não conseguiu gerar link")
 
                 if attempt < max_retries - 1:
-                    global _CACHED_CSRF
-                    async with _CSRF_LOCK:
-                        _CACHED_CSRF = None
+                    _CSRF_STORE.invalidate(profile)
                     await asyncio.sleep(3)
                     continue
 
@@ -434,25 +598,45 @@ async def generate_amazon_affiliate_link_async(
         return None, None
 
     print(f"\n 🔄 [AMAZON] Processando URL...")
+    _cancel_warm_product_page(page_m)
 
     # 1) tenta extrair ASIN direto
     asin = _extract_asin_from_url(original_url)
     parsed = urlparse(original_url)
     netloc = parsed.netloc or "www.amazon.com.br"
 
-    # 2) se for amzn.to OU não achou ASIN, resolve navegando
+    # 2) resolução sem navegador: cache ou redirects HTTP (amzn.to)
     resolved_url = original_url
-    if AMZN_SHORT_RE.search(original_url) or not asin:
+    if not asin:
+        fast_url = affiliate_cache.get_resolved(original_url)
+        if fast_url:
+            print(f" ⚡ Resolução em cache: {fast_url[:100]}")
+        elif HTTP_RESOLVE_ENABLED and AMZN_SHORT_RE.search(original_url):
+            fast_url = await _follow_redirects_http(page_m, original_url)
+            if fast_url and _extract_asin_from_url(fast_url):
+                affiliate_cache.put_resolved(original_url, fast_url)
+                print(f" ⚡ Resolvido via HTTP (sem abrir página): {fast_url[:100]}")
+
+        fast_asin = _extract_asin_from_url(fast_url or "")
+        if fast_asin:
+            asin = fast_asin
+            resolved_url = fast_url
+            netloc = urlparse(fast_url).netloc or netloc
+
+    # 3) se for amzn.to não resolvido OU não achou ASIN, resolve navegando
+    if (AMZN_SHORT_RE.search(original_url) and resolved_url == original_url) or not asin:
         try:
             print(f" → Resolvendo redirect/URL final: {original_url[:80]}...")
             await page_m.goto(original_url, wait_until="domcontentloaded", timeout=60000)
-            await page_m.wait_for_timeout(1500)
+            await wait_for_network_idle(page_m, timeout_ms=1500)
 
             resolved_url = page_m.url
             print(f" → URL resolvida: {resolved_url[:120]}")
 
             asin = _extract_asin_from_url(resolved_url)
-            if not asin:
+            if asin:
+                affiliate_cache.put_resolved(original_url, resolved_url)
+            else:
                 asin = await _extract_asin_from_page_dom(page_m)
 
             p2 = urlparse(resolved_url)
@@ -462,13 +646,13 @@ async def generate_amazon_affiliate_link_async(
         except Exception as e:
             print(f" ⚠️ Falha ao resolver no navegador: {e}")
 
-    # 3) se achou ASIN, monta canônico
+    # 4) se achou ASIN, monta canônico
     if asin:
         affiliate = _build_canonical_amazon_url(netloc, asin, tag)
         print(f" ✅ [AMAZON] ASIN={asin} | Link: {affiliate[:100]}...")
         return affiliate, resolved_url
 
-    # 4) fallback: troca tag no query (melhor que nada)
+    # 5) fallback: troca tag no query (melhor que nada)
     try:
         affiliate = _fallback_replace_tag(resolved_url, tag)
         print(f" ⚠️ [AMAZON] Sem ASIN, usando fallback tag-query: {affiliate[:100]}...")
@@ -501,7 +685,7 @@ async def download_product_image(
                     wait_until="domcontentloaded",
                     timeout=30000,
                 )
-                await page.wait_for_timeout(2000)
+                await wait_for_network_idle(page, timeout_ms=2000)
             except Exception:
                 pass
 
@@ -525,15 +709,18 @@ async def download_product_image(
 
         img_element = None
 
+        # Ordem de prioridade fixa (foto principal antes de qualquer img da CDN):
+        # candidatos apontam para elementos diferentes, então não passam pelo registro
         for selector in img_selectors:
             try:
                 elem = page.locator(selector).first
                 if await elem.count() > 0 and await elem.is_visible():
                     img_element = elem
-                    print(f" ✓ Imagem encontrada: {selector}")
-                    break
             except Exception:
-                continue
+                pass
+            if img_element is not None:
+                print(f" ✓ Imagem encontrada: {selector}")
+                break
 
         if not img_element:
             print(" ✗ Não encontrei imagem do produto (ML/Amazon)")
@@ -0,0 +1,101 @@
+"""
+Cache persistente de links de afiliado.
+
+- (produto normalizado, tag) → link afiliado gerado
+  produto = MLB (Mercado Livre) ou ASIN (Amazon)
+- link curto de origem (/sec/, amzn.to) → URL do produto resolvida
+
+Evita navegar + CSRF + POST na API quando a mesma oferta chega por outro
+grupo source. Entradas expiram por TTL. Guardado no estado SQLite
+(state_db: tabelas affiliate_links e resolved_urls).
+"""
+
+import re
+import time
+
+import state_db
+from config import AFFILIATE_LINK_TTL_SECONDS, RESOLVED_URL_TTL_SECONDS
+
+ML_ITEM_RE = re.compile(r"MLB-?(\d{6,})", re.IGNORECASE)
+AMAZON_ASIN_RE = re.compile(
+    r"/(?:dp|gp/product|product|ASIN)/([A-Z0-9]{10})(?:[/?]|$)", re.IGNORECASE
+)
+
+
+def product_key_from_url(url: str) -> str | None:
+    """Normaliza URL de produto para 'MLB123456' ou 'ASIN:B0XXXXXXX'."""
+    if not url:
+        return None
+    m = ML_ITEM_RE.search(url)
+    if m:
+        return f"MLB{m.group(1)}"
+    m = AMAZON_ASIN_RE.search(url)
+    if m:
+        return f"ASIN:{m.group(1).upper()}"
+    return None
+
+
+def get_resolved(short_url: str) -> str | None:
+    """URL do produto já resolvida para um link curto (ou None)."""
+    short_url = (short_url or "").strip()
+    if not short_url:
+        return None
+    try:
+        return state_db.resolved_get(short_url)
+    except Exception as e:
+        print(f"⚠️ Erro ao ler cache de afiliados: {e}")
+        return None
+
+
+def put_resolved(short_url: str, product_url: str):
+    short_url = (short_url or "").strip()
+    if not short_url or not product_url:
+        return
+    try:
+        state_db.resolved_put(short_url, product_url, time.time() + RESOLVED_URL_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Erro ao salvar cache de afiliados: {e}")
+
+
+def get_link(product_key: str, tag: str) -> tuple[str, str] | None:
+    """(link_afiliado, product_url) em cache para o produto+tag."""
+    try:
+        return state_db.link_get(product_key, tag)
+    except Exception as e:
+        print(f"⚠️ Erro ao ler cache de afiliados: {e}")
+        return None
+
+
+def put_link(product_key: str, tag: str, link: str, product_url: str = ""):
+    if not product_key or not tag or not link:
+        return
+    try:
+        state_db.link_put(product_key, tag, link, product_url, time.time() + AFFILIATE_LINK_TTL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Erro ao salvar cache de afiliados: {e}")
+
+
+def lookup(source_url: str, tag: str) -> tuple[str | None, str | None]:
+    """
+    Procura link afiliado pronto para a URL de origem SEM tocar no navegador.
+    Usa a URL direta (se já tem MLB/ASIN) ou a resolução em cache do link curto.
+    RETORNA: (link_afiliado, product_url) ou (None, None)
+    """
+    product_url = source_url if product_key_from_url(source_url) else get_resolved(source_url)
+    key = product_key_from_url(product_url or "")
+    if not key:
+        return None, None
+    hit = get_link(key, tag)
+    if not hit:
+        return None, None
+    link, cached_product_url = hit
+    return link, (cached_product_url or product_url)
+
+
+def remember(source_url: str, product_url: str | None, tag: str, link: str):
+    """Registra resolução + link gerado após uma conversão bem-sucedida."""
+    if not product_url:
+        return
+    if source_url and source_url != product_url:
+        put_resolved(source_url, product_url)
+    put_link(product_key_from_url(product_url), tag, link, product_url)
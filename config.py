@@ -1,12 +1,7 @@
-import os
-
 CHROME_USER_DATA_DIR = "C:\\BotChromeProfile"
 CHROME_PROFILE_DIR_NAME = "Default"
 HEADLESS = True
 
-DOWNLOAD_DIR = "./tmp"
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-
 MELI_AFFILIATE_TAG = "silvagabriel20230920180155"
 AMAZON_AFFILIATE_TAG = "superprom03bb-20"
 
@@ -38,6 +33,67 @@ ML_PROFILES = [
 ]
 ML_ROTATION_MINUTES = 30
 
+# Warm standby: mantém os contextos dos perfis extras abertos e logados,
+# então a rotação só troca o ponteiro (sem launch do Chrome no meio da oferta).
+ML_WARM_STANDBY = True
+# Limite de memória: máximo de contextos extras residentes ao mesmo tempo
+ML_MAX_RESIDENT_CONTEXTS = 2
+# Intervalo entre health-checks dos contextos residentes
+ML_HEALTHCHECK_SECONDS = 300
+# Perfil cujo Chrome não abriu fica indisponível (fallback no principal) e
+# só é reaberto depois deste intervalo, que dobra a cada falha até o teto
+ML_OPEN_RETRY_SECONDS = 300
+ML_OPEN_RETRY_MAX_SECONDS = 3600
+
+# Token CSRF do programa de afiliados, por perfil (csrf_tokens.json).
+# Renovado em background quando faltar menos que a margem para expirar.
+ML_CSRF_TTL_SECONDS = 2 * 60 * 60
+ML_CSRF_REFRESH_MARGIN_SECONDS = 15 * 60
+
+# Estado persistente (last-seen, dedup, cache de afiliados, histórico de
+# envios) em SQLite modo WAL; importa os .txt/.json antigos na 1ª execução
+STATE_DB_PATH = "bot_state.db"
+
+# Cache de afiliados (estado SQLite): produto+tag → link gerado
+# e link curto (/sec/, amzn.to) → URL do produto resolvida
+AFFILIATE_LINK_TTL_SECONDS = 24 * 60 * 60
+RESOLVED_URL_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Resolve /sec/ e amzn.to seguindo os redirects HTTP (sem carregar a página);
+# só minutoreview/social ainda abre o navegador para clicar "Ir para produto"
+HTTP_RESOLVE_ENABLED = True
+HTTP_RESOLVE_MAX_REDIRECTS = 8
+
+# Após gerar o link ML, volta o page_m para a página do produto em background.
+# Desligado por padrão: nada no fluxo usa esse estado (a imagem vem do WhatsApp).
+ML_WARM_PRODUCT_PAGE = False
+
+# Bloqueio de recursos (page.route) nas páginas de afiliados ML/Amazon:
+# elas só são usadas para ler URL/DOM, não precisam de imagens, CSS etc.
+ROUTE_BLOCKING_ENABLED = True
+ROUTE_BLOCK_RESOURCE_TYPES = ["image", "media", "font", "stylesheet"]
+ROUTE_BLOCKED_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "facebook.net",
+    "facebook.com",
+    "hotjar.com",
+    "clarity.ms",
+    "scorecardresearch.com",
+    "amazon-adsystem.com",
+    "fls-na.amazon.com",
+    "unagi.amazon.com.br",
+]
+# Exceções por plataforma: (regex da URL da página, tipos liberados)
+ROUTE_ALLOWLIST = [
+    # minutoreview/social: botão "Ir para produto" precisa de CSS para renderizar
+    (r"mercadolivre\.com(?:\.br)?/(?:social/|.*minutoreview)", ["stylesheet", "font"]),
+    # Amazon login/captcha: precisa aparecer se alguém for resolver manualmente
+    (r"amazon\.[a-z.]+/(?:ap/signin|errors/validateCaptcha)", ["stylesheet", "image"]),
+]
+
 SUPERHERO_EMOJI = "🦸"
 
 GATILHOS = [
@@ -50,8 +106,94 @@ GATILHOS = [
 ]
 GATILHO_CHANCE = 0.20
 
+# Quase-duplicatas: MinHash da legenda normalizada (sem links, emojis,
+# acentos e gatilhos). Jaccard estimado acima do limite = mesma oferta
+# reescrita; legendas com poucas palavras não são comparadas.
+NEAR_DUP_ENABLED = True
+NEAR_DUP_MIN_JACCARD = 0.6
+NEAR_DUP_MIN_TOKENS = 6
+# Assinatura e faixas do LSH (NUM_PERM deve ser múltiplo de BANDS)
+NEAR_DUP_NUM_PERM = 64
+NEAR_DUP_BANDS = 16
+
+# Dedup pela imagem: dHash (64 bits) da foto do bubble, calculado no canvas
+# da própria página. Até IMAGE_DEDUP_MAX_HAMMING bits de diferença = mesma foto.
+IMAGE_DEDUP_ENABLED = True
+IMAGE_DEDUP_MAX_HAMMING = 6
+
+# Tempo máximo (s) esperando o chat aberto parar de renderizar antes do snapshot
 BUBBLE_REFRESH_DELAY = 2
 
+# Esperas por condição (waits.py) no lugar das pausas fixas: cada espera
+# termina quando a página fica pronta (elemento visível, DOM parado, rede
+# ociosa) ou no tempo da pausa antiga. O piso de segurança (ms, sorteado
+# entre os dois valores) mantém o ritmo humano mesmo quando a página
+# responde na hora. False = volta às pausas fixas.
+CONDITION_WAITS_ENABLED = True
+WAIT_SAFETY_FLOOR_MS = (250, 600)
+# DOM "parado": sem mutações por este tempo (ms)
+DOM_STABLE_QUIET_MS = 300
+# Rede ociosa: sem requisições em andamento por este tempo (ms)
+NETWORK_IDLE_MS = 500
+
+# Catch-up: quantos bubbles recentes ler por source para achar o último
+# data-id visto e enfileirar, em ordem, todas as ofertas perdidas
+CATCHUP_MAX_MESSAGES = 10
+# Oferta que falha segura o last-seen do source (é redetectada e tentada de
+# novo); depois de OFFER_MAX_ATTEMPTS falhas é dada como perdida
+OFFER_MAX_ATTEMPTS = 3
+
+# Detecção por eventos: MutationObserver na lista de chats avisa quais
+# sources têm mensagem nova; só esses chats são abertos. A pausa aleatória
+# entre ciclos vira o teto de espera (varredura completa de segurança).
+EVENT_DRIVEN_DETECTION = True
+# Espera aleatória (segundos) após um evento, para agrupar rajadas
+EVENT_DEBOUNCE_SECONDS = (3, 12)
+
+# Pré-passo na lista de chats: antes de abrir os sources, lê de uma vez o
+# contador de não lidas e a prévia/horário de cada um. Só abre os chats que
+# mudaram desde a última verificação (ou que não estão visíveis na lista).
+CHAT_LIST_PREPASS = True
+
+# Pipeline detecção → afiliado → envio: tamanho máximo de cada fila.
+# Cheia = a detecção espera (backpressure) em vez de acumular imagens.
+PIPELINE_QUEUE_SIZE = 8
+
+# Envio em lote: ofertas prontas para o mesmo target são enviadas em
+# sequência numa única visita ao chat. Enquanto ainda há ofertas no
+# afiliado o envio segura o lote até SEND_BATCH_MAX_SIZE ofertas ou
+# SEND_BATCH_MAX_HOLD_SECONDS; com o pipeline vazio envia na hora.
+# SEND_BATCH_MAX_SIZE = 1 desliga o lote.
+SEND_BATCH_MAX_SIZE = 4
+SEND_BATCH_MAX_HOLD_SECONDS = 45
+
+# Agendador adaptativo: cada source é verificado no seu próprio ritmo,
+# estimado pela taxa de mensagens do grupo naquela hora do dia. O total de
+# aberturas de chat fica dentro do orçamento do ciclo antigo (todos os
+# sources a cada SCHEDULER_BUDGET_CYCLE_SECONDS = varredura + pausa 1~6 min).
+ADAPTIVE_SCHEDULER_ENABLED = True
+SCHEDULER_BUDGET_CYCLE_SECONDS = 240
+SCHEDULER_MIN_INTERVAL_SECONDS = 20
+SCHEDULER_MAX_INTERVAL_SECONDS = 20 * 60
+# Jitter relativo (±) aplicado a cada intervalo
+SCHEDULER_JITTER = 0.25
+# Pausa mínima entre rodadas
+SCHEDULER_MIN_SLEEP_SECONDS = 5
+# Estatísticas de chegada: meia-vida (dias), taxa a priori (msgs/hora) e pesos
+SCHEDULER_HALF_LIFE_DAYS = 7
+SCHEDULER_PRIOR_RATE_PER_HOUR = 2.0
+SCHEDULER_PRIOR_HOURS = 1.0
+SCHEDULER_HOUR_SMOOTHING_HOURS = 2.0
+# Janelas sem verificação maiores que isso (noite, restart) não entram na estatística
+SCHEDULER_MAX_GAP_SECONDS = 60 * 60
+
+# Registro de seletores: cada lista de seletores com fallback (anexar, fotos,
+# "Ir para produto", imagem do bubble) é tentada na ordem do histórico de
+# acertos. Decaimento por tentativa (mais perto de 1 = memória mais longa)
+# e intervalo mínimo entre gravações do ranking em selector_stats.json.
+SELECTOR_STATS_DECAY = 0.9
+SELECTOR_STATS_SAVE_SECONDS = 30
+
 POLL_SECONDS = 180
 
 RESTART_EVERY_CYCLES = 25
@@ -74,3 +216,19 @@ CHANNEL_PAIRS = [
 ]
 
 GROUP_LINK = "https://chat.whatsapp.com/Hd8UFqVrs1dGxdhq477syJ"
+
+# Legenda inserida com um único paste sintético (verificado); se o campo não
+# conferir, volta para a digitação linha a linha com Shift+Enter
+CAPTION_FAST_INSERT = True
+
+# Confirmação de envio: depois do Enter o sender espera a bolha nova
+# (div.message-out) aparecer no chat e o ícone sair do relógio (upload
+# concluído). Sem bolha no primeiro prazo = o método não enviou (tenta o
+# próximo); bolha ainda no relógio no segundo prazo = enviada, upload pendente.
+SEND_CONFIRM_BUBBLE_TIMEOUT_MS = 5000
+SEND_CONFIRM_ACK_TIMEOUT_MS = 30000
+
+# Upload direto no input[type=file] oculto de "Fotos e vídeos" (sem clicar
+# em Anexar nem abrir file chooser). Se o input não existir ou o editor de
+# mídia não abrir, usa o menu; o registro de seletores lembra qual funciona.
+DIRECT_FILE_INPUT_UPLOAD = True
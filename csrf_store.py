@@ -0,0 +1,116 @@
+"""
+Tokens CSRF do programa de afiliados ML, um por perfil (ML1, ML2, ...).
+
+Cada token é salvo em disco com o horário de captura, expira por TTL e é
+renovado em background pouco antes de expirar. Um 401/403 invalida só o
+perfil afetado, então voltar de ML3 para ML1 não exige carregar página.
+"""
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from config import ML_CSRF_TTL_SECONDS, ML_CSRF_REFRESH_MARGIN_SECONDS
+
+CSRF_STORE_FILE = Path("csrf_tokens.json")
+
+
+class CsrfTokenStore:
+    """Store de tokens CSRF por perfil com TTL, persistência e refresh proativo."""
+
+    def __init__(
+        self,
+        path: Path = CSRF_STORE_FILE,
+        ttl_seconds: int = ML_CSRF_TTL_SECONDS,
+        refresh_margin_seconds: int = ML_CSRF_REFRESH_MARGIN_SECONDS,
+    ):
+        self._path = Path(path)
+        self._ttl = ttl_seconds
+        self._margin = refresh_margin_seconds
+        self._tokens: dict[str, dict] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._refresh_tasks: dict[str, asyncio.Task] = {}
+        self._load()
+
+    def _load(self):
+        if not self._path.exists():
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            self._tokens = {
+                profile: entry
+                for profile, entry in (data or {}).items()
+                if entry.get("token") and now - entry.get("captured_at", 0) < self._ttl
+            }
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar tokens CSRF: {e}")
+
+    def _save(self):
+        try:
+            tmp = self._path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._tokens, f)
+            os.replace(tmp, self._path)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar tokens CSRF: {e}")
+
+    def lock(self, profile: str) -> asyncio.Lock:
+        """Lock por perfil (evita duas capturas simultâneas do mesmo token)."""
+        if profile not in self._locks:
+            self._locks[profile] = asyncio.Lock()
+        return self._locks[profile]
+
+    def _age(self, profile: str) -> float | None:
+        entry = self._tokens.get(profile)
+        if not entry:
+            return None
+        return time.time() - entry.get("captured_at", 0)
+
+    def get(self, profile: str) -> str | None:
+        """Token válido do perfil (ou None se ausente/expirado)."""
+        age = self._age(profile)
+        if age is None:
+            return None
+        if age >= self._ttl:
+            self.invalidate(profile)
+            return None
+        return self._tokens[profile]["token"]
+
+    def needs_refresh(self, profile: str) -> bool:
+        age = self._age(profile)
+        return age is None or age >= self._ttl - self._margin
+
+    def put(self, profile: str, token: str):
+        self._tokens[profile] = {"token": token, "captured_at": time.time()}
+        self._save()
+
+    def invalidate(self, profile: str | None = None):
+        """Invalida um perfil (ou todos, se profile=None)."""
+        if profile is None:
+            self._tokens.clear()
+        else:
+            self._tokens.pop(profile, None)
+        self._save()
+
+    def schedule_refresh(self, profile: str, fetcher: Callable[[], Awaitable[str | None]]):
+        """Renova o token em background (no máximo um refresh por perfil)."""
+        task = self._refresh_tasks.get(profile)
+        if task is not None and not task.done():
+            return
+
+        async def _refresh():
+            try:
+                token = await fetcher()
+            except Exception as e:
+                print(f" ⚠️ [{profile}] Refresh de CSRF falhou: {e}")
+                return
+            if token:
+                self.put(profile, token)
+                print(f" 🔄 [{profile}] CSRF renovado em background: {token[:20]}...")
+
+        self._refresh_tasks[profile] = asyncio.create_task(_refresh())
@@ -5,15 +5,21 @@ Bloqueia mensagens com o mesmo link de produto dentro de uma janela de tempo.
 
 import re
 import time
+import heapq
 import hashlib
-from pathlib import Path
 from typing import Optional
 
+import state_db
+
 # Janela de deduplicação em segundos (3 horas)
 DEDUP_WINDOW_SECONDS = 3 * 60 * 60  # 10800 segundos
 
-# Arquivo de cache persistente
-DEDUP_CACHE_FILE = Path("dedup_cache.txt")
+# Intervalo de compactação do índice em memória e do journal SQLite
+DEDUP_COMPACT_SECONDS = 10 * 60
+
+# Validade de uma reserva (oferta no pipeline). Rede de segurança: se a
+# oferta nunca sair pelo release/confirm, a chave volta a ficar livre
+DEDUP_RESERVATION_TTL_SECONDS = 30 * 60
 
 # Regex para extrair identificadores únicos de produtos
 ML_PRODUCT_RE = re.compile(r"(MLB-?\d+)", re.IGNORECASE)
@@ -60,53 +66,119 @@ def _generate_content_hash(text: str, urls: list[str]) -> str:
     return hashlib.sha256(text.encode()).hexdigest()[:32]
 
 
-def _load_cache() -> dict[str, dict]:
+class DedupIndex:
     """
-    Carrega cache do disco.
-    Formato: {target_group: {content_hash: timestamp}}
+    Índice em memória da janela de dedup: dict (target, hash) → horário do
+    envio + heap ordenado por expiração. Carregado do estado SQLite na
+    partida; a tabela `dedup` funciona como journal (cada envio é um INSERT
+    de uma linha) e é compactada periodicamente junto com o heap.
+
+    Um miss na memória consulta o SQLite pela chave primária antes de
+    liberar a oferta: outra instância do bot apontando para o mesmo banco
+    pode ter enviado depois do carregamento. Acertos continuam só em memória.
     """
-    cache: dict[str, dict] = {}
-    
-    if not DEDUP_CACHE_FILE.exists():
-        return cache
-    
-    try:
-        with open(DEDUP_CACHE_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line or "|" not in line:
-                    continue
-                
-                parts = line.split("|")
-                if len(parts) >= 3:
-                    target_group = parts[0]
-                    content_hash = parts[1]
-                    timestamp = float(parts[2])
-                    
-                    if target_group not in cache:
-                        cache[target_group] = {}
-                    cache[target_group][content_hash] = timestamp
-    except Exception as e:
-        print(f"⚠️ Erro ao carregar cache de dedup: {e}")
-    
-    return cache
 
+    def __init__(self, window_seconds: int = DEDUP_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._sent: dict[tuple[str, str], float] = {}
+        self._heap: list[tuple[float, str, str]] = []
+        # Ofertas já aprovadas que ainda estão no pipeline: chave -> horário da reserva
+        self._reserved: dict[tuple[str, str], float] = {}
+        self._last_compact = time.time()
+        self._load()
 
-def _save_cache(cache: dict[str, dict]):
-    """
-    Salva cache no disco, removendo entradas expiradas.
-    """
-    now = time.time()
-    
-    try:
-        with open(DEDUP_CACHE_FILE, "w", encoding="utf-8") as f:
-            for target_group, hashes in cache.items():
-                for content_hash, timestamp in hashes.items():
-                    # Só salva se ainda estiver válido
-                    if now - timestamp < DEDUP_WINDOW_SECONDS:
-                        f.write(f"{target_group}|{content_hash}|{timestamp}\n")
-    except Exception as e:
-        print(f"⚠️ Erro ao salvar cache de dedup: {e}")
+    def _load(self):
+        now = time.time()
+        try:
+            rows = state_db.dedup_load(now - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar cache de dedup: {e}")
+            rows = []
+        for target_group, content_hash, sent_at in rows:
+            self._remember(target_group, content_hash, sent_at)
+
+    def _remember(self, target_group: str, content_hash: str, sent_at: float):
+        self._sent[(target_group, content_hash)] = sent_at
+        heapq.heappush(self._heap, (sent_at + self.window_seconds, target_group, content_hash))
+
+    def last_sent(self, target_group: str, content_hash: str) -> float | None:
+        self._maybe_compact()
+        sent_at = self._sent.get((target_group, content_hash))
+        # Ausente ou já vencida na memória: o banco pode ter um envio mais novo
+        if sent_at is None or sent_at < time.time() - self.window_seconds:
+            sent_at = self._lookup_db(target_group, content_hash) or sent_at
+        return sent_at
+
+    def _lookup_db(self, target_group: str, content_hash: str) -> float | None:
+        """Miss na memória: confere o journal (envios de outras instâncias)."""
+        try:
+            sent_at = state_db.dedup_get(target_group, content_hash)
+        except Exception as e:
+            print(f"⚠️ Erro ao consultar cache de dedup: {e}")
+            return None
+        if sent_at is None or sent_at < time.time() - self.window_seconds:
+            return None
+        self._remember(target_group, content_hash, sent_at)
+        return sent_at
+
+    def is_reserved(self, target_group: str, content_hash: str) -> bool:
+        key = (target_group, content_hash)
+        reserved_at = self._reserved.get(key)
+        if reserved_at is None:
+            return False
+        if time.time() - reserved_at >= DEDUP_RESERVATION_TTL_SECONDS:
+            del self._reserved[key]  # reserva esquecida: não bloqueia para sempre
+            return False
+        return True
+
+    def reserve(self, target_group: str, content_hash: str):
+        self._reserved[(target_group, content_hash)] = time.time()
+
+    def release(self, target_group: str, content_hash: str):
+        self._reserved.pop((target_group, content_hash), None)
+
+    def add(self, target_group: str, content_hash: str, sent_at: float):
+        self._reserved.pop((target_group, content_hash), None)
+        self._remember(target_group, content_hash, sent_at)
+        try:
+            state_db.dedup_put(target_group, content_hash, sent_at)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar cache de dedup: {e}")
+
+    def _maybe_compact(self):
+        if time.time() - self._last_compact >= DEDUP_COMPACT_SECONDS:
+            self.compact()
+
+    def compact(self) -> int:
+        """Tira do heap/dict as entradas vencidas e apaga as mesmas do journal."""
+        now = time.time()
+        self._last_compact = now
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, target_group, content_hash = heapq.heappop(self._heap)
+            key = (target_group, content_hash)
+            # Entrada reenviada depois tem expiração nova: só remove a versão atual
+            if self._sent.get(key) == expires_at - self.window_seconds:
+                del self._sent[key]
+                removed += 1
+        for key, reserved_at in list(self._reserved.items()):
+            if now - reserved_at >= DEDUP_RESERVATION_TTL_SECONDS:
+                del self._reserved[key]
+        try:
+            state_db.dedup_purge(now - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao compactar cache de dedup: {e}")
+        return removed
+
+
+_index: DedupIndex | None = None
+
+
+def _get_index() -> DedupIndex:
+    global _index
+    if _index is None:
+        _index = DedupIndex()
+    return _index
 
 
 def is_duplicate(
@@ -116,7 +188,8 @@ def is_duplicate(
     window_seconds: int = DEDUP_WINDOW_SECONDS
 ) -> bool:
     """
-    Verifica se a mensagem é duplicada (já foi enviada recentemente).
+    Verifica se a mensagem é duplicada (já foi enviada recentemente ou já
+    está no pipeline a caminho do mesmo target).
     
     Args:
         target_group: Nome do grupo de destino
@@ -128,24 +201,39 @@ def is_duplicate(
         True se é duplicada (NÃO deve enviar), False se é nova (pode enviar)
     """
     content_hash = _generate_content_hash(text, urls)
-    cache = _load_cache()
+    index = _get_index()
     now = time.time()
     
-    # Verifica se existe no cache do grupo de destino
-    if target_group in cache:
-        if content_hash in cache[target_group]:
-            last_sent = cache[target_group][content_hash]
-            age = now - last_sent
-            
-            if age < window_seconds:
-                remaining = window_seconds - age
-                remaining_min = int(remaining / 60)
-                print(f"   🔄 DUPLICADA! Mesma oferta enviada há {int(age/60)} min. Bloqueio: {remaining_min} min restantes.")
-                return True
+    if index.is_reserved(target_group, content_hash):
+        print(f"   🔄 DUPLICADA! Mesma oferta já está na fila de envio para {target_group}.")
+        return True
+    
+    last_sent = index.last_sent(target_group, content_hash)
+    if last_sent is not None:
+        age = now - last_sent
+        
+        if age < window_seconds:
+            remaining = window_seconds - age
+            remaining_min = int(remaining / 60)
+            print(f"   🔄 DUPLICADA! Mesma oferta enviada há {int(age/60)} min. Bloqueio: {remaining_min} min restantes.")
+            return True
     
     return False
 
 
+def reserve(target_group: str, text: str, urls: list[str]):
+    """
+    Reserva a oferta enquanto ela atravessa o pipeline: uma cópia vinda de
+    outro source já é barrada antes do envio da primeira.
+    """
+    _get_index().reserve(target_group, _generate_content_hash(text, urls))
+
+
+def release(target_group: str, text: str, urls: list[str]):
+    """Libera a reserva (oferta descartada ou envio falhou)."""
+    _get_index().release(target_group, _generate_content_hash(text, urls))
+
+
 def mark_as_sent(target_group: str, text: str, urls: list[str]):
     """
     Marca a mensagem como enviada no cache.
@@ -157,14 +245,7 @@ def mark_as_sent(target_group: str, text: str, urls: list[str]):
         urls: Lista de URLs na mensagem
     """
     content_hash = _generate_content_hash(text, urls)
-    cache = _load_cache()
-    now = time.time()
-    
-    if target_group not in cache:
-        cache[target_group] = {}
-    
-    cache[target_group][content_hash] = now
-    _save_cache(cache)
+    _get_index().add(target_group, content_hash, time.time())
     
     product_id = _extract_product_id(urls)
     if product_id:
@@ -175,9 +256,8 @@ def mark_as_sent(target_group: str, text: str, urls: list[str]):
 
 def cleanup_expired_cache():
     """
-    Remove entradas expiradas do cache.
-    Pode ser chamado periodicamente para manter o arquivo limpo.
+    Remove entradas expiradas do índice e do journal.
+    Também roda sozinho a cada DEDUP_COMPACT_SECONDS.
     """
-    cache = _load_cache()
-    _save_cache(cache)  # _save_cache já filtra expirados
-    print("🧹 Cache de deduplicação limpo")
\ No newline at end of file
+    removed = _get_index().compact()
+    print(f"🧹 Cache de deduplicação limpo ({removed} entradas expiradas)")
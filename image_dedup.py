@@ -0,0 +1,252 @@
+"""
+Dedup de ofertas pela imagem: dHash perceptual (64 bits) da foto do bubble.
+
+A mesma foto de produto repostada com outra legenda ou outro link curto
+fica a poucos bits de distância. Os hashes ficam numa BK-tree por target
+(busca por distância de Hamming sem varrer tudo), expiram junto com a
+janela de dedup e são salvos no estado SQLite.
+"""
+
+import heapq
+import time
+from dataclasses import dataclass
+
+import state_db
+from config import IMAGE_DEDUP_ENABLED, IMAGE_DEDUP_MAX_HAMMING
+from dedup import (
+    DEDUP_WINDOW_SECONDS,
+    DEDUP_COMPACT_SECONDS,
+    DEDUP_RESERVATION_TTL_SECONDS,
+    _extract_product_id,
+)
+
+HASH_BITS = 64
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """SQLite guarda INTEGER com sinal (64 bits)."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+@dataclass
+class ImageHashEntry:
+    target: str
+    dhash: int
+    product_id: str | None
+    sent_at: float
+    pending: bool = False  # oferta ainda no pipeline (não enviada)
+
+    def expired_reservation(self, now: float) -> bool:
+        """Reserva pendente além do TTL (a oferta nunca saiu do pipeline)."""
+        return self.pending and now - self.sent_at >= DEDUP_RESERVATION_TTL_SECONDS
+    alive: bool = True
+
+
+class BKTree:
+    """
+    BK-tree sobre distância de Hamming. Remoção é preguiçosa (entrada marcada
+    como morta); a árvore é reconstruída quando metade dos nós morreu.
+    """
+
+    def __init__(self):
+        self._root = None  # [entry_id, dhash, {distância: filho}]
+        self._size = 0
+        self._dead = 0
+
+    def add(self, entry_id: int, dhash: int):
+        self._size += 1
+        node = [entry_id, dhash, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            d = hamming(dhash, current[1])
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, dhash: int, max_distance: int) -> list[tuple[int, int]]:
+        """(entry_id, distância) de todos os nós a até `max_distance`."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(dhash, node[1])
+            if d <= max_distance:
+                found.append((node[0], d))
+            # Desigualdade triangular: só filhos em [d - max, d + max] podem casar
+            for dist, child in node[2].items():
+                if d - max_distance <= dist <= d + max_distance:
+                    stack.append(child)
+        return found
+
+    def mark_dead(self) -> bool:
+        """Conta uma remoção. True quando vale reconstruir a árvore."""
+        self._dead += 1
+        return self._dead * 2 >= self._size
+
+
+class ImageHashIndex:
+    """BK-tree por target com expiração pela janela de dedup."""
+
+    def __init__(
+        self,
+        window_seconds: int = DEDUP_WINDOW_SECONDS,
+        max_hamming: int = IMAGE_DEDUP_MAX_HAMMING,
+    ):
+        self.window_seconds = window_seconds
+        self.max_hamming = max_hamming
+        self._entries: dict[int, ImageHashEntry] = {}
+        self._trees: dict[str, BKTree] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._next_id = 1
+        self._last_compact = time.time()
+        self._load()
+
+    def _load(self):
+        try:
+            rows = state_db.image_hashes_load(time.time() - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar hashes de imagem: {e}")
+            rows = []
+        for target, value, product_id, sent_at in rows:
+            self._insert(ImageHashEntry(target, value % (1 << HASH_BITS), product_id, sent_at))
+
+    def _insert(self, entry: ImageHashEntry) -> int:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._trees.setdefault(entry.target, BKTree()).add(entry_id, entry.dhash)
+        heapq.heappush(self._heap, (entry.sent_at + self.window_seconds, entry_id))
+        return entry_id
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.get(entry_id)
+        if entry is None or not entry.alive:
+            return
+        entry.alive = False
+        tree = self._trees.get(entry.target)
+        if tree is not None and tree.mark_dead():
+            self._rebuild(entry.target)
+
+    def _rebuild(self, target: str):
+        tree = BKTree()
+        for entry_id, entry in list(self._entries.items()):
+            if entry.target != target:
+                continue
+            if entry.alive:
+                tree.add(entry_id, entry.dhash)
+            else:
+                del self._entries[entry_id]
+        self._trees[target] = tree
+
+    def find(self, target: str, dhash: int, product_id: str | None) -> tuple[ImageHashEntry, int] | None:
+        self._maybe_compact()
+        tree = self._trees.get(target)
+        if tree is None:
+            return None
+        now = time.time()
+        for entry_id, distance in sorted(tree.search(dhash, self.max_hamming), key=lambda x: x[1]):
+            entry = self._entries.get(entry_id)
+            if entry is None or not entry.alive or now - entry.sent_at >= self.window_seconds:
+                continue
+            if entry.expired_reservation(now):
+                continue
+            # Produtos conhecidos e diferentes (ex.: foto genérica de variações) não são duplicata
+            if product_id and entry.product_id and product_id != entry.product_id:
+                continue
+            return entry, distance
+        return None
+
+    def reserve(self, target: str, dhash: int, product_id: str | None) -> int:
+        return self._insert(ImageHashEntry(target, dhash, product_id, time.time(), pending=True))
+
+    def confirm(self, entry_id: int):
+        entry = self._entries.get(entry_id)
+        if entry is None or not entry.alive or not entry.pending:
+            return
+        entry.pending = False
+        entry.sent_at = time.time()
+        heapq.heappush(self._heap, (entry.sent_at + self.window_seconds, entry_id))
+        try:
+            state_db.image_hashes_put(entry.target, _to_signed(entry.dhash), entry.product_id, entry.sent_at)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar hash de imagem: {e}")
+
+    def release(self, entry_id: int):
+        entry = self._entries.get(entry_id)
+        if entry is not None and entry.pending:
+            self._remove(entry_id)
+
+    def _maybe_compact(self):
+        if time.time() - self._last_compact >= DEDUP_COMPACT_SECONDS:
+            self.compact()
+
+    def compact(self):
+        now = time.time()
+        self._last_compact = now
+        while self._heap and self._heap[0][0] <= now:
+            _, entry_id = heapq.heappop(self._heap)
+            entry = self._entries.get(entry_id)
+            # Pendentes saem pelo release/confirm (ou pelo TTL); confirmadas têm
+            # expiração nova no heap
+            if entry is None:
+                continue
+            if entry.expired_reservation(now) or (
+                not entry.pending and entry.sent_at + self.window_seconds <= now
+            ):
+                self._remove(entry_id)
+        try:
+            state_db.image_hashes_purge(now - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao compactar hashes de imagem: {e}")
+
+
+_index: ImageHashIndex | None = None
+
+
+def _get_index() -> ImageHashIndex:
+    global _index
+    if _index is None:
+        _index = ImageHashIndex()
+    return _index
+
+
+def is_duplicate_image(target_group: str, dhash: int | None, urls: list[str]) -> bool:
+    """True se uma imagem quase igual foi enviada (ou está indo) para o target."""
+    if not IMAGE_DEDUP_ENABLED or dhash is None:
+        return False
+    match = _get_index().find(target_group, dhash, _extract_product_id(urls))
+    if match is None:
+        return False
+    entry, distance = match
+    age_min = int((time.time() - entry.sent_at) / 60)
+    state = "na fila de envio" if entry.pending else f"enviada há {age_min} min"
+    print(f"   🔄 IMAGEM REPETIDA! Foto a {distance} bits de uma {state} para {target_group}.")
+    return True
+
+
+def reserve(target_group: str, dhash: int | None, urls: list[str]) -> int | None:
+    """Registra o hash enquanto a oferta atravessa o pipeline. RETORNA: id (ou None)."""
+    if not IMAGE_DEDUP_ENABLED or dhash is None:
+        return None
+    return _get_index().reserve(target_group, dhash, _extract_product_id(urls))
+
+
+def confirm(entry_id: int | None):
+    """Envio bem-sucedido: o hash passa a valer pela janela e vai para o disco."""
+    if entry_id is not None:
+        _get_index().confirm(entry_id)
+
+
+def release(entry_id: int | None):
+    """Oferta descartada/falhou: remove a reserva (no-op se já confirmada)."""
+    if entry_id is not None:
+        _get_index().release(entry_id)
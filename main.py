@@ -1,7 +1,9 @@
 import asyncio
+import itertools
 import traceback
 import random
 import os
+import time
 import sys
 import logging
 import re
@@ -11,7 +13,6 @@ from playwright.async_api import async_playwright
 from config import (
     BUBBLE_REFRESH_DELAY,
     CHANNEL_PAIRS,
-    DOWNLOAD_DIR,
     MELI_AFFILIATE_TAG,
     CHROME_USER_DATA_DIR,
     AMAZON_AFFILIATE_TAG,
@@ -32,15 +33,27 @@ from config import (
     LOG_CLEANUP_CYCLES,
     ML_PROFILES,
     ML_ROTATION_MINUTES,
+    EVENT_DRIVEN_DETECTION,
+    EVENT_DEBOUNCE_SECONDS,
+    CHAT_LIST_PREPASS,
+    IMAGE_DEDUP_ENABLED,
+    STATE_DB_PATH,
+    PIPELINE_QUEUE_SIZE,
+    SEND_BATCH_MAX_SIZE,
+    SEND_BATCH_MAX_HOLD_SECONDS,
+    CATCHUP_MAX_MESSAGES,
+    OFFER_MAX_ATTEMPTS,
+    ADAPTIVE_SCHEDULER_ENABLED,
+    SCHEDULER_MIN_SLEEP_SECONDS,
 )
 from watcher import (
+    ChatActivityWatcher,
+    scan_chat_list,
     open_chat,
-    extract_last_message_text_and_urls,
     compute_msg_id,
-    get_last_message_bubble,
-    has_image,
-    download_last_image,
+    snapshot_last_bubbles,
     download_image_from_bubble,
+    compute_image_dhash,
 )
 from extractor import (
     extract_urls_from_text,
@@ -48,10 +61,24 @@ from extractor import (
     filter_amazon_urls,
     format_old_price_with_strikethrough,
 )
-from affiliate import generate_affiliate_link, generate_amazon_affiliate_link_async
+from affiliate import (
+    generate_affiliate_link,
+    generate_amazon_affiliate_link_async,
+    resolve_product_url_cached,
+)
 from sender_whatsapp import send_image_with_caption
 from storage import get_last_seen as load_last_seen, save_last_seen
 from ml_rotation import MLRotationManager
+from route_filter import install_resource_blocking
+from pipeline import Offer, OfferPipeline
+from scheduler import SourceScheduler
+from waits import pause, wait_for_dom_stable
+from selector_registry import registry as selector_registry
+import affiliate_cache
+import dedup
+import near_dedup
+import image_dedup
+import state_db
 
 # Flag de primeiro teste (roda 1 link por perfil sem esperar 30 min)
 FIRST_TEST = "--first-test" in sys.argv
@@ -190,21 +217,6 @@ def filter_meli_sec_urls(urls: list[str]) -> list[str]:
     return [u for u in urls if u and meli_sec_pattern.search(u)]
 
 
-def cleanup_temp_images(download_dir: str):
-    try:
-        temp_dir = Path(download_dir)
-        if not temp_dir.exists():
-            return
-        for img_file in temp_dir.glob("*.jpg"):
-            try:
-                img_file.unlink()
-            except Exception:
-                pass
-        logger.info("🗑️  Cleanup: imagens temporárias deletadas")
-    except Exception as e:
-        logger.warning(f"⚠️  Erro ao limpar imagens: {e}")
-
-
 async def wait_for_day_time():
     if not NIGHT_MODE_ENABLED:
         return
@@ -231,35 +243,60 @@ async def wait_for_day_time():
             await asyncio.sleep(300)
 
 
-async def process_new_message(
-    page_w,
-    page_m,
-    ml_manager,
-    text: str,
-    hrefs: list[str],
-    source_name: str,
-    target_name: str,
-    description: str,
-    bubble=None,  # 🔥 Novo: recebe o bubble específico para evitar mistura de imagem/legenda
-) -> bool:
-    # Se não recebeu bubble, busca (compatibilidade)
-    if bubble is None:
-        bubble = await get_last_message_bubble(page_w)
-    
-    if not await has_image(bubble):
-        logger.warning(f"   ⚠️  {source_name}: Sem IMAGEM - IGNORANDO mensagem")
-        return True
+def offer_urls(offer: Offer) -> list[str]:
+    """URLs da oferta (hrefs do bubble ou, sem eles, extraídas do texto)."""
+    return offer.hrefs if offer.hrefs else extract_urls_from_text(offer.text)
 
-    logger.info(f"   📸 {source_name}: Mensagem tem IMAGEM ✅")
 
-    urls = hrefs if hrefs else []
-    if not urls:
-        urls = extract_urls_from_text(text)
+async def resolve_dedup_urls(page_m, urls: list[str], product_links: list[str]) -> list[str]:
+    """
+    Troca os links curtos (/sec/, amzn.to) pela URL do produto resolvida, para
+    o dedup usar o MLB/ASIN canônico: links curtos diferentes do mesmo
+    produto viram a mesma chave. Cache primeiro; senão só redirects HTTP.
+    """
+    resolved: dict[str, str] = {}
+    for u in product_links[:3]:
+        try:
+            product_url = await resolve_product_url_cached(page_m, u)
+        except Exception as e:
+            logger.warning(f"   ⚠️  Falha ao resolver {u[:60]} para dedup: {e}")
+            product_url = None
+        if product_url:
+            resolved[u] = product_url
+    return [resolved.get(u, u) for u in urls]
+
+
+async def process_new_message(page_m, ml_manager, offer: Offer) -> bool:
+    """
+    Estágio de afiliados: gera os links (page_m/páginas de rotação) e monta a
+    legenda final em offer.final_text. True sem final_text = mensagem ignorada.
+    """
+    text = offer.text
+    source_name = offer.source_name
+
+    urls = offer_urls(offer)
 
     meli_urls = filter_meli_sec_urls(urls)
     
     # 🔥 Verifica se AMAZON está habilitado antes de filtrar
     amazon_urls = filter_amazon_urls(urls) if AMAZON_ENABLED else []
+
+    # 🔁 Dedup ANTES de qualquer trabalho no navegador (mesma oferta postada
+    # por vários sources no mesmo target), pelo produto e não pelo link curto
+    offer.dedup_urls = await resolve_dedup_urls(page_m, urls, meli_urls or amazon_urls)
+    if dedup.is_duplicate(offer.target_name, text, offer.dedup_urls):
+        logger.info(f"   🔁 {source_name}: Oferta repetida para {offer.target_name} - IGNORANDO")
+        return True
+    if near_dedup.is_near_duplicate(offer.target_name, text, offer.dedup_urls):
+        logger.info(f"   🔁 {source_name}: Oferta reescrita já enviada para {offer.target_name} - IGNORANDO")
+        return True
+    if image_dedup.is_duplicate_image(offer.target_name, offer.image_hash, offer.dedup_urls):
+        logger.info(f"   🔁 {source_name}: Mesma foto já enviada para {offer.target_name} - IGNORANDO")
+        return True
+    dedup.reserve(offer.target_name, text, offer.dedup_urls)
+    offer.dedup_reserved = True
+    offer.near_dup_id = near_dedup.reserve(offer.target_name, text, offer.dedup_urls)
+    offer.image_dup_id = image_dedup.reserve(offer.target_name, offer.image_hash, offer.dedup_urls)
     
     mapping = {}
     product_url = None
@@ -268,21 +305,48 @@ async def process_new_message(
     # Prioridade: Mercado Livre primeiro
     if meli_urls:
         platform = "ML"
-        page_ml, tag_ml = await ml_manager.get_ml_page_and_tag(page_m)
-        prof_name = ml_manager.current_profile["name"]
+        # Cache primeiro: um acerto não paga rotação nem aquisição de página
+        prof_name, tag_ml = ml_manager.peek_profile_and_tag()
         for u in meli_urls[:3]:
-            logger.info(f"   🔗 [ML/{prof_name}] Gerando afiliado para: {u[:60]}...")
-            new_u, prod_url = await generate_affiliate_link(page_ml, u, tag_ml)
+            new_u, prod_url = affiliate_cache.lookup(u, tag_ml)
             if new_u:
                 mapping[u] = new_u
                 product_url = prod_url
-                logger.info(f"   ✅ [ML/{prof_name}] Gerado: {new_u[:60]}...")
+                logger.info(f"   ⚡ [ML/{prof_name}] Cache: {new_u[:60]}... (sem navegador)")
                 break
+
+        if not mapping:
+            page_ml, tag_ml = await ml_manager.get_ml_page_and_tag(page_m)
+            prof_name = ml_manager.serving_profile["name"]
+            for u in meli_urls[:3]:
+                # A rotação pode ter trocado a tag: confere o cache dela também
+                new_u, prod_url = affiliate_cache.lookup(u, tag_ml)
+                if new_u:
+                    mapping[u] = new_u
+                    product_url = prod_url
+                    logger.info(f"   ⚡ [ML/{prof_name}] Cache: {new_u[:60]}... (sem navegador)")
+                    break
+
+                logger.info(f"   🔗 [ML/{prof_name}] Gerando afiliado para: {u[:60]}...")
+                new_u, prod_url = await generate_affiliate_link(page_ml, u, tag_ml, profile=prof_name)
+                if new_u:
+                    mapping[u] = new_u
+                    product_url = prod_url
+                    affiliate_cache.remember(u, prod_url, tag_ml, new_u)
+                    logger.info(f"   ✅ [ML/{prof_name}] Gerado: {new_u[:60]}...")
+                    break
     
     # Se não tem ML, tenta Amazon
     elif amazon_urls:
         platform = "AMAZON"
         for u in amazon_urls[:3]:
+            new_u, prod_url = affiliate_cache.lookup(u, AMAZON_AFFILIATE_TAG)
+            if new_u:
+                mapping[u] = new_u
+                product_url = prod_url
+                logger.info(f"   ⚡ [AMAZON] Cache: {new_u[:60]}... (sem navegador)")
+                break
+
             logger.info(f"   🔗 [AMAZON] Gerando afiliado para: {u[:60]}...")
             # Usando a função importada do affiliate.py unificado
             new_u, prod_url = await generate_amazon_affiliate_link_async(
@@ -291,6 +355,7 @@ async def process_new_message(
             if new_u:
                 mapping[u] = new_u
                 product_url = prod_url
+                affiliate_cache.remember(u, prod_url, AMAZON_AFFILIATE_TAG, new_u)
                 logger.info(f"   ✅ [AMAZON] Gerado: {new_u[:60]}...")
                 break
     
@@ -305,46 +370,76 @@ async def process_new_message(
     enhanced_text = process_text_enhancements(text)
     new_text = replace_urls_in_text(enhanced_text, mapping)
     new_text = format_old_price_with_strikethrough(new_text)
-    final_text = new_text
+    offer.final_text = new_text
 
-    logger.info(f"   📝 Texto processado: {len(final_text)} chars")
-    preview = final_text.replace("\n", " ")[:80]
+    logger.info(f"   📝 Texto processado: {len(offer.final_text)} chars")
+    preview = offer.final_text.replace("\n", " ")[:80]
     logger.info(f"   📝 Preview: {preview}...")
-    logger.info(f"   📸 Baixando imagem do bubble específico (evita mistura)...")
+    return True
 
-    # 🔥 Usa download_image_from_bubble com o bubble específico para evitar mistura
-    img_path = await download_image_from_bubble(page_w, bubble, DOWNLOAD_DIR, source_name)
-    if not img_path:
-        logger.error(f"   ❌ {source_name}: FALHA ao capturar/baixar imagem")
-        return False
 
-    logger.info(f"   ✅ Imagem pronta: {os.path.basename(img_path)}")
+def _record_send_result(offer: Offer, result) -> bool:
+    """Histórico + dedup de uma oferta enviada (ou não)."""
+    source_name = offer.source_name
+    target_name = offer.target_name
 
-    await page_w.bring_to_front()
-    await page_w.wait_for_timeout(300)
+    try:
+        state_db.record_send(
+            source_name, target_name, offer.msg_id, result.ok, offer.text,
+            status=result.status, upload_seconds=result.upload_seconds,
+        )
+    except Exception as e:
+        logger.warning(f"⚠️  Erro ao registrar histórico de envio: {e}")
+
+    if result.ok:
+        dedup.mark_as_sent(target_name, offer.text, offer.dedup_urls)
+        near_dedup.confirm(offer.near_dup_id)
+        image_dedup.confirm(offer.image_dup_id)
+        waited = time.time() - offer.detected_at
+        upload = f"upload {result.upload_seconds:.1f}s" if result.upload_seconds is not None else "upload pendente"
+        logger.info(
+            f"   ✅✅✅ {source_name}: SUCESSO! ({result.status}, {upload}, "
+            f"{result.total_seconds:.1f}s no envio, {waited:.0f}s desde a detecção)"
+        )
+    else:
+        logger.error(f"   ❌ {source_name}: FALHA ao enviar ({result.error or result.status})")
 
-    logger.info(f"   📤 {source_name}: Enviando IMAGEM + LEGENDA para {target_name}...")
-    ok = await send_image_with_caption(
-        page_w,
-        target_name,
-        img_path,
-        final_text,
-        target_group=target_name,
-    )
+    return result.ok
 
-    if img_path and os.path.exists(img_path):
-        try:
-            os.remove(img_path)
-            logger.info(f"   🗑️  Imagem temporária deletada")
-        except Exception as e:
-            logger.warning(f"   ⚠️  Erro ao deletar imagem: {e}")
 
-    if ok:
-        logger.info(f"   ✅✅✅ {source_name}: SUCESSO!")
-    else:
-        logger.error(f"   ❌ {source_name}: FALHA ao enviar")
+async def send_batch(page_w, wa_lock: asyncio.Lock, offers: list[Offer]) -> list[bool]:
+    """
+    Estágio de envio: dono do page_w enquanto envia um lote do mesmo target.
+    O chat do target é aberto uma vez e fica aberto entre as ofertas.
+    """
+    target_name = offers[0].target_name
+    results = []
+
+    async with wa_lock:
+        await page_w.bring_to_front()
+        await pause()
+
+        if len(offers) > 1:
+            logger.info(f"   📦 Lote de {len(offers)} ofertas para {target_name} (uma visita ao chat)")
+
+        chat_open = False
+        for offer in offers:
+            if chat_open:
+                await pause()
+            logger.info(f"   📤 {offer.source_name}: Enviando IMAGEM + LEGENDA para {target_name}...")
+            result = await send_image_with_caption(
+                page_w,
+                target_name,
+                offer.image,
+                offer.final_text,
+                target_group=target_name,
+                skip_open_chat=chat_open,
+            )
+            # Depois de uma falha o estado da tela é incerto: a próxima reabre o chat
+            chat_open = result.ok
+            results.append(_record_send_result(offer, result))
 
-    return ok
+    return results
 
 
 async def monitoring_loop(page_w, page_m, ml_manager):
@@ -366,81 +461,305 @@ async def monitoring_loop(page_w, page_m, ml_manager):
         else:
             logger.info(f"   Último ID: nenhum (primeira execução - vai enviar ÚLTIMA)")
         logger.info("")
-    logger.info(f"⏱️  Ciclo: Verificar todos → pausar 1~6 minutos (aleatório)")
+    scheduler = None
+    if ADAPTIVE_SCHEDULER_ENABLED:
+        scheduler = SourceScheduler([src for src, _, _ in CHANNEL_PAIRS])
+        logger.info("⏱️  Agendador adaptativo: cada source no ritmo das suas mensagens")
+        for line in scheduler.describe():
+            logger.info(f"   📈 {line}")
+    else:
+        logger.info(f"⏱️  Ciclo: Verificar todos → pausar 1~6 minutos (aleatório)")
+    for line in selector_registry.summary():
+        logger.info(f"   🧭 Seletores: {line}")
+
+    activity = None
+    if EVENT_DRIVEN_DETECTION:
+        activity = ChatActivityWatcher([src for src, _, _ in CHANNEL_PAIRS])
+        if await activity.install(page_w):
+            logger.info("🔔 Detecção por eventos ATIVA: pausa é interrompida quando um source recebe mensagem")
+        else:
+            logger.warning("⚠️  Detecção por eventos indisponível - usando apenas polling")
+            activity = None
     logger.info("=" * 80)
     logger.info("")
     cycle_count = 0
+    # None = varredura completa; set = apenas os sources devidos/com atividade
+    sources_to_check = None
+    # Assinatura (prévia/horário) de cada source na lista lateral na última verificação
+    chat_baseline: dict[str, str] = {}
+    # Restart e limpeza de logs contam varreduras equivalentes (verificações / nº de sources)
+    checks_done = 0
+    log_cleanups_done = 0
 
     # Para modo first-test: rastreia quais perfis ja foram testados
     tested_profiles = set()
 
-    async def _check_all_sources():
-        nonlocal tested_profiles
+    # page_w é compartilhado entre detecção (lê sources) e envio (upload)
+    wa_lock = asyncio.Lock()
+    # Rotação forçada (first-test) não pode trocar o perfil no meio de um afiliado
+    ml_lock = asyncio.Lock()
+
+    async def _affiliate_stage(offer: Offer) -> bool:
+        async with ml_lock:
+            return await process_new_message(page_m, ml_manager, offer)
+
+    async def _send_stage(offers: list[Offer]) -> list[bool]:
+        return await send_batch(page_w, wa_lock, offers)
+
+    # Ordem de detecção por source. O last-seen só avança pelo prefixo
+    # contíguo de mensagens resolvidas: uma oferta ainda no pipeline ou que
+    # falhou segura as mais novas, e é redetectada (mesmo seq) no próximo check
+    detect_seq = itertools.count(1)
+    seen_tracker: dict[str, dict[int, list]] = {}  # source -> seq -> [msg_id, preview, estado]
+    failed_attempts: dict[tuple[str, str], int] = {}
+
+    def _track(source_group: str, msg_id: str, preview: str = "") -> int | None:
+        """seq da mensagem (reaproveitado na redetecção); None se já foi resolvida."""
+        entries = seen_tracker.setdefault(source_group, {})
+        for seq, entry in entries.items():
+            if entry[0] == msg_id:
+                if entry[2] == "done":
+                    return None
+                entry[2] = "pending"
+                return seq
+        seq = next(detect_seq)
+        entries[seq] = [msg_id, preview, "pending"]
+        return seq
+
+    def _resolve(source_group: str, seq: int, ok: bool):
+        entries = seen_tracker.get(source_group, {})
+        entry = entries.get(seq)
+        if entry is None:
+            return
+        key = (source_group, entry[0])
+        if ok:
+            failed_attempts.pop(key, None)
+        else:
+            failed_attempts[key] = failed_attempts.get(key, 0) + 1
+            if failed_attempts[key] >= OFFER_MAX_ATTEMPTS:
+                logger.warning(f"   ⚠️  {source_group}: {entry[0][:16]}... falhou {OFFER_MAX_ATTEMPTS}x - desistindo")
+                failed_attempts.pop(key, None)
+                ok = True
+        entry[2] = "done" if ok else "failed"
+        _advance_last_seen(source_group)
+
+    def _expire_tracked(source_group: str, visible_ids: set[str]):
+        """
+        Desiste das mensagens que saíram da janela de catch-up (últimas
+        CATCHUP_MAX_MESSAGES) sem estar no pipeline: nunca mais seriam
+        redetectadas e segurariam o last-seen do source para sempre.
+        """
+        entries = seen_tracker.get(source_group, {})
+        expired = False
+        for entry in entries.values():
+            msg_id = entry[0]
+            if entry[2] == "done" or msg_id in visible_ids or pipeline.is_in_flight(source_group, msg_id):
+                continue
+            logger.warning(f"   ⚠️  {source_group}: {msg_id[:16]}... saiu da janela de catch-up - desistindo")
+            failed_attempts.pop((source_group, msg_id), None)
+            entry[2] = "done"
+            expired = True
+        if expired:
+            _advance_last_seen(source_group)
+
+    def _advance_last_seen(source_group: str):
+        entries = seen_tracker.get(source_group, {})
+        last = None
+        for s in sorted(entries):
+            if entries[s][2] != "done":
+                break
+            last = entries.pop(s)
+        if last is not None:
+            msg_id, preview, _ = last
+            last_seen_dict[source_group] = msg_id
+            save_last_seen(msg_id, source_group, preview)
+            logger.info(f"   💾 ID salvo: {msg_id[:16]}...")
+
+    async def _on_offer_done(offer: Offer, ok: bool):
+        # Enviada já virou entrada de dedup; qualquer outro desfecho libera a reserva
+        if offer.dedup_reserved:
+            dedup.release(offer.target_name, offer.text, offer.dedup_urls)
+        near_dedup.release(offer.near_dup_id)
+        image_dedup.release(offer.image_dup_id)
+        _resolve(offer.source_name, offer.seq, ok)
+        if not ok:
+            logger.warning(f"   ⚠️  {offer.source_name}: Falhou - ID NÃO salvo (será tentada de novo)")
+            return
+
+        # First-test: forca rotacao apos envio
+        if FIRST_TEST and offer.final_text:
+            async with ml_lock:
+                prof_name = ml_manager.current_profile["name"]
+                tested_profiles.add(prof_name)
+                logger.info(f"   🧪 [FIRST-TEST] Perfil {prof_name} testado! Forcando rotacao...")
+                await ml_manager.force_rotate()
+
+    pipeline = OfferPipeline(
+        _affiliate_stage,
+        _send_stage,
+        _on_offer_done,
+        maxsize=PIPELINE_QUEUE_SIZE,
+        batch_size=SEND_BATCH_MAX_SIZE,
+        max_hold=SEND_BATCH_MAX_HOLD_SECONDS,
+    )
+
+    def _pending_bubbles(source_group: str, snaps: list) -> list:
+        """
+        Bubbles ainda não vistos, do mais antigo para o mais novo (catch-up).
+        Anda para trás até o data-id salvo; aceita também o hash antigo
+        (compute_msg_id) para migrar o estado de versões anteriores.
+        """
+        last_seen_id = last_seen_dict.get(source_group)
+        if not last_seen_id:
+            logger.info("   🆕 PRIMEIRA EXECUÇÃO - Enviando ÚLTIMA mensagem")
+            return snaps[-1:]
+
+        for idx in range(len(snaps) - 1, -1, -1):
+            snap = snaps[idx]
+            if last_seen_id in (snap.data_id, compute_msg_id(snap.text, snap.hrefs)):
+                return snaps[idx + 1:]
+
+        logger.info(f"   ⚠️  ID anterior ({last_seen_id[:16]}...) fora das últimas {len(snaps)} mensagens - enviando só a ÚLTIMA")
+        return snaps[-1:]
+
+    async def _detect_source(source_group: str, target_group: str, description: str) -> tuple[list[Offer], int]:
+        """
+        Lê os bubbles novos do source (segurando o page_w) e captura as imagens.
+        RETORNA: (ofertas, nº de mensagens novas) - a contagem alimenta o agendador.
+        """
+        offers: list[Offer] = []
+        async with wa_lock:
+            await ensure_whatsapp_ready(page_w)
+            opened_at = time.monotonic()
+            await open_chat(page_w, source_group)
+            # Snapshot assim que a lista de mensagens parar de renderizar
+            await wait_for_dom_stable(page_w, "#main", timeout_ms=BUBBLE_REFRESH_DELAY * 1000)
+
+            # 🔥 Snapshot único: texto, urls e imagem sempre do mesmo bubble
+            snaps = await snapshot_last_bubbles(page_w, CATCHUP_MAX_MESSAGES)
+            snaps = [s for s in snaps if s.text or s.hrefs]
+            pending = _pending_bubbles(source_group, snaps) if snaps else []
+
+            # Bubble novo sem imagem pode ser só a foto ainda carregando: antes
+            # de descartá-lo, completa o BUBBLE_REFRESH_DELAY desde a abertura
+            # do chat e tira outro snapshot
+            remaining = BUBBLE_REFRESH_DELAY - (time.monotonic() - opened_at)
+            if remaining > 0 and any(not s.has_image for s in pending):
+                await asyncio.sleep(remaining)
+                snaps = await snapshot_last_bubbles(page_w, CATCHUP_MAX_MESSAGES)
+                snaps = [s for s in snaps if s.text or s.hrefs]
+                pending = _pending_bubbles(source_group, snaps) if snaps else []
+
+            if not snaps:
+                logger.info("   ℹ️  Sem mensagens no grupo")
+                return offers, 0
+            _expire_tracked(
+                source_group, {s.data_id or compute_msg_id(s.text, s.hrefs) for s in snaps}
+            )
+
+            first_run = not last_seen_dict.get(source_group)
+            new_count = 0 if first_run else len(pending)
+            if not pending:
+                logger.info("   ✅ Nenhuma mensagem nova")
+                return offers, 0
+            if len(pending) > 1:
+                logger.info(f"   🆕 {len(pending)} MENSAGENS NOVAS (catch-up em ordem)")
+
+            for snap in pending:
+                # data-id nativo do WhatsApp; hash só se o bubble não tiver data-id
+                msg_id = snap.data_id or compute_msg_id(snap.text, snap.hrefs)
+                if pipeline.is_in_flight(source_group, msg_id):
+                    logger.info(f"   ⏳ {msg_id[:16]}... já está no pipeline")
+                    continue
+
+                seq = _track(source_group, msg_id, snap.text[:50])
+                if seq is None:
+                    logger.info(f"   ✔️  {msg_id[:16]}... já resolvida (aguardando uma mais antiga)")
+                    continue
+                logger.info(f"   🆕 MENSAGEM NOVA: {msg_id[:16]}... {snap.timestamp.strip()}")
+
+                if not snap.has_image:
+                    logger.warning(f"   ⚠️  {source_group}: Sem IMAGEM - IGNORANDO mensagem")
+                    _resolve(source_group, seq, True)
+                    continue
+
+                logger.info(f"   📸 {source_group}: Mensagem tem IMAGEM ✅")
+                logger.info(f"   📸 Baixando imagem do bubble específico (evita mistura)...")
+
+                # 🔥 Baixa a imagem agora, com o chat do source ainda aberto
+                image = await download_image_from_bubble(page_w, snap, source_group)
+                if not image:
+                    logger.error(f"   ❌ {source_group}: FALHA ao capturar/baixar imagem")
+                    _resolve(source_group, seq, False)
+                    continue
+
+                logger.info(f"   ✅ Imagem pronta em memória: {image['name']} ({image['mimeType']})")
+                # Hash perceptual uma vez por imagem, ainda com o bubble na tela
+                image_hash = await compute_image_dhash(page_w, snap) if IMAGE_DEDUP_ENABLED else None
+                offers.append(
+                    Offer(
+                        source_name=source_group,
+                        target_name=target_group,
+                        description=description,
+                        msg_id=msg_id,
+                        text=snap.text,
+                        hrefs=snap.hrefs,
+                        image=image,
+                        image_hash=image_hash,
+                        seq=seq,
+                    )
+                )
+
+        return offers, new_count
+
+    def _needs_open(source_group: str, row) -> bool:
+        """Decide pelo pré-passo se vale abrir o chat do source."""
+        if row is None:
+            return True  # fora da parte renderizada da lista: não dá para saber
+        if row.unread > 0:
+            return True
+        return chat_baseline.get(source_group) != row.signature
+
+    async def _check_all_sources(only: set[str] | None = None):
+        nonlocal tested_profiles, checks_done
+        rows = None
+        if CHAT_LIST_PREPASS:
+            async with wa_lock:
+                rows = await scan_chat_list(page_w, [src for src, _, _ in CHANNEL_PAIRS])
+            if rows is None:
+                logger.warning("   ⚠️  Lista de chats indisponível - abrindo todos os sources")
+
         for source_group, target_group, description in CHANNEL_PAIRS:
+            if only is not None and source_group not in only:
+                continue
+            row = rows.get(source_group) if rows is not None else None
+            if rows is not None and not _needs_open(source_group, row):
+                logger.info(f"💤 {source_group}: sem mudança na lista de chats - não abre")
+                checks_done += 1
+                if scheduler is not None:
+                    scheduler.observe(source_group, 0)
+                continue
+
+            new_count = None
             try:
                 logger.info(f"🔹 {description}")
                 logger.info(f"   Verificando: {source_group}...")
 
-                await ensure_whatsapp_ready(page_w)
-                await open_chat(page_w, source_group)
-                await page_w.wait_for_timeout(BUBBLE_REFRESH_DELAY * 1000)
-
-                # 🔥 Captura o bubble ANTES de extrair texto/urls para garantir consistência
-                current_bubble = await get_last_message_bubble(page_w)
-                
-                text, hrefs = await extract_last_message_text_and_urls(page_w)
-                if text or hrefs:
-                    msg_id = compute_msg_id(text, hrefs)
-                    last_seen_id = last_seen_dict.get(source_group)
-                    if not last_seen_id:
-                        logger.info("   🆕 PRIMEIRA EXECUÇÃO - Enviando ÚLTIMA mensagem")
-                        ok = await process_new_message(
-                            page_w, page_m, ml_manager, text, hrefs, source_group, target_group, description,
-                            bubble=current_bubble  # 🔥 Passa o bubble específico
-                        )
-                        if ok:
-                            last_seen_dict[source_group] = msg_id
-                            preview = text[:50] if text else ""
-                            save_last_seen(msg_id, source_group, preview)
-                            logger.info(f"   💾 ID salvo: {msg_id[:16]}...")
-
-                            # First-test: forca rotacao apos envio
-                            if FIRST_TEST:
-                                prof_name = ml_manager.current_profile["name"]
-                                tested_profiles.add(prof_name)
-                                logger.info(f"   🧪 [FIRST-TEST] Perfil {prof_name} testado! Forcando rotacao...")
-                                await ml_manager.force_rotate()
-                        else:
-                            logger.warning("   ⚠️  Falhou enviar - ID NÃO salvo")
-                    elif msg_id != last_seen_id:
-                        logger.info("   🆕 MENSAGEM NOVA DETECTADA!")
-                        logger.info(f"   ID atual: {msg_id[:16]}...")
-                        logger.info(f"   ID anterior: {last_seen_id[:16]}...")
-                        ok = await process_new_message(
-                            page_w, page_m, ml_manager, text, hrefs, source_group, target_group, description,
-                            bubble=current_bubble  # 🔥 Passa o bubble específico
-                        )
-                        if ok:
-                            last_seen_dict[source_group] = msg_id
-                            preview = text[:50] if text else ""
-                            save_last_seen(msg_id, source_group, preview)
-                            logger.info(f"   💾 ID salvo: {msg_id[:16]}...")
-
-                            # First-test: forca rotacao apos envio
-                            if FIRST_TEST:
-                                prof_name = ml_manager.current_profile["name"]
-                                tested_profiles.add(prof_name)
-                                logger.info(f"   🧪 [FIRST-TEST] Perfil {prof_name} testado! Forcando rotacao...")
-                                await ml_manager.force_rotate()
-                        else:
-                            logger.warning("   ⚠️  Falhou enviar - ID NÃO salvo")
-                    else:
-                        logger.info("   ✅ Nenhuma mensagem nova")
-                else:
-                    logger.info("   ℹ️  Sem mensagens no grupo")
+                offers, new_count = await _detect_source(source_group, target_group, description)
+                # Base para o próximo pré-passo: lida antes de abrir, então uma
+                # mensagem que chegue no meio só causa uma abertura extra
+                if row is not None:
+                    chat_baseline[source_group] = row.signature
+                for offer in offers:
+                    # Fora do wa_lock: o envio precisa do page_w para esvaziar a fila
+                    await pipeline.submit(offer)
+                    logger.info(f"   📥 Oferta enfileirada (afiliados: {pipeline.affiliate_queue.qsize()})")
             except Exception as e:
                 logger.error(f"❌ Erro ao verificar {source_group}: {e}")
                 logger.error(traceback.format_exc())
+            checks_done += 1
+            if scheduler is not None:
+                scheduler.observe(source_group, new_count)
             await asyncio.sleep(2)
 
             # First-test: verifica se todos os perfis foram testados
@@ -457,61 +776,119 @@ async def monitoring_loop(page_w, page_m, ml_manager):
                     return True  # Sinaliza que deve parar
         return False  # Continua normalmente
 
-    while True:
-        try:
-            cycle_count += 1
+    pipeline.start()
+    try:
+        while True:
+            try:
+                cycle_count += 1
             
-            # ==========================================
-            # 🧹 LIMPEZA AUTOMÁTICA DE LOGS
-            # ==========================================
-            if LOG_CLEANUP_CYCLES > 0 and cycle_count % LOG_CLEANUP_CYCLES == 0:
-                logger.info(f"🧹 Iniciando limpeza de logs (Ciclo {cycle_count})...")
-                rotate_logs()
-
-            await wait_for_day_time()
-            logger.info("")
-            logger.info("=" * 80)
-            logger.info(f"🔄 CICLO #{cycle_count} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            logger.info("=" * 80)
-            logger.info("")
-            should_stop = await asyncio.wait_for(_check_all_sources(), timeout=CYCLE_TIMEOUT_SECONDS)
-
-            # First-test: encerra se todos os perfis foram testados
-            if should_stop:
-                break
+                sweeps = checks_done / max(1, len(CHANNEL_PAIRS))
+
+                # ==========================================
+                # 🧹 LIMPEZA AUTOMÁTICA DE LOGS
+                # ==========================================
+                if LOG_CLEANUP_CYCLES > 0 and sweeps >= (log_cleanups_done + 1) * LOG_CLEANUP_CYCLES:
+                    log_cleanups_done += 1
+                    logger.info(f"🧹 Iniciando limpeza de logs ({sweeps:.0f} varreduras)...")
+                    rotate_logs()
 
-            if RESTART_EVERY_CYCLES and cycle_count % RESTART_EVERY_CYCLES == 0:
-                logger.warning(
-                    f"🔁 Reinício preventivo a cada {RESTART_EVERY_CYCLES} ciclos (agora: {cycle_count})"
+                await wait_for_day_time()
+                logger.info("")
+                logger.info("=" * 80)
+                logger.info(f"🔄 CICLO #{cycle_count} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                if sources_to_check is not None:
+                    logger.info(f"   🎯 Apenas sources devidos/com atividade: {', '.join(sorted(sources_to_check))}")
+                logger.info("=" * 80)
+                logger.info("")
+                if activity is not None:
+                    # Eventos anteriores a este ciclo já são cobertos pela verificação;
+                    # os de sources fora desta rodada ficam vencidos no agendador
+                    events = activity.drain()
+                    if scheduler is not None and sources_to_check is not None:
+                        scheduler.mark_due(events - sources_to_check)
+                should_stop = await asyncio.wait_for(
+                    _check_all_sources(sources_to_check), timeout=CYCLE_TIMEOUT_SECONDS
                 )
-                raise RestartRequested("Periodic restart")
-
-            logger.info("")
-            logger.info("=" * 80)
-            random_minutes = random.randint(1, 6)
-            logger.info(f"⏸️  Ciclo completo! Pausando por {random_minutes} minutos...")
-            logger.info("=" * 80)
-            logger.info("")
-            await chunked_sleep(random_minutes * 60, SLEEP_GRANULARITY_SECONDS, label="Pausa")
-
-        except asyncio.TimeoutError:
-            logger.error(f"⏱️  Timeout no ciclo (>{CYCLE_TIMEOUT_SECONDS}s). Reiniciando contexto...")
-            raise RestartRequested("Cycle timeout")
-        except KeyboardInterrupt:
-            logger.info("")
-            logger.info("⚠️  Bot interrompido pelo usuário (Ctrl+C)")
-            break
-        except Exception as e:
-            logger.error(f"❌ Erro no loop principal: {e}")
-            logger.error(traceback.format_exc())
-            await asyncio.sleep(60)
+
+                # First-test: encerra se todos os perfis foram testados
+                if should_stop:
+                    break
+
+                pipeline.log_stats()
+
+                sweeps = checks_done / max(1, len(CHANNEL_PAIRS))
+                if RESTART_EVERY_CYCLES and sweeps >= RESTART_EVERY_CYCLES:
+                    # Deixa as ofertas em andamento terminarem antes de fechar o contexto
+                    try:
+                        await asyncio.wait_for(pipeline.join(), timeout=CYCLE_TIMEOUT_SECONDS)
+                    except asyncio.TimeoutError:
+                        logger.warning("⚠️  Pipeline não esvaziou a tempo - ofertas pendentes serão redetectadas")
+                    logger.warning(
+                        f"🔁 Reinício preventivo a cada {RESTART_EVERY_CYCLES} ciclos (agora: {sweeps:.0f} varreduras equivalentes)"
+                    )
+                    for line in selector_registry.summary():
+                        logger.info(f"   🧭 Seletores: {line}")
+                    raise RestartRequested("Periodic restart")
+
+                if scheduler is not None:
+                    scheduler.save()
+                    for line in scheduler.describe():
+                        logger.info(f"   📈 {line}")
+                    delay = max(SCHEDULER_MIN_SLEEP_SECONDS, scheduler.seconds_until_next())
+                    logger.info(f"⏸️  Próxima verificação em {delay:.0f}s")
+                    if activity is None:
+                        await chunked_sleep(delay, SLEEP_GRANULARITY_SECONDS, label="Pausa")
+                    elif await activity.wait(delay):
+                        debounce = random.uniform(*EVENT_DEBOUNCE_SECONDS)
+                        await asyncio.sleep(debounce)
+                        woke = activity.drain()
+                        scheduler.mark_due(woke)
+                        logger.info(f"🔔 Atividade em {len(woke)} source(s) - antecipando verificação")
+                    sources_to_check = set(scheduler.due_sources())
+                    continue
+
+                logger.info("")
+                logger.info("=" * 80)
+                random_minutes = random.randint(1, 6)
+                logger.info(f"⏸️  Ciclo completo! Pausando por {random_minutes} minutos...")
+                logger.info("=" * 80)
+                logger.info("")
+                if activity is None:
+                    await chunked_sleep(random_minutes * 60, SLEEP_GRANULARITY_SECONDS, label="Pausa")
+                    sources_to_check = None
+                elif await activity.wait(random_minutes * 60):
+                    debounce = random.uniform(*EVENT_DEBOUNCE_SECONDS)
+                    await asyncio.sleep(debounce)
+                    sources_to_check = activity.drain()
+                    logger.info(f"🔔 Atividade em {len(sources_to_check)} source(s) - antecipando ciclo")
+                else:
+                    sources_to_check = None
+
+            except asyncio.TimeoutError:
+                logger.error(f"⏱️  Timeout no ciclo (>{CYCLE_TIMEOUT_SECONDS}s). Reiniciando contexto...")
+                raise RestartRequested("Cycle timeout")
+            except KeyboardInterrupt:
+                logger.info("")
+                logger.info("⚠️  Bot interrompido pelo usuário (Ctrl+C)")
+                break
+            except Exception as e:
+                logger.error(f"❌ Erro no loop principal: {e}")
+                logger.error(traceback.format_exc())
+                await asyncio.sleep(60)
+    finally:
+        await pipeline.stop()
+        selector_registry.save(force=True)
 
 
 async def run():
     logger.info("🚀 Iniciando bot...")
     if FIRST_TEST:
         logger.info("🧪 MODO FIRST-TEST ativado via --first-test")
-    cleanup_temp_images(DOWNLOAD_DIR)
+    try:
+        removed = state_db.purge_expired()
+        logger.info(f"🗄️  Estado SQLite: {STATE_DB_PATH} ({removed} entradas de cache expiradas removidas)")
+    except Exception as e:
+        logger.warning(f"⚠️  Erro ao abrir estado SQLite: {e}")
     async with async_playwright() as p:
         logger.info(f"🔧 Chrome Profile: {CHROME_USER_DATA_DIR}")
         logger.info(f"🎭 Modo Headless: {HEADLESS}")
@@ -542,6 +919,9 @@ async def run():
                 logger.info("✅ WhatsApp pronto!")
 
                 page_m = await ctx.new_page()
+                # Só no page_m: o contexto principal também tem o WhatsApp
+                if await install_resource_blocking(page_m):
+                    logger.info("🚫 Bloqueio de imagens/CSS/trackers ativo no page_m")
                 logger.info("🛒 Abrindo Mercado Livre (Verificação)...")
                 try:
                     await page_m.goto(
@@ -568,6 +948,7 @@ async def run():
                 logger.info("")
 
                 ml_manager = MLRotationManager(p)
+                ml_manager.start()
                 await monitoring_loop(page_w, page_m, ml_manager)
 
                 break
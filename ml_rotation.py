@@ -1,12 +1,31 @@
+import os
 import time
+import asyncio
 import logging
-from config import ML_PROFILES, ML_ROTATION_MINUTES, HEADLESS
+from config import (
+    ML_PROFILES,
+    ML_ROTATION_MINUTES,
+    HEADLESS,
+    ML_WARM_STANDBY,
+    ML_MAX_RESIDENT_CONTEXTS,
+    ML_HEALTHCHECK_SECONDS,
+    ML_OPEN_RETRY_SECONDS,
+    ML_OPEN_RETRY_MAX_SECONDS,
+)
+from route_filter import install_resource_blocking
 
 logger = logging.getLogger("BotAfiliados")
 
 
 class MLRotationManager:
-    """Gerencia rotacao de perfis ML (multi-conta Mercado Livre)."""
+    """
+    Gerencia rotacao de perfis ML (multi-conta Mercado Livre).
+
+    Com ML_WARM_STANDBY os contextos dos perfis extras ficam abertos (até
+    ML_MAX_RESIDENT_CONTEXTS), verificados e logados em background; a rotação
+    só troca o ponteiro. Se o próximo perfil ainda não estiver pronto, a
+    rotação é adiada em vez de travar a geração de link num launch do Chrome.
+    """
 
     def __init__(self, playwright):
         self._pw = playwright
@@ -14,8 +33,16 @@ class MLRotationManager:
         self._rotation_seconds = ML_ROTATION_MINUTES * 60
         self._current_index = 0
         self._last_rotation = time.time()
-        self._ml_ctx = None    # contexto Playwright extra (perfis #2/#3)
-        self._ml_page = None   # page do contexto extra
+        # Contextos Playwright extras (perfis #2/#3): nome -> (context, page)
+        self._resident: dict[str, tuple] = {}
+        self._last_used: dict[str, float] = {}
+        self._opening: dict[str, asyncio.Task] = {}
+        self._unavailable: set[str] = set()  # sem diretório, sem login ou launch falhou
+        # Launch que falhou: nome -> (nº de falhas seguidas, próxima tentativa)
+        self._open_failures: dict[str, tuple[int, float]] = {}
+        self._serving = self._profiles[self._current_index]
+        self._last_healthcheck = time.time()
+        self._healthcheck_task: asyncio.Task | None = None
 
         prof = self._profiles[self._current_index]
         logger.info(f"[MLRotation] Perfil inicial: {prof['name']} (tag={prof['affiliate_tag'][:20]}...)")
@@ -24,97 +51,236 @@ class MLRotationManager:
     def current_profile(self) -> dict:
         return self._profiles[self._current_index]
 
+    @property
+    def serving_profile(self) -> dict:
+        """Perfil cuja sessão atendeu o último get_ml_page_and_tag (difere no fallback)."""
+        return self._serving
+
     def _should_rotate(self) -> bool:
         return (time.time() - self._last_rotation) >= self._rotation_seconds
 
-    async def _close_extra_context(self):
-        """Fecha contexto ML extra se houver."""
-        if self._ml_page is not None:
-            try:
-                await self._ml_page.close()
-            except Exception:
-                pass
-            self._ml_page = None
+    def _next_index(self) -> int:
+        return (self._current_index + 1) % len(self._profiles)
 
-        if self._ml_ctx is not None:
-            try:
-                await self._ml_ctx.close()
-            except Exception:
-                pass
-            self._ml_ctx = None
+    @staticmethod
+    def _is_extra(profile: dict) -> bool:
+        return not profile.get("uses_main_context", False)
+
+    def start(self):
+        """Modo warm standby: abre em background os perfis extras (respeitando o limite)."""
+        if not ML_WARM_STANDBY:
+            return
+        # Ordem de rotação a partir do perfil atual (que já pode estar servindo)
+        # e depois os próximos: o mais urgente abre primeiro
+        order = [
+            self._profiles[(self._current_index + i) % len(self._profiles)]
+            for i in range(len(self._profiles))
+        ]
+        extras = [p for p in order if self._is_extra(p)]
+        for prof in extras[:ML_MAX_RESIDENT_CONTEXTS]:
+            self._open_in_background(prof)
+
+    def _is_ready(self, profile: dict) -> bool:
+        if not self._is_extra(profile):
+            return True
+        entry = self._resident.get(profile["name"])
+        return entry is not None and not entry[1].is_closed()
+
+    async def _close_extra_context(self, name: str):
+        """Fecha contexto ML extra de um perfil, se houver."""
+        entry = self._resident.pop(name, None)
+        self._last_used.pop(name, None)
+        if entry is None:
+            return
+        ctx, page = entry
+        try:
+            await page.close()
+        except Exception:
+            pass
+        try:
+            await ctx.close()
+        except Exception:
+            pass
+
+    async def _evict_for(self, profile: dict):
+        """Libera espaço (LRU) para abrir `profile` sem estourar o limite de memória."""
+        keep = {self.current_profile["name"], profile["name"]}
+        while len(self._resident) >= max(1, ML_MAX_RESIDENT_CONTEXTS):
+            candidates = [n for n in self._resident if n not in keep]
+            if not candidates:
+                return
+            victim = min(candidates, key=lambda n: self._last_used.get(n, 0))
+            logger.info(f"[MLRotation] Limite de {ML_MAX_RESIDENT_CONTEXTS} contexto(s): fechando {victim}")
+            await self._close_extra_context(victim)
 
     async def _open_extra_context(self, profile: dict):
         """Abre contexto Playwright dedicado para perfil ML."""
-        import os
         user_data_dir = profile["user_data_dir"]
-        
+
         # Verifica se o diretório existe
         if not os.path.exists(user_data_dir):
             logger.error(f"[MLRotation] ❌ Diretório NÃO existe: {user_data_dir}")
             logger.error(f"[MLRotation] Execute 'python setup_login.py' para criar os perfis!")
+            self._unavailable.add(profile["name"])
             return
-        
+
+        await self._evict_for(profile)
         logger.info(f"[MLRotation] Abrindo {profile['name']} ({user_data_dir})...")
-        
-        self._ml_ctx = await self._pw.chromium.launch_persistent_context(
-            user_data_dir,
-            channel="chrome",
-            headless=HEADLESS,
-            args=[
-                f"--profile-directory={profile['profile_dir_name']}",
-                "--disable-blink-features=AutomationControlled",
-                "--disable-dev-shm-usage",
-                "--no-sandbox",
-                "--disable-setuid-sandbox",
-                "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            ],
-            ignore_default_args=["--enable-automation"],
-        )
-        self._ml_page = self._ml_ctx.pages[0] if self._ml_ctx.pages else await self._ml_ctx.new_page()
+
+        try:
+            ctx = await self._launch_context(profile)
+        except Exception as e:
+            self._mark_open_failed(profile["name"], e)
+            raise
+        self._open_failures.pop(profile["name"], None)
+        # Contexto dedicado ao ML: filtro vale para todas as pages dele
+        await install_resource_blocking(ctx)
+        page = ctx.pages[0] if ctx.pages else await ctx.new_page()
+        self._resident[profile["name"]] = (ctx, page)
+        self._last_used[profile["name"]] = time.time()
 
         # Navega para ML afiliados para garantir sessao ativa
         try:
-            await self._ml_page.goto(
+            await page.goto(
                 "https://www.mercadolivre.com.br/afiliados",
                 wait_until="domcontentloaded",
                 timeout=60000,
             )
             # Verifica se está logado checando a URL final
-            final_url = self._ml_page.url
+            final_url = page.url
             if "login" in final_url.lower():
+                self._unavailable.add(profile["name"])
                 logger.warning(f"[MLRotation] ⚠️ {profile['name']} NÃO está logado!")
             else:
+                self._unavailable.discard(profile["name"])
                 logger.info(f"[MLRotation] ✅ {profile['name']} pronto!")
         except Exception as e:
             logger.warning(f"[MLRotation] Erro ao abrir {profile['name']}: {e}")
 
-    async def _rotate(self):
-        """Avanca para o proximo perfil ML."""
-        from affiliate import clear_csrf_cache
+    def _mark_open_failed(self, name: str, error: Exception):
+        """Launch falhou: indisponível até a próxima tentativa (backoff exponencial)."""
+        failures = self._open_failures.get(name, (0, 0.0))[0] + 1
+        delay = min(ML_OPEN_RETRY_MAX_SECONDS, ML_OPEN_RETRY_SECONDS * 2 ** (failures - 1))
+        self._open_failures[name] = (failures, time.time() + delay)
+        self._unavailable.add(name)
+        logger.warning(f"[MLRotation] ⚠️ {name} não abriu ({error}) - nova tentativa em {delay / 60:.0f} min")
 
+    def _can_try_open(self, name: str) -> bool:
+        failure = self._open_failures.get(name)
+        return failure is None or time.time() >= failure[1]
+
+    async def _launch_context(self, profile: dict):
+        return await self._pw.chromium.launch_persistent_context(
+            profile["user_data_dir"],
+            channel="chrome",
+            headless=HEADLESS,
+            args=[
+                f"--profile-directory={profile['profile_dir_name']}",
+                "--disable-blink-features=AutomationControlled",
+                "--disable-dev-shm-usage",
+                "--no-sandbox",
+                "--disable-setuid-sandbox",
+                "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            ],
+            ignore_default_args=["--enable-automation"],
+        )
+
+    def _open_in_background(self, profile: dict):
+        """Agenda abertura do contexto sem bloquear quem chamou."""
+        name = profile["name"]
+        if not self._is_extra(profile) or self._is_ready(profile):
+            return
+        if not os.path.exists(profile["user_data_dir"]):
+            self._unavailable.add(name)
+            return
+        task = self._opening.get(name)
+        if task is not None and not task.done():
+            return
+        if not self._can_try_open(name):
+            return
+
+        async def _open():
+            try:
+                await self._open_extra_context(profile)
+            except Exception as e:
+                logger.warning(f"[MLRotation] Falha ao abrir {name} em background: {e}")
+
+        self._opening[name] = asyncio.create_task(_open())
+
+    async def _health_check(self):
+        """Verifica contextos residentes; descarta os mortos e reabre em background."""
+        for name, (ctx, page) in list(self._resident.items()):
+            healthy = False
+            try:
+                if not page.is_closed():
+                    await asyncio.wait_for(page.evaluate("1"), timeout=10)
+                    healthy = True
+            except Exception:
+                pass
+            if not healthy:
+                logger.warning(f"[MLRotation] ⚠️ Contexto {name} não respondeu - reabrindo")
+                await self._close_extra_context(name)
+                prof = next((p for p in self._profiles if p["name"] == name), None)
+                if prof is not None:
+                    self._open_in_background(prof)
+
+    def _maybe_health_check(self):
+        if time.time() - self._last_healthcheck < ML_HEALTHCHECK_SECONDS:
+            return
+        if self._healthcheck_task is not None and not self._healthcheck_task.done():
+            return
+        self._last_healthcheck = time.time()
+        self._healthcheck_task = asyncio.create_task(self._health_check())
+
+    async def _rotate(self, wait: bool = False):
+        """Avanca para o proximo perfil ML."""
         old_name = self._profiles[self._current_index]["name"]
+        new_index = self._next_index()
+        new_prof = self._profiles[new_index]
+
+        if ML_WARM_STANDBY and not self._is_ready(new_prof) and new_prof["name"] not in self._unavailable:
+            self._open_in_background(new_prof)
+            if not wait:
+                # Não trava a oferta atual: tenta de novo na próxima chamada
+                logger.info(f"[MLRotation] {new_prof['name']} ainda abrindo - rotacao adiada")
+                return
+            task = self._opening.get(new_prof["name"])
+            if task is not None:
+                await task
 
-        # Fecha contexto extra anterior
-        await self._close_extra_context()
+        if not ML_WARM_STANDBY and self._is_extra(self.current_profile):
+            # Modo frio: fecha contexto extra anterior
+            await self._close_extra_context(old_name)
 
         # Avanca indice circular
-        self._current_index = (self._current_index + 1) % len(self._profiles)
+        self._current_index = new_index
         self._last_rotation = time.time()
 
-        # Limpa CSRF cache (token do perfil anterior nao serve)
-        clear_csrf_cache()
+        # CSRF é guardado por perfil (affiliate._CSRF_STORE): nada a limpar aqui
 
-        new_prof = self._profiles[self._current_index]
         logger.info(f"[MLRotation] Rotacao: {old_name} -> {new_prof['name']} (tag={new_prof['affiliate_tag'][:20]}...)")
 
-        # Se o novo perfil nao usa contexto principal, abre contexto dedicado
-        if not new_prof.get("uses_main_context", False):
+        if ML_WARM_STANDBY:
+            # Já prepara o seguinte enquanto este serve
+            self._open_in_background(self._profiles[self._next_index()])
+        elif self._is_extra(new_prof):
+            # Se o novo perfil nao usa contexto principal, abre contexto dedicado
             await self._open_extra_context(new_prof)
 
     async def force_rotate(self):
         """Forca rotacao imediata (usado no modo first-test)."""
         logger.info("[MLRotation] Rotacao forcada (first-test)...")
-        await self._rotate()
+        await self._rotate(wait=True)
+
+    def peek_profile_and_tag(self) -> tuple[str, str]:
+        """
+        (nome, tag) do perfil que atenderia agora, sem rotacionar nem abrir
+        contexto - para consultar o cache de links antes de pegar a página.
+        """
+        prof = self._profiles[self._current_index]
+        if self._is_extra(prof) and (not self._is_ready(prof) or prof["name"] in self._unavailable):
+            prof = next((p for p in self._profiles if not self._is_extra(p)), prof)
+        return prof["name"], prof["affiliate_tag"]
 
     async def get_ml_page_and_tag(self, page_m_main):
         """
@@ -123,25 +289,50 @@ class MLRotationManager:
         - Se perfil atual usa contexto principal, retorna page_m_main.
         - Senao, retorna page do contexto dedicado.
         """
+        if ML_WARM_STANDBY:
+            self._maybe_health_check()
+
         if self._should_rotate():
             await self._rotate()
 
         prof = self._profiles[self._current_index]
 
-        if prof.get("uses_main_context", False):
+        if not self._is_extra(prof):
+            self._serving = prof
             return page_m_main, prof["affiliate_tag"]
 
         # Perfil dedicado: garante que contexto esta aberto
-        if self._ml_page is None:
-            await self._open_extra_context(prof)
+        if not self._is_ready(prof):
+            if ML_WARM_STANDBY:
+                self._open_in_background(prof)
+            elif self._can_try_open(prof["name"]):
+                try:
+                    await self._open_extra_context(prof)
+                except Exception:
+                    pass  # já marcado indisponível; segue no fallback
 
-        if self._ml_page is None:
-            logger.error(f"[MLRotation] ❌ Contexto dedicado não foi criado! Usando fallback")
-            return page_m_main, prof["affiliate_tag"]
-            
-        return self._ml_page, prof["affiliate_tag"]
+        if not self._is_ready(prof) or prof["name"] in self._unavailable:
+            # Fallback: sessão do contexto principal, com a tag do perfil principal
+            main_prof = next((p for p in self._profiles if not self._is_extra(p)), prof)
+            logger.error(f"[MLRotation] ❌ Contexto dedicado de {prof['name']} indisponível! Usando fallback {main_prof['name']}")
+            self._serving = main_prof
+            return page_m_main, main_prof["affiliate_tag"]
+
+        self._serving = prof
+        self._last_used[prof["name"]] = time.time()
+        return self._resident[prof["name"]][1], prof["affiliate_tag"]
 
     async def close(self):
         """Fecha tudo (chamado no shutdown/restart)."""
-        await self._close_extra_context()
+        pending = [
+            task for task in list(self._opening.values()) + [self._healthcheck_task]
+            if task is not None and not task.done()
+        ]
+        for task in pending:
+            task.cancel()
+        # Espera o cancelamento: um launch em andamento pode registrar o contexto
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._opening.clear()
+        for name in list(self._resident):
+            await self._close_extra_context(name)
         logger.info("[MLRotation] Contextos ML extras fechados.")
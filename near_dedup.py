@@ -0,0 +1,286 @@
+"""
+Detecção de ofertas quase duplicadas (mesma promoção com outra redação,
+outros gatilhos ou emojis).
+
+Cada legenda normalizada vira uma assinatura MinHash (NEAR_DUP_NUM_PERM
+mínimos) sobre shingles de palavras; a fração de posições iguais estima a
+similaridade de Jaccard. A assinatura é cortada em faixas (LSH): só as
+legendas que caem no mesmo balde em alguma faixa são comparadas, então a
+busca não percorre o índice todo. Entradas expiram junto com a janela de
+dedup e ficam no estado SQLite.
+"""
+
+import hashlib
+import heapq
+import random
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+
+import state_db
+from config import (
+    GATILHOS,
+    NEAR_DUP_ENABLED,
+    NEAR_DUP_MIN_JACCARD,
+    NEAR_DUP_MIN_TOKENS,
+    NEAR_DUP_NUM_PERM,
+    NEAR_DUP_BANDS,
+)
+from dedup import (
+    DEDUP_WINDOW_SECONDS,
+    DEDUP_COMPACT_SECONDS,
+    DEDUP_RESERVATION_TTL_SECONDS,
+    _extract_product_id,
+)
+
+# Hash universal (a*x + b) mod primo de Mersenne; sementes fixas para que as
+# assinaturas salvas continuem comparáveis entre execuções
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NEAR_DUP_NUM_PERM)
+]
+_ROWS_PER_BAND = NEAR_DUP_NUM_PERM // NEAR_DUP_BANDS
+
+URL_RE = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _strip_accents(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch))
+
+
+_GATILHO_TEXTS = [
+    NON_WORD_RE.sub(" ", _strip_accents(g).lower()).strip() for g in GATILHOS
+]
+
+
+def normalize_caption(text: str) -> list[str]:
+    """
+    Tokens da legenda sem o que varia entre repostagens: links, emojis,
+    pontuação/markdown, acentos, caixa e gatilhos do config.
+    """
+    text = URL_RE.sub(" ", text or "")
+    text = _strip_accents(text).lower()
+    text = NON_WORD_RE.sub(" ", text)
+    for gatilho in _GATILHO_TEXTS:
+        if gatilho:
+            text = text.replace(gatilho, " ")
+    return text.split()
+
+
+def _shingles(tokens: list[str]) -> set[str]:
+    """Palavras + pares de palavras vizinhas (legendas são curtas)."""
+    return set(tokens) | {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+
+
+def minhash(tokens: list[str]) -> tuple[int, ...]:
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for shingle in _shingles(tokens)
+    ]
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def similarity(sig_a: tuple[int, ...], sig_b: tuple[int, ...]) -> float:
+    """Jaccard estimado: fração de mínimos iguais."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+def _bands(signature: tuple[int, ...]) -> list[tuple[int, tuple[int, ...]]]:
+    return [
+        (i, signature[i * _ROWS_PER_BAND:(i + 1) * _ROWS_PER_BAND])
+        for i in range(NEAR_DUP_BANDS)
+    ]
+
+
+def _pack(signature: tuple[int, ...]) -> bytes:
+    return b"".join(v.to_bytes(8, "big") for v in signature)
+
+
+def _unpack(blob: bytes) -> tuple[int, ...]:
+    return tuple(int.from_bytes(blob[i:i + 8], "big") for i in range(0, len(blob), 8))
+
+
+@dataclass
+class NearDupEntry:
+    target: str
+    signature: tuple[int, ...]
+    product_id: str | None
+    sent_at: float
+    pending: bool = False  # oferta ainda no pipeline (não enviada)
+
+    def expired_reservation(self, now: float) -> bool:
+        """Reserva pendente além do TTL (a oferta nunca saiu do pipeline)."""
+        return self.pending and now - self.sent_at >= DEDUP_RESERVATION_TTL_SECONDS
+
+
+class NearDupIndex:
+    """Índice MinHash + LSH por target, com expiração pela janela de dedup."""
+
+    def __init__(
+        self,
+        window_seconds: int = DEDUP_WINDOW_SECONDS,
+        min_jaccard: float = NEAR_DUP_MIN_JACCARD,
+    ):
+        self.window_seconds = window_seconds
+        self.min_jaccard = min_jaccard
+        self._entries: dict[int, NearDupEntry] = {}
+        self._buckets: dict[tuple, set[int]] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._next_id = 1
+        self._last_compact = time.time()
+        self._load()
+
+    def _load(self):
+        try:
+            rows = state_db.near_dedup_load(time.time() - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar índice de quase-duplicatas: {e}")
+            rows = []
+        for target, blob, product_id, sent_at in rows:
+            signature = _unpack(blob)
+            if len(signature) == NEAR_DUP_NUM_PERM:  # ignora assinaturas de outra configuração
+                self._insert(NearDupEntry(target, signature, product_id, sent_at))
+
+    def _insert(self, entry: NearDupEntry) -> int:
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        for band in _bands(entry.signature):
+            self._buckets.setdefault((entry.target, *band), set()).add(entry_id)
+        heapq.heappush(self._heap, (entry.sent_at + self.window_seconds, entry_id))
+        return entry_id
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for band in _bands(entry.signature):
+            key = (entry.target, *band)
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def find(self, target: str, signature: tuple[int, ...], product_id: str | None) -> NearDupEntry | None:
+        self._maybe_compact()
+        now = time.time()
+        candidates: set[int] = set()
+        for band in _bands(signature):
+            candidates |= self._buckets.get((target, *band), set())
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if now - entry.sent_at >= self.window_seconds or entry.expired_reservation(now):
+                continue
+            # Produtos conhecidos e diferentes nunca são a mesma oferta
+            if product_id and entry.product_id and product_id != entry.product_id:
+                continue
+            if similarity(signature, entry.signature) >= self.min_jaccard:
+                return entry
+        return None
+
+    def reserve(self, target: str, signature: tuple[int, ...], product_id: str | None) -> int:
+        return self._insert(NearDupEntry(target, signature, product_id, time.time(), pending=True))
+
+    def confirm(self, entry_id: int):
+        entry = self._entries.get(entry_id)
+        if entry is None or not entry.pending:
+            return
+        entry.pending = False
+        entry.sent_at = time.time()
+        heapq.heappush(self._heap, (entry.sent_at + self.window_seconds, entry_id))
+        try:
+            state_db.near_dedup_put(entry.target, _pack(entry.signature), entry.product_id, entry.sent_at)
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar índice de quase-duplicatas: {e}")
+
+    def release(self, entry_id: int):
+        entry = self._entries.get(entry_id)
+        if entry is not None and entry.pending:
+            self._remove(entry_id)
+
+    def _maybe_compact(self):
+        if time.time() - self._last_compact >= DEDUP_COMPACT_SECONDS:
+            self.compact()
+
+    def compact(self):
+        now = time.time()
+        self._last_compact = now
+        while self._heap and self._heap[0][0] <= now:
+            _, entry_id = heapq.heappop(self._heap)
+            entry = self._entries.get(entry_id)
+            # Pendentes saem pelo release/confirm (ou pelo TTL); confirmadas têm
+            # expiração nova no heap
+            if entry is None:
+                continue
+            if entry.expired_reservation(now) or (
+                not entry.pending and entry.sent_at + self.window_seconds <= now
+            ):
+                self._remove(entry_id)
+        try:
+            state_db.near_dedup_purge(now - self.window_seconds)
+        except Exception as e:
+            print(f"⚠️ Erro ao compactar índice de quase-duplicatas: {e}")
+
+
+_index: NearDupIndex | None = None
+
+
+def _get_index() -> NearDupIndex:
+    global _index
+    if _index is None:
+        _index = NearDupIndex()
+    return _index
+
+
+def _signature(text: str, urls: list[str]) -> tuple[tuple[int, ...], str | None] | None:
+    tokens = normalize_caption(text)
+    if len(tokens) < NEAR_DUP_MIN_TOKENS:
+        return None  # legenda curta demais para comparar com segurança
+    return minhash(tokens), _extract_product_id(urls)
+
+
+def is_near_duplicate(target_group: str, text: str, urls: list[str]) -> bool:
+    """True se uma legenda parecida foi enviada (ou está indo) para o target."""
+    if not NEAR_DUP_ENABLED:
+        return False
+    signature = _signature(text, urls)
+    if signature is None:
+        return False
+    match = _get_index().find(target_group, *signature)
+    if match is None:
+        return False
+    age_min = int((time.time() - match.sent_at) / 60)
+    state = "na fila de envio" if match.pending else f"enviada há {age_min} min"
+    print(f"   🔄 QUASE DUPLICADA! Legenda parecida {state} para {target_group}.")
+    return True
+
+
+def reserve(target_group: str, text: str, urls: list[str]) -> int | None:
+    """Registra a legenda enquanto a oferta atravessa o pipeline. RETORNA: id (ou None)."""
+    if not NEAR_DUP_ENABLED:
+        return None
+    signature = _signature(text, urls)
+    if signature is None:
+        return None
+    return _get_index().reserve(target_group, *signature)
+
+
+def confirm(entry_id: int | None):
+    """Envio bem-sucedido: a entrada passa a valer pela janela e vai para o disco."""
+    if entry_id is not None:
+        _get_index().confirm(entry_id)
+
+
+def release(entry_id: int | None):
+    """Oferta descartada/falhou: remove a reserva (no-op se já confirmada)."""
+    if entry_id is not None:
+        _get_index().release(entry_id)
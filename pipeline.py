@@ -0,0 +1,282 @@
+"""
+Pipeline em estágios para ofertas: detecção → afiliado → envio.
+
+A detecção (loop de monitoramento, dona do page_w enquanto lê o source)
+coloca Offers na fila de afiliados; o estágio de afiliados trabalha no
+page_m/páginas de rotação e o estágio de envio é dono do page_w para
+upload. Assim o afiliado da oferta B roda enquanto a oferta A é enviada.
+Filas limitadas dão backpressure: se o envio atrasar, a detecção espera.
+
+O estágio de envio junta ofertas prontas do mesmo target e envia o lote
+numa única visita ao chat. Enquanto ainda há ofertas chegando do
+afiliado ele segura o lote (até batch_size ofertas ou max_hold segundos);
+com o pipeline vazio envia na hora, sem latência extra.
+"""
+
+import asyncio
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+logger = logging.getLogger("BotAfiliados")
+
+
+@dataclass
+class Offer:
+    """Uma mensagem de source pronta para virar oferta no target."""
+
+    source_name: str
+    target_name: str
+    description: str
+    msg_id: str
+    text: str
+    hrefs: list[str]
+    image: dict | None = None  # payload em memória {"name", "mimeType", "buffer"}
+    final_text: str = ""  # preenchido pelo estágio de afiliados
+    seq: int = 0  # ordem de detecção (o last-seen só avança)
+    dedup_urls: list[str] = field(default_factory=list)  # URLs com links curtos já resolvidos
+    dedup_reserved: bool = False  # reservou a chave de dedup no estágio de afiliados
+    near_dup_id: int | None = None  # reserva no índice de quase-duplicatas
+    image_hash: int | None = None  # dHash da imagem (calculado na detecção)
+    image_dup_id: int | None = None  # reserva no índice de hashes de imagem
+    detected_at: float = field(default_factory=time.time)
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.source_name, self.msg_id)
+
+
+class StageStats:
+    """Contadores de vazão/tempo de um estágio."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.max_depth = 0
+        self.started_at = time.time()
+
+    def record(self, ok: bool, elapsed: float):
+        self.processed += 1
+        if not ok:
+            self.failed += 1
+        self.busy_seconds += elapsed
+
+    def observe_depth(self, depth: int):
+        self.max_depth = max(self.max_depth, depth)
+
+    def summary(self, depth: int) -> str:
+        minutes = max(1e-6, (time.time() - self.started_at) / 60)
+        avg = self.busy_seconds / self.processed if self.processed else 0.0
+        return (
+            f"{self.name:<9} | {self.processed} itens ({self.failed} falhas) | "
+            f"{self.processed / minutes:.2f}/min | média {avg:.1f}s | "
+            f"fila {depth} (máx {self.max_depth})"
+        )
+
+
+class OfferPipeline:
+    """
+    Orquestra os estágios com asyncio.Queue limitadas.
+
+    - affiliate_handler(offer) -> bool: True = tratada (se offer.final_text
+      foi preenchido segue para envio; senão é ignorada), False = falha.
+    - send_handler(offers) -> list[bool]: envia um lote do mesmo target,
+      na ordem, e devolve o resultado de cada oferta.
+    - on_done(offer, ok): chamado uma vez por oferta ao sair do pipeline.
+    """
+
+    def __init__(
+        self,
+        affiliate_handler: Callable[[Offer], Awaitable[bool]],
+        send_handler: Callable[[list[Offer]], Awaitable[list[bool]]],
+        on_done: Callable[[Offer, bool], Awaitable[None]],
+        maxsize: int = 8,
+        batch_size: int = 1,
+        max_hold: float = 0.0,
+    ):
+        self._affiliate_handler = affiliate_handler
+        self._send_handler = send_handler
+        self._on_done = on_done
+        self.batch_size = max(1, batch_size)
+        self.max_hold = max(0.0, max_hold)
+        self.affiliate_queue: asyncio.Queue[Offer] = asyncio.Queue(maxsize=maxsize)
+        self.send_queue: asyncio.Queue[Offer] = asyncio.Queue(maxsize=maxsize)
+        self.stats = {
+            "detect": StageStats("detecção"),
+            "affiliate": StageStats("afiliado"),
+            "send": StageStats("envio"),
+        }
+        self._in_flight: set[tuple[str, str]] = set()
+        # Toda oferta entre submit() e on_done (inclusive a que um estágio está
+        # processando): stop() entrega as que sobrarem ao on_done
+        self._offers: dict[tuple[str, str], Offer] = {}
+        self._tasks: list[asyncio.Task] = []
+        # Lotes segurados pelo envio: target -> ofertas (ordem de chegada)
+        self._held: dict[str, list[Offer]] = {}
+        self._held_since: dict[str, float] = {}
+        self._affiliate_busy = False
+        self.batches = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._affiliate_worker(), name="pipeline-affiliate"),
+            asyncio.create_task(self._send_worker(), name="pipeline-send"),
+        ]
+
+    async def stop(self):
+        """
+        Cancela os estágios. Ofertas que ainda não saíram (filas, lotes
+        segurados, em processamento) passam pelo on_done com ok=False: as
+        reservas de dedup são liberadas e elas serão redetectadas.
+        """
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tasks = []
+        for queue in (self.affiliate_queue, self.send_queue):
+            while not queue.empty():
+                queue.get_nowait()
+                queue.task_done()
+        self._held.clear()
+        self._held_since.clear()
+        for offer in list(self._offers.values()):
+            await self._finish(offer, False)
+        self._in_flight.clear()
+
+    def is_in_flight(self, source_name: str, msg_id: str) -> bool:
+        return (source_name, msg_id) in self._in_flight
+
+    async def submit(self, offer: Offer):
+        """Enfileira a oferta. Bloqueia (backpressure) se o estágio de afiliados estiver cheio."""
+        t0 = time.perf_counter()
+        self._in_flight.add(offer.key)
+        self._offers[offer.key] = offer
+        await self.affiliate_queue.put(offer)
+        self.stats["detect"].record(True, time.perf_counter() - t0)
+        self.stats["affiliate"].observe_depth(self.affiliate_queue.qsize())
+
+    async def join(self):
+        """Aguarda todas as ofertas enfileiradas saírem do pipeline."""
+        await self.affiliate_queue.join()
+        await self.send_queue.join()
+
+    def log_stats(self):
+        logger.info("📊 Pipeline:")
+        depths = {
+            "detect": 0,
+            "affiliate": self.affiliate_queue.qsize(),
+            "send": self.send_queue.qsize(),
+        }
+        for key, stats in self.stats.items():
+            logger.info(f"   {stats.summary(depths[key])}")
+        if self.batch_size > 1 and self.batches:
+            sent = self.stats["send"].processed
+            logger.info(f"   lotes     | {self.batches} visitas ao chat | {sent / self.batches:.1f} ofertas/visita")
+
+    async def _affiliate_worker(self):
+        while True:
+            offer = await self.affiliate_queue.get()
+            self._affiliate_busy = True
+            try:
+                t0 = time.perf_counter()
+                try:
+                    ok = await self._affiliate_handler(offer)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"   ❌ [pipeline/afiliado] {offer.source_name}: {e}")
+                    ok = False
+                self.stats["affiliate"].record(ok, time.perf_counter() - t0)
+
+                if ok and offer.final_text:
+                    # Backpressure: espera vaga no envio antes de pegar a próxima oferta
+                    await self.send_queue.put(offer)
+                    self.stats["send"].observe_depth(self.send_queue.qsize())
+                else:
+                    await self._finish(offer, ok)
+            finally:
+                self._affiliate_busy = False
+                self.affiliate_queue.task_done()
+
+    def _upstream_idle(self) -> bool:
+        """Nada mais a caminho do envio: segurar o lote só atrasaria."""
+        return self.send_queue.empty() and self.affiliate_queue.empty() and not self._affiliate_busy
+
+    def _ready_targets(self) -> list[str]:
+        now = time.monotonic()
+        idle = self._upstream_idle()
+        ready = [
+            target for target, batch in self._held.items()
+            if idle
+            or len(batch) >= self.batch_size
+            or now - self._held_since[target] >= self.max_hold
+        ]
+        return sorted(ready, key=lambda t: self._held_since[t])
+
+    def _next_wait(self) -> float | None:
+        """Quanto esperar por mais ofertas antes de reavaliar os lotes (None = sem lote)."""
+        if not self._held:
+            return None
+        deadline = min(self._held_since.values()) + self.max_hold
+        # Reavalia com frequência: o afiliado pode ficar ocioso antes do prazo
+        return max(0.0, min(deadline - time.monotonic(), 0.5))
+
+    async def _send_worker(self):
+        while True:
+            wait = self._next_wait()
+            try:
+                if wait is None:
+                    offer = await self.send_queue.get()
+                else:
+                    offer = await asyncio.wait_for(self.send_queue.get(), timeout=wait)
+                self._held.setdefault(offer.target_name, []).append(offer)
+                self._held_since.setdefault(offer.target_name, time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+
+            for target in self._ready_targets():
+                batch = self._held.pop(target)
+                self._held_since.pop(target, None)
+                await self._send_batch(batch)
+
+    async def _send_batch(self, batch: list[Offer]):
+        t0 = time.perf_counter()
+        try:
+            try:
+                results = list(await self._send_handler(batch))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"   ❌ [pipeline/envio] {batch[0].target_name}: {e}")
+                results = []
+            results += [False] * (len(batch) - len(results))
+            self.batches += 1
+            elapsed = (time.perf_counter() - t0) / len(batch)
+            for offer, ok in zip(batch, results):
+                self.stats["send"].record(ok, elapsed)
+                await self._finish(offer, ok)
+        finally:
+            for _ in batch:
+                self.send_queue.task_done()
+
+    async def _finish(self, offer: Offer, ok: bool):
+        try:
+            await self._on_done(offer, ok)
+        except Exception as e:
+            logger.error(f"   ❌ [pipeline] Erro ao finalizar oferta de {offer.source_name}: {e}")
+        finally:
+            self._discard(offer)
+
+    def _discard(self, offer: Offer):
+        self._in_flight.discard(offer.key)
+        self._offers.pop(offer.key, None)
+        offer.image = None  # libera o buffer da imagem
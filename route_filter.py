@@ -0,0 +1,75 @@
+"""
+Interceptação de requests (page.route) nas páginas de afiliados ML/Amazon.
+
+Essas páginas só servem para ler uma URL ou um valor do DOM, então
+imagens, mídia, fontes, CSS e trackers são abortados. Exceções por
+plataforma (ROUTE_ALLOWLIST) liberam tipos específicos em páginas que
+precisam renderizar, como o botão "Ir para produto" do minutoreview.
+"""
+
+import re
+from urllib.parse import urlparse
+
+from config import (
+    ROUTE_BLOCKING_ENABLED,
+    ROUTE_BLOCK_RESOURCE_TYPES,
+    ROUTE_BLOCKED_HOSTS,
+    ROUTE_ALLOWLIST,
+)
+
+_ALLOWLIST = [(re.compile(pattern, re.IGNORECASE), set(types)) for pattern, types in ROUTE_ALLOWLIST]
+_BLOCK_TYPES = set(ROUTE_BLOCK_RESOURCE_TYPES)
+
+
+def _is_blocked_host(url: str) -> bool:
+    host = (urlparse(url).hostname or "").lower()
+    return any(host == h or host.endswith("." + h) for h in ROUTE_BLOCKED_HOSTS)
+
+
+def _allowed_types_for(page_url: str) -> set[str]:
+    allowed: set[str] = set()
+    for pattern, types in _ALLOWLIST:
+        if pattern.search(page_url or ""):
+            allowed |= types
+    return allowed
+
+
+def should_block(url: str, resource_type: str, page_url: str = "") -> bool:
+    """Decide se um request deve ser abortado."""
+    if _is_blocked_host(url):
+        return True
+    if resource_type not in _BLOCK_TYPES:
+        return False
+    return resource_type not in _allowed_types_for(page_url)
+
+
+async def _handle_route(route):
+    request = route.request
+    try:
+        page_url = request.frame.url
+    except Exception:
+        page_url = ""
+
+    try:
+        if should_block(request.url, request.resource_type, page_url):
+            await route.abort()
+        else:
+            await route.continue_()
+    except Exception:
+        # Página/contexto fechado no meio do request
+        pass
+
+
+async def install_resource_blocking(target) -> bool:
+    """
+    Instala o filtro em uma Page ou BrowserContext.
+    Use Page para o page_m (o contexto principal também tem o WhatsApp).
+    """
+    if not ROUTE_BLOCKING_ENABLED:
+        return False
+    try:
+        await target.route("**/*", _handle_route)
+        return True
+    except Exception as e:
+        print(f" ⚠️ Não foi possível instalar bloqueio de recursos: {e}")
+        return False
@@ -0,0 +1,204 @@
+"""
+Agendador adaptativo de verificação por source.
+
+Cada source tem sua própria próxima verificação. A taxa de mensagens de
+cada grupo é estimada por hora do dia (24 baldes com decaimento
+exponencial) e as aberturas de chat são distribuídas proporcionalmente a
+sqrt(taxa), que minimiza a latência média por mensagem para um total fixo
+de aberturas. O total nunca passa do orçamento do ciclo antigo: todos os
+sources a cada SCHEDULER_BUDGET_CYCLE_SECONDS.
+"""
+
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime
+from pathlib import Path
+
+from config import (
+    SCHEDULER_BUDGET_CYCLE_SECONDS,
+    SCHEDULER_MIN_INTERVAL_SECONDS,
+    SCHEDULER_MAX_INTERVAL_SECONDS,
+    SCHEDULER_JITTER,
+    SCHEDULER_HALF_LIFE_DAYS,
+    SCHEDULER_PRIOR_RATE_PER_HOUR,
+    SCHEDULER_PRIOR_HOURS,
+    SCHEDULER_HOUR_SMOOTHING_HOURS,
+    SCHEDULER_MAX_GAP_SECONDS,
+)
+
+SCHEDULER_STATS_FILE = Path("scheduler_stats.json")
+HOURS_PER_DAY = 24
+
+
+def _hour_segments(start: float, end: float) -> list[tuple[int, float]]:
+    """Quebra o intervalo [start, end) em (hora_do_dia, segundos)."""
+    segments = []
+    t = start
+    while t < end:
+        dt = datetime.fromtimestamp(t)
+        next_hour = dt.replace(minute=0, second=0, microsecond=0).timestamp() + 3600
+        seg_end = min(end, next_hour)
+        segments.append((dt.hour, seg_end - t))
+        t = seg_end
+    return segments
+
+
+class SourceScheduler:
+    """Decide quando cada source deve ser verificado."""
+
+    def __init__(self, sources: list[str], path: Path = SCHEDULER_STATS_FILE):
+        self._sources = list(sources)
+        self._path = Path(path)
+        # source -> {"arrivals": [24], "exposure": [24] (horas), "updated_at": ts}
+        self._stats: dict[str, dict] = {}
+        self._last_check: dict[str, float] = {}
+        # 0 = vencido: a primeira rodada verifica todos (varredura inicial)
+        self._next_due: dict[str, float] = {s: 0.0 for s in self._sources}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not self._path.exists():
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for source, entry in (data or {}).items():
+                if len(entry.get("arrivals", [])) == HOURS_PER_DAY and len(entry.get("exposure", [])) == HOURS_PER_DAY:
+                    self._stats[source] = entry
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar estatísticas do agendador: {e}")
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            tmp = self._path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False)
+            os.replace(tmp, self._path)
+            self._dirty = False
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar estatísticas do agendador: {e}")
+
+    def _entry(self, source: str) -> dict:
+        if source not in self._stats:
+            self._stats[source] = {
+                "arrivals": [0.0] * HOURS_PER_DAY,
+                "exposure": [0.0] * HOURS_PER_DAY,
+                "updated_at": time.time(),
+            }
+        return self._stats[source]
+
+    @staticmethod
+    def _decay(entry: dict, now: float):
+        """Envelhece os contadores (meia-vida SCHEDULER_HALF_LIFE_DAYS)."""
+        elapsed = now - entry.get("updated_at", now)
+        if elapsed > 0:
+            factor = 0.5 ** (elapsed / (SCHEDULER_HALF_LIFE_DAYS * 86400))
+            entry["arrivals"] = [a * factor for a in entry["arrivals"]]
+            entry["exposure"] = [e * factor for e in entry["exposure"]]
+        entry["updated_at"] = now
+
+    def observe(self, source: str, new_messages: int | None, now: float | None = None):
+        """
+        Registra uma verificação do source e agenda a próxima.
+        new_messages=None (erro na verificação) só reagenda.
+        """
+        now = now or time.time()
+        last = self._last_check.get(source)
+        self._last_check[source] = now
+
+        # Janelas longas (noite, restart) não entram: as chegadas não têm hora conhecida
+        if new_messages is not None and last is not None and 0 < now - last <= SCHEDULER_MAX_GAP_SECONDS:
+            entry = self._entry(source)
+            self._decay(entry, now)
+            total = now - last
+            for hour, seconds in _hour_segments(last, now):
+                entry["exposure"][hour] += seconds / 3600
+                entry["arrivals"][hour] += new_messages * seconds / total
+            self._dirty = True
+
+        self._schedule(source, now)
+
+    def rate(self, source: str, now: float | None = None) -> float:
+        """Taxa estimada (msgs/hora) do source na hora do dia atual."""
+        now = now or time.time()
+        entry = self._stats.get(source)
+        prior = SCHEDULER_PRIOR_RATE_PER_HOUR * SCHEDULER_PRIOR_HOURS
+        if not entry:
+            return SCHEDULER_PRIOR_RATE_PER_HOUR
+        overall = (sum(entry["arrivals"]) + prior) / (sum(entry["exposure"]) + SCHEDULER_PRIOR_HOURS)
+        hour = datetime.fromtimestamp(now).hour
+        k = SCHEDULER_HOUR_SMOOTHING_HOURS
+        # Balde da hora puxado para a média geral quando tem pouca observação
+        return (entry["arrivals"][hour] + k * overall) / (entry["exposure"][hour] + k)
+
+    def _intervals(self, now: float) -> dict[str, float]:
+        """Intervalo alvo por source: frequência ∝ sqrt(taxa), dentro do orçamento."""
+        if not self._sources:
+            return {}
+        budget = len(self._sources) / SCHEDULER_BUDGET_CYCLE_SECONDS  # aberturas/segundo
+        weights = {s: math.sqrt(max(self.rate(s, now), 1e-3)) for s in self._sources}
+        intervals: dict[str, float] = {}
+        free = set(self._sources)
+
+        while free:
+            total_weight = sum(weights[s] for s in free)
+            wanted = {
+                s: (total_weight / (budget * weights[s])) if budget > 0 else SCHEDULER_MAX_INTERVAL_SECONDS
+                for s in free
+            }
+            # Quem bate num limite fica fixo e consome seu orçamento; o resto é redistribuído
+            bound = SCHEDULER_MIN_INTERVAL_SECONDS
+            clamped = [s for s, interval in wanted.items() if interval < bound]
+            if not clamped:
+                bound = SCHEDULER_MAX_INTERVAL_SECONDS
+                clamped = [s for s, interval in wanted.items() if interval > bound]
+            if not clamped:
+                intervals.update(wanted)
+                break
+            for s in clamped:
+                intervals[s] = bound
+                budget -= 1 / bound
+                free.discard(s)
+            if budget <= 0:
+                for s in free:
+                    intervals[s] = SCHEDULER_MAX_INTERVAL_SECONDS
+                break
+        return intervals
+
+    def _schedule(self, source: str, now: float):
+        interval = self._intervals(now).get(source, SCHEDULER_BUDGET_CYCLE_SECONDS)
+        # Jitter mantém o padrão de uso com cara de humano
+        interval *= random.uniform(1 - SCHEDULER_JITTER, 1 + SCHEDULER_JITTER)
+        self._next_due[source] = now + max(SCHEDULER_MIN_INTERVAL_SECONDS, interval)
+
+    def mark_due(self, sources):
+        """Antecipa sources (ex.: evento de mensagem nova na lista de chats)."""
+        for source in sources or ():
+            if source in self._next_due:
+                self._next_due[source] = 0.0
+
+    def due_sources(self, now: float | None = None) -> list[str]:
+        now = now or time.time()
+        due = [s for s in self._sources if self._next_due.get(s, 0.0) <= now]
+        return sorted(due, key=lambda s: self._next_due.get(s, 0.0))
+
+    def seconds_until_next(self, now: float | None = None) -> float:
+        now = now or time.time()
+        if not self._next_due:
+            return SCHEDULER_BUDGET_CYCLE_SECONDS
+        return max(0.0, min(self._next_due.values()) - now)
+
+    def describe(self, now: float | None = None) -> list[str]:
+        now = now or time.time()
+        intervals = self._intervals(now)
+        return [
+            f"{s}: {self.rate(s, now):.1f} msg/h → a cada ~{intervals.get(s, 0):.0f}s "
+            f"(próxima em {max(0.0, self._next_due.get(s, 0.0) - now):.0f}s)"
+            for s in self._sources
+        ]
@@ -0,0 +1,113 @@
+"""
+Registro adaptativo de seletores com fallback.
+
+Cada grupo de candidatos (ex.: "wa.attach") guarda, por seletor, acertos e
+tentativas com decaimento (o histórico recente pesa mais) e a latência
+média. `ordered()` devolve os candidatos do mais confiável para o menos,
+então quando o WhatsApp/ML muda o DOM o seletor que passou a funcionar
+sobe para o topo e os mortos deixam de custar timeout em todo envio.
+O ranking é salvo em disco e sobrevive a reinícios.
+
+Só entram aqui grupos em que TODO candidato aponta para o mesmo elemento
+(ex.: o botão de anexo). Listas em ordem de prioridade (foto do bubble,
+imagem do produto) ficam fora: reordenar por acerto deixaria um candidato
+errado, mas que sempre acha algo, no topo para sempre.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from config import SELECTOR_STATS_DECAY, SELECTOR_STATS_SAVE_SECONDS
+
+SELECTOR_STATS_FILE = Path("selector_stats.json")
+
+
+class SelectorRegistry:
+    """Estatísticas de hit/miss/latência por (grupo, seletor)."""
+
+    def __init__(self, path: Path = SELECTOR_STATS_FILE):
+        self._path = Path(path)
+        # grupo -> seletor -> {"hits", "tries", "latency", "last_hit", "total_hits", "total_tries"}
+        self._stats: dict[str, dict[str, dict]] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self):
+        if not self._path.exists():
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as f:
+                self._stats = json.load(f) or {}
+        except Exception as e:
+            print(f"⚠️ Erro ao carregar ranking de seletores: {e}")
+
+    def save(self, force: bool = False):
+        if not self._dirty:
+            return
+        if not force and time.time() - self._last_save < SELECTOR_STATS_SAVE_SECONDS:
+            return
+        try:
+            tmp = self._path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, self._path)
+            self._dirty = False
+            self._last_save = time.time()
+        except Exception as e:
+            print(f"⚠️ Erro ao salvar ranking de seletores: {e}")
+
+    def _score(self, group: str, selector: str) -> float:
+        entry = self._stats.get(group, {}).get(selector)
+        if not entry:
+            return 0.5  # nunca testado: prior neutro
+        # Laplace: (acertos + 1) / (tentativas + 2), com contagens decaídas
+        return (entry["hits"] + 1) / (entry["tries"] + 2)
+
+    def ordered(self, group: str, candidates: list[str]) -> list[str]:
+        """Candidatos do mais confiável para o menos (empate mantém a ordem original)."""
+        index = {c: i for i, c in enumerate(candidates)}
+        return sorted(candidates, key=lambda c: (-self._score(group, c), index[c]))
+
+    def record(self, group: str, selector: str, ok: bool, latency: float):
+        """Registra uma tentativa (latência em segundos, inclusive de falhas)."""
+        entry = self._stats.setdefault(group, {}).setdefault(
+            selector,
+            {"hits": 0.0, "tries": 0.0, "latency": 0.0, "last_hit": 0.0, "total_hits": 0, "total_tries": 0},
+        )
+        entry["hits"] = entry["hits"] * SELECTOR_STATS_DECAY + (1 if ok else 0)
+        entry["tries"] = entry["tries"] * SELECTOR_STATS_DECAY + 1
+        # Média móvel exponencial da latência
+        entry["latency"] = latency if entry["total_tries"] == 0 else 0.8 * entry["latency"] + 0.2 * latency
+        entry["total_tries"] += 1
+        if ok:
+            entry["total_hits"] += 1
+            entry["last_hit"] = time.time()
+        self._dirty = True
+        self.save()
+
+    def stats(self, group: str | None = None) -> dict:
+        """Cópia das estatísticas (de um grupo ou de todos)."""
+        if group is not None:
+            return {sel: dict(entry) for sel, entry in self._stats.get(group, {}).items()}
+        return {g: {sel: dict(e) for sel, e in sels.items()} for g, sels in self._stats.items()}
+
+    def summary(self) -> list[str]:
+        """Uma linha por grupo: seletor líder, taxa de acerto recente e latência."""
+        lines = []
+        for group, selectors in sorted(self._stats.items()):
+            ranked = self.ordered(group, list(selectors))
+            best = ranked[0]
+            entry = selectors[best]
+            dead = sum(1 for s in selectors.values() if s["total_tries"] and not s["total_hits"])
+            lines.append(
+                f"{group:<16} | líder: {best[:50]} "
+                f"({self._score(group, best):.0%}, {entry['latency'] * 1000:.0f} ms) | "
+                f"{len(selectors)} candidatos, {dead} sem acerto"
+            )
+        return lines
+
+
+registry = SelectorRegistry()
@@ -1,15 +1,29 @@
 # sender_whatsapp.py - VERSÃO QUE FUNCIONAVA (RECUPERADA)
 
 import asyncio
-from pathlib import Path
-from config import GROUP_LINK
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from config import (
+    GROUP_LINK,
+    CAPTION_FAST_INSERT,
+    SEND_CONFIRM_BUBBLE_TIMEOUT_MS,
+    SEND_CONFIRM_ACK_TIMEOUT_MS,
+    DIRECT_FILE_INPUT_UPLOAD,
+)
 from watcher import open_chat
+from selector_registry import registry as selector_registry
+from waits import pause, wait_for_state, wait_for_dom_stable
+
+
+MESSAGE_BOX_SELECTOR = "footer div[contenteditable='true'][role='textbox']"
 
 
 async def _wait_message_box(page):
     """Aguarda a caixa de mensagem estar disponível"""
     candidates = [
-        page.locator("footer div[contenteditable='true'][role='textbox']").last,
+        page.locator(MESSAGE_BOX_SELECTOR).last,
         page.locator("div[contenteditable='true'][data-tab='10']").last,
     ]
     
@@ -23,6 +37,251 @@ async def _wait_message_box(page):
     raise RuntimeError("Não achei a caixa de mensagem do WhatsApp.")
 
 
+# --- CONFIRMAÇÃO DE ENVIO (BOLHA DE SAÍDA + ÍCONE DE ACK) ---
+
+# Última bolha enviada do chat aberto: data-id e estado do ícone
+# (msg-time = relógio/upload, msg-check = enviada, msg-dblcheck* = entregue/lida)
+_LAST_OUTGOING_JS = """
+() => {
+    const outs = document.querySelectorAll('div.message-out');
+    if (!outs.length) return null;
+    const b = outs[outs.length - 1];
+    const holder = b.closest('[data-id]') || b.querySelector('[data-id]');
+    const icons = Array.from(b.querySelectorAll('span[data-icon]'))
+        .map(el => el.getAttribute('data-icon') || '');
+    let ack = 'unknown';
+    if (icons.some(i => i.startsWith('msg-dblcheck'))) ack = 'delivered';
+    else if (icons.some(i => i === 'msg-check')) ack = 'sent';
+    else if (icons.some(i => i === 'msg-time' || i.includes('clock'))) ack = 'pending';
+    return {id: holder ? (holder.getAttribute('data-id') || '') : '', ack};
+}
+"""
+
+
+@dataclass
+class SendResult:
+    """Resultado de um envio de imagem + legenda."""
+
+    ok: bool
+    status: str  # delivered | sent | pending | not_sent | error
+    method: str | None = None  # método que gerou a bolha
+    data_id: str | None = None  # data-id da bolha enviada
+    attempts: int = 0
+    upload_seconds: float | None = None  # do Enter até o ícone sair do relógio
+    total_seconds: float = 0.0
+    error: str | None = None
+
+
+async def _read_last_outgoing(page) -> dict | None:
+    try:
+        return await page.evaluate(_LAST_OUTGOING_JS)
+    except Exception:
+        return None
+
+
+async def _confirm_outgoing(page, baseline_id: str | None) -> tuple[str, str | None, float | None]:
+    """
+    Observa a bolha nova depois do Enter.
+    RETORNA: (status, data_id, segundos até o ack) - status not_sent se
+    nenhuma bolha nova apareceu no prazo, pending se o upload não terminou.
+    """
+    started = time.monotonic()
+    bubble_deadline = started + SEND_CONFIRM_BUBBLE_TIMEOUT_MS / 1000
+    ack_deadline = started + SEND_CONFIRM_ACK_TIMEOUT_MS / 1000
+    while True:
+        info = await _read_last_outgoing(page)
+        now = time.monotonic()
+        if info and info.get("id") and info["id"] != baseline_id:
+            # Sem relógio = saiu do aparelho (ícone desconhecido conta como enviada)
+            if info.get("ack") != "pending":
+                return ("delivered" if info.get("ack") == "delivered" else "sent"), info["id"], now - started
+            if now >= ack_deadline:
+                return "pending", info["id"], None
+        elif now >= bubble_deadline:
+            return "not_sent", None, None
+        await asyncio.sleep(0.15)
+
+
+# --- UPLOAD DA IMAGEM ---
+
+# Marca o input de arquivo oculto de "Fotos e vídeos": accept com imagem e
+# vídeo (o de figurinha só aceita imagem, o de documento aceita tudo)
+_MARK_MEDIA_INPUT_JS = """
+() => {
+    document.querySelectorAll('input[data-bot-upload]').forEach(el => el.removeAttribute('data-bot-upload'));
+    const inputs = Array.from(document.querySelectorAll('input[type="file"]'))
+        .filter(el => (el.getAttribute('accept') || '').includes('image/'));
+    const media = inputs.find(el => (el.getAttribute('accept') || '').includes('video/'));
+    const target = media || inputs.find(el => !(el.getAttribute('accept') || '').includes('webp'));
+    if (!target) return false;
+    target.setAttribute('data-bot-upload', '1');
+    return true;
+}
+"""
+
+def _upload_strategies() -> list[str]:
+    if DIRECT_FILE_INPUT_UPLOAD:
+        return ["input_direto", "menu_anexar"]
+    return ["menu_anexar"]
+
+
+# Editor de mídia aberto: campo de legenda = editável fora do compositor
+# (#main footer) e da busca (#side). Com `preview`, a miniatura blob: fora
+# dos painéis também conta (editor abrindo, legenda ainda não montada).
+_MEDIA_EDITOR_JS = """
+({preview}) => {
+    const shown = (el) => {
+        const r = el.getBoundingClientRect();
+        return r.width > 0 && r.height > 0;
+    };
+    for (const el of document.querySelectorAll('[contenteditable="true"]')) {
+        if (!el.closest('#main footer, #side') && shown(el)) return true;
+    }
+    if (!preview) return false;
+    for (const el of document.querySelectorAll('img[src^="blob:"]')) {
+        if (!el.closest('#main, #side') && shown(el)) return true;
+    }
+    return false;
+}
+"""
+
+
+async def _upload_via_hidden_input(page, image: dict) -> bool:
+    """
+    Sobe a imagem direto no input[type=file] oculto do WhatsApp, sem abrir
+    o menu Anexar. RETORNA: True se o editor de mídia abriu.
+    """
+    print(" [1-2/4] Upload direto no input de arquivo...")
+    if not await page.evaluate(_MARK_MEDIA_INPUT_JS):
+        print(" ⊗ Input de imagem não está no DOM")
+        return False
+
+    await page.locator("input[data-bot-upload]").first.set_files(image)
+    try:
+        # Editor de mídia aberto = apareceu o campo de legenda dele
+        await page.wait_for_function(_MEDIA_EDITOR_JS, arg={"preview": False}, timeout=3000)
+    except Exception:
+        # Editor abrindo atrasado faria o menu anexar uma segunda imagem: fecha.
+        # Sem editor na tela, Escape fecharia o chat - então não aperta.
+        try:
+            editor_open = await page.evaluate(_MEDIA_EDITOR_JS, {"preview": True})
+        except Exception:
+            editor_open = False
+        if editor_open:
+            await page.keyboard.press("Escape")
+        print(" ⊗ Editor de mídia não abriu pelo input direto")
+        return False
+
+    print(" ✓ Upload via input direto (sem menu)")
+    return True
+
+
+async def _upload_via_menu(page, image: dict):
+    """Caminho antigo: botão Anexar → "Fotos e vídeos" → file chooser."""
+    # ============================================
+    # [1/4] CLICAR NO BOTÃO ANEXAR (REFORÇADO)
+    # ============================================
+    print(" [1/4] Procurando botão Anexar...")
+    
+    attach_selectors = [
+        'div[title="Anexar"]',
+        'button[aria-label="Anexar"]',
+        'span[data-icon="plus"]',
+        'span[data-icon="attach-menu-plus"]',
+        'div[aria-label="Anexar"]',
+        'button[title="Anexar"]',
+        'div[role="button"]:has(span[data-icon="plus"])',
+    ]
+    
+    attach_clicked = False
+    # Ordem pelo histórico: o seletor que funcionou por último vem primeiro
+    for sel in selector_registry.ordered("wa.attach", attach_selectors):
+        started = time.perf_counter()
+        try:
+            attach = page.locator(sel).first
+            if await attach.count() > 0:
+                await attach.click(timeout=3000)
+                attach_clicked = True
+        except Exception:
+            pass
+        selector_registry.record("wa.attach", sel, attach_clicked, time.perf_counter() - started)
+        if attach_clicked:
+            # Menu de anexos terminou de abrir
+            await wait_for_dom_stable(page, timeout_ms=1500)
+            print(f" ✓ Clicou em Anexar ({sel})")
+            break
+    
+    if not attach_clicked:
+        print(" ✗ Botão Anexar não encontrado!")
+        raise RuntimeError("Botão Anexar não encontrado")
+    
+    # ============================================
+    # [2/4] CLICAR EM "FOTOS E VÍDEOS" + UPLOAD (MÉTODO QUE FUNCIONAVA)
+    # ============================================
+    print(" [2/4] Procurando 'Fotos e vídeos'...")
+    
+    photo_selectors = [
+        'button[aria-label*="Fotos"]',
+        'li[aria-label*="Fotos"]',
+        'span:text-is("Fotos e vídeos")',
+        'span:has-text("Fotos e vídeos")',
+        'input[accept="image/*,video/mp4,video/3gpp,video/quicktime"]',
+        'span[data-icon="image"]',
+        'li:has-text("Fotos e vídeos")',
+        'button:has-text("Fotos")',
+        'div[role="button"]:has-text("Fotos")',
+    ]
+    
+    # Ordem fixa: a lista mistura o item do menu e o <input> escondido,
+    # que são elementos diferentes, então fica fora do registro de seletores
+    photo_clicked = False
+    for sel in photo_selectors:
+        photo_clicked = await _try_photo_selector(page, sel, image)
+        if photo_clicked:
+            break
+    
+    if not photo_clicked:
+        print(" ✗ 'Fotos e vídeos' não encontrado!")
+        raise RuntimeError("Botão 'Fotos e vídeos' não encontrado")
+
+
+async def _try_photo_selector(page, sel: str, image: dict) -> bool:
+    """Tenta um seletor de "Fotos e vídeos" e faz o upload. RETORNA: True se subiu."""
+    try:
+        # ✅ SE FOR INPUT FILE, USA DIRETO
+        if 'input[accept' in sel:
+            file_input = page.locator(sel).first
+            if await file_input.count() == 0:
+                return False
+            await file_input.set_files(image)
+            print(f" ✓ Upload via input file")
+            return True
+
+        # ✅ MÉTODO QUE FUNCIONAVA: expect_file_chooser
+        elem = page.locator(sel).first
+        if await elem.count() == 0:
+            return False
+
+        # Verifica se não é "Figurinhas"
+        try:
+            txt = await elem.inner_text(timeout=500)
+            if txt and "figurinha" in txt.lower():
+                return False
+        except Exception:
+            pass
+
+        # ✅ CLICA E CAPTURA FILE CHOOSER
+        async with page.expect_file_chooser(timeout=5000) as fc:
+            await elem.click(timeout=2000)
+            file_chooser = await fc.value
+            await file_chooser.set_files(image)
+
+        print(f" ✓ Upload via file chooser ({sel})")
+        return True
+    except Exception:
+        return False
+
+
 async def send_text_message(
     page,
     target_chat: str,
@@ -49,17 +308,11 @@ async def send_text_message(
         else:
             full_text = text
         
-        lines = full_text.split("\n")
-        for i, line in enumerate(lines):
-            if line:
-                await box.type(line, delay=2)
-            if i < len(lines) - 1:
-                await box.press("Shift+Enter")
-                await page.wait_for_timeout(15)
+        await _insert_caption(page, box, full_text, delay=2)
         
         await page.wait_for_timeout(100)
         await page.keyboard.press("Enter")
-        await page.wait_for_timeout(500)
+        await pause()
         
         return True
     
@@ -68,6 +321,93 @@ async def send_text_message(
         return False
 
 
+# Diferenças que o editor introduz sem mudar a legenda: espaços/quebras,
+# caracteres de largura zero e o seletor de variação dos emojis (U+FE0F)
+_CAPTION_NOISE_RE = re.compile(r"[\s\u200b-\u200d\u2060\ufeff\ufe0e\ufe0f]+")
+
+
+def _normalize_caption(text: str) -> str:
+    return _CAPTION_NOISE_RE.sub("", unicodedata.normalize("NFC", text or ""))
+
+
+def _caption_matches(expected: str, actual: str) -> bool:
+    """Confere se o campo tem exatamente a legenda (ignorando espaços/quebras)."""
+    exp = _normalize_caption(expected)
+    return bool(exp) and _normalize_caption(actual) == exp
+
+
+# Texto do campo com os emojis: o WhatsApp os renderiza como <img alt="😀">,
+# que o inner_text ignora
+_FIELD_TEXT_JS = """
+(el) => {
+    let text = '';
+    const walk = (node) => {
+        if (node.nodeType === 3) {
+            text += node.textContent;
+        } else if (node.nodeType === 1) {
+            if (node.tagName === 'IMG') {
+                text += node.getAttribute('alt') || '';
+            } else if (node.tagName === 'BR') {
+                text += '\\n';
+            } else {
+                node.childNodes.forEach(walk);
+            }
+        }
+    };
+    walk(el);
+    return text;
+}
+"""
+
+
+async def _read_field_text(field) -> str:
+    """Conteúdo do campo editável, incluindo o alt dos emojis."""
+    try:
+        return await field.evaluate(_FIELD_TEXT_JS)
+    except Exception:
+        return await field.inner_text()
+
+
+async def _paste_text(field, text: str):
+    """Insere o texto inteiro com um único paste sintético (mantém \\n, *negrito*, emoji)."""
+    await field.evaluate(
+        """
+        (el, text) => {
+            el.focus();
+            const data = new DataTransfer();
+            data.setData('text/plain', text);
+            el.dispatchEvent(new ClipboardEvent('paste', {
+                clipboardData: data,
+                bubbles: true,
+                cancelable: true,
+            }));
+        }
+        """,
+        text,
+    )
+
+
+async def _insert_caption(page, field, text: str, delay: int = 10):
+    """
+    Insere a legenda: paste sintético (rápido) verificado pelo conteúdo do
+    campo; se não conferir, limpa e digita linha a linha (caminho antigo).
+    """
+    if CAPTION_FAST_INSERT:
+        try:
+            await _paste_text(field, text)
+            await page.wait_for_timeout(150)
+            if _caption_matches(text, await _read_field_text(field)):
+                print(" ⚡ Legenda inserida via paste")
+                return
+            print(" ⊗ Paste incompleto - voltando para digitação")
+            await field.press("Control+A")
+            await field.press("Backspace")
+        except Exception as e:
+            print(f" ⊗ Paste falhou ({str(e)[:40]}) - voltando para digitação")
+
+    await _type_with_line_breaks(field, text, delay=delay)
+
+
 async def _type_with_line_breaks(locator_or_page, text: str, delay: int = 5):
     """Digita texto convertendo \n em Shift+Enter"""
     lines = text.split("\n")
@@ -86,29 +426,56 @@ async def _type_with_line_breaks(locator_or_page, text: str, delay: int = 5):
 async def send_image_with_caption(
     page,
     target_chat: str,
-    image_path: str,
+    image: dict,
     caption: str,
     target_group: str = None,
     page_ml=None,
     max_retries: int = 3,
-) -> bool:
+    skip_open_chat: bool = False,
+) -> SendResult:
     """
     🔥 Imagem + Legenda em 1 bolha - VERSÃO QUE FUNCIONAVA ONTEM
+
+    `image` é o payload em memória {"name", "mimeType", "buffer"} devolvido
+    por download_image_from_bubble; vai direto para o set_files, sem disco.
+    O envio só conta quando a bolha nova aparece no chat (ver SendResult).
+    skip_open_chat=True reaproveita o chat já aberto (lote para o mesmo
+    target); os retries sempre reabrem.
     """
+    started = time.monotonic()
+    baseline_id = None  # última bolha enviada antes da primeira tentativa
+    baseline_read = False
+    last_error = None
     
     for attempt in range(max_retries):
         try:
-            if not image_path or not Path(image_path).exists():
-                print(f"✗ Arquivo não existe: {image_path}")
-                return False
+            if not image or not image.get("buffer"):
+                print(f"✗ Imagem vazia/ausente")
+                return SendResult(ok=False, status="error", error="imagem vazia/ausente")
             
-            img = Path(image_path).resolve()
             print(f"\n🔥 [{attempt+1}/{max_retries}] Enviando imagem + legenda")
-            print(f" → {img.name}")
+            print(f" → {image['name']} ({image['mimeType']}, {len(image['buffer']) // 1024} KB)")
             print(f" → {len(caption)} chars ({caption.count(chr(10))} quebras)")
             
-            await open_chat(page, target_chat)
-            await page.wait_for_timeout(1500)
+            if not (skip_open_chat and attempt == 0):
+                await open_chat(page, target_chat)
+            await wait_for_state(page, MESSAGE_BOX_SELECTOR, "visible", timeout_ms=1500)
+            
+            # Leitura estrita: sem baseline confiável qualquer bolha antiga pareceria nova
+            outgoing = await page.evaluate(_LAST_OUTGOING_JS)
+            if not baseline_read:
+                baseline_id = outgoing.get("id") if outgoing else None
+                baseline_read = True
+            elif outgoing and outgoing.get("id") and outgoing["id"] != baseline_id:
+                # A tentativa anterior enviou depois do prazo: reenviar duplicaria
+                print(" ✓ Bolha da tentativa anterior apareceu no chat - sem reenviar")
+                return SendResult(
+                    ok=True,
+                    status="sent" if outgoing.get("ack") != "pending" else "pending",
+                    data_id=outgoing["id"],
+                    attempts=attempt,
+                    total_seconds=time.monotonic() - started,
+                )
             
             # Adiciona link do grupo no final da legenda
             if GROUP_LINK:
@@ -117,105 +484,33 @@ async def send_image_with_caption(
                 full_caption = caption
             
             # ============================================
-            # [1/4] CLICAR NO BOTÃO ANEXAR (REFORÇADO)
+            # [1-2/4] ANEXAR IMAGEM (INPUT DIRETO OU MENU)
             # ============================================
-            print(" [1/4] Procurando botão Anexar...")
-            
-            attach_selectors = [
-                'div[title="Anexar"]',
-                'button[aria-label="Anexar"]',
-                'span[data-icon="plus"]',
-                'span[data-icon="attach-menu-plus"]',
-                'div[aria-label="Anexar"]',
-                'button[title="Anexar"]',
-                'div[role="button"]:has(span[data-icon="plus"])',
-            ]
-            
-            attach_clicked = False
-            for sel in attach_selectors:
+            uploaded = False
+            for strategy in selector_registry.ordered("wa.upload", _upload_strategies()):
+                t0 = time.perf_counter()
                 try:
-                    attach = page.locator(sel).first
-                    if await attach.count() > 0:
-                        await attach.click(timeout=3000)
-                        await page.wait_for_timeout(1500)
-                        print(f" ✓ Clicou em Anexar ({sel})")
-                        attach_clicked = True
-                        break
-                except Exception:
-                    continue
-            
-            if not attach_clicked:
-                print(" ✗ Botão Anexar não encontrado!")
-                raise RuntimeError("Botão Anexar não encontrado")
-            
-            # ============================================
-            # [2/4] CLICAR EM "FOTOS E VÍDEOS" + UPLOAD (MÉTODO QUE FUNCIONAVA)
-            # ============================================
-            print(" [2/4] Procurando 'Fotos e vídeos'...")
-            
-            photo_selectors = [
-                'button[aria-label*="Fotos"]',
-                'li[aria-label*="Fotos"]',
-                'span:text-is("Fotos e vídeos")',
-                'span:has-text("Fotos e vídeos")',
-                'input[accept="image/*,video/mp4,video/3gpp,video/quicktime"]',
-                'span[data-icon="image"]',
-                'li:has-text("Fotos e vídeos")',
-                'button:has-text("Fotos")',
-                'div[role="button"]:has-text("Fotos")',
-            ]
-            
-            photo_clicked = False
-            for sel in photo_selectors:
-                try:
-                    # ✅ SE FOR INPUT FILE, USA DIRETO
-                    if 'input[accept' in sel:
-                        file_input = page.locator(sel).first
-                        if await file_input.count() > 0:
-                            await file_input.set_files(str(img))
-                            print(f" ✓ Upload via input file")
-                            photo_clicked = True
-                            break
+                    if strategy == "input_direto":
+                        uploaded = await _upload_via_hidden_input(page, image)
                     else:
-                        # ✅ MÉTODO QUE FUNCIONAVA: expect_file_chooser
-                        elem = page.locator(sel).first
-                        if await elem.count() == 0:
-                            continue
-                        
-                        # Verifica se não é "Figurinhas"
-                        try:
-                            txt = await elem.inner_text(timeout=500)
-                            if txt and "figurinha" in txt.lower():
-                                continue
-                        except Exception:
-                            pass
-                        
-                        # ✅ CLICA E CAPTURA FILE CHOOSER
-                        try:
-                            async with page.expect_file_chooser(timeout=5000) as fc:
-                                await elem.click(timeout=2000)
-                                file_chooser = await fc.value
-                                await file_chooser.set_files(str(img))
-                            
-                            print(f" ✓ Upload via file chooser ({sel})")
-                            photo_clicked = True
-                            break
-                        except Exception:
-                            continue
-                
+                        await _upload_via_menu(page, image)
+                        uploaded = True
                 except Exception as e:
-                    continue
+                    print(f" ⚠️ Upload ({strategy}) falhou: {str(e)[:80]}")
+                selector_registry.record("wa.upload", strategy, uploaded, time.perf_counter() - t0)
+                if uploaded:
+                    break
             
-            if not photo_clicked:
-                print(" ✗ 'Fotos e vídeos' não encontrado!")
-                raise RuntimeError("Botão 'Fotos e vídeos' não encontrado")
+            if not uploaded:
+                raise RuntimeError("Não conseguiu anexar a imagem")
             
             # ============================================
             # [3/4] INSERIR LEGENDA COM QUEBRAS DE LINHA
             # ============================================
             print(" [3/4] Inserindo legenda...")
             
-            await page.wait_for_timeout(2500)
+            # Editor de mídia renderizado (preview + campo de legenda)
+            await wait_for_dom_stable(page, timeout_ms=2500)
             
             caption_inserted = False
             caption_field_used = None
@@ -250,19 +545,23 @@ async def send_image_with_caption(
                         except Exception:
                             pass
                         
-                        # Digita legenda
-                        await _type_with_line_breaks(field, full_caption, delay=10)
-                        await page.wait_for_timeout(1000)
+                        # Insere legenda (paste rápido, digitação como fallback)
+                        await _insert_caption(page, field, full_caption, delay=10)
+                        await page.wait_for_timeout(300)
                         
-                        # Verifica se funcionou
-                        text_check = await field.inner_text()
+                        # Verifica se funcionou: o campo tem que ter a legenda inteira
+                        text_check = await _read_field_text(field)
                         text_len = len(text_check.strip())
                         
-                        if text_len > 20:
+                        if _caption_matches(full_caption, text_check):
                             print(f" ✅ Legenda inserida: {text_len} chars")
                             caption_inserted = True
                             caption_field_used = field
                             break
+                        elif text_len:
+                            print(f" ⊗ Campo #{i} com legenda diferente ({text_len} chars) - limpando")
+                            await field.press("Control+A", timeout=500)
+                            await field.press("Backspace", timeout=500)
                         else:
                             print(f" ⊗ Campo #{i} vazio após digitação")
                     
@@ -285,7 +584,7 @@ async def send_image_with_caption(
                             await page.keyboard.press("Shift+Enter")
                             await page.wait_for_timeout(50)
                     
-                    await page.wait_for_timeout(1000)
+                    await pause()
                     print(" ✓ Legenda digitada via keyboard")
                     caption_inserted = True
                 except Exception as e:
@@ -299,49 +598,50 @@ async def send_image_with_caption(
             # ============================================
             print(" [4/4] Enviando...")
             
-            await page.wait_for_timeout(1000)
+            await pause()
             
-            sent = False
-            
-            # Método 1: Enter no campo
+            methods = []
             if caption_field_used:
-                try:
-                    await caption_field_used.press("Enter")
-                    await page.wait_for_timeout(2500)
-                    print(" ✓ Enviado via Enter no campo")
-                    sent = True
-                except Exception as e:
-                    print(f" ⚠️ Enter no campo falhou: {e}")
-            
-            # Método 2: Enter global
-            if not sent:
-                try:
-                    await page.keyboard.press("Enter")
-                    await page.wait_for_timeout(2500)
-                    print(" ✓ Enviado via Enter global")
-                    sent = True
-                except Exception as e:
-                    print(f" ⚠️ Enter global falhou: {e}")
+                methods.append(("Enter no campo", lambda: caption_field_used.press("Enter")))
+            methods.append(("Enter global", lambda: page.keyboard.press("Enter")))
+            methods.append((
+                "botão Send",
+                lambda: page.locator('span[data-icon="send"]').last.click(force=True, timeout=3000),
+            ))
             
-            # Método 3: Botão Send
-            if not sent:
+            # Cada método só conta se a bolha nova aparecer no chat
+            for method, action in methods:
                 try:
-                    send = page.locator('span[data-icon="send"]').last
-                    await send.click(force=True, timeout=3000)
-                    await page.wait_for_timeout(2500)
-                    print(" ✓ Enviado via botão Send")
-                    sent = True
+                    await action()
                 except Exception as e:
-                    print(f" ⚠️ Botão Send falhou: {e}")
-            
-            if not sent:
-                raise RuntimeError("Nenhum método de envio funcionou")
+                    print(f" ⚠️ {method} falhou: {e}")
+                    continue
+                
+                status, data_id, upload_seconds = await _confirm_outgoing(page, baseline_id)
+                if status == "not_sent":
+                    print(f" ⊗ {method}: nenhuma bolha nova em {SEND_CONFIRM_BUBBLE_TIMEOUT_MS} ms")
+                    continue
+                
+                if upload_seconds is not None:
+                    print(f" ✓ Enviado via {method} ({status}, upload {upload_seconds:.1f}s)")
+                else:
+                    print(f" ✓ Enviado via {method} (upload ainda pendente)")
+                print("\n ✅✅✅ SUCESSO: Imagem + Legenda enviada!\n")
+                return SendResult(
+                    ok=True,
+                    status=status,
+                    method=method,
+                    data_id=data_id,
+                    attempts=attempt + 1,
+                    upload_seconds=upload_seconds,
+                    total_seconds=time.monotonic() - started,
+                )
             
-            print("\n ✅✅✅ SUCESSO: Imagem + Legenda enviada!\n")
-            return True
+            raise RuntimeError("Nenhum método de envio gerou bolha no chat")
         
         except Exception as e:
             print(f"\n ❌ Tentativa {attempt+1} falhou: {str(e)[:150]}\n")
+            last_error = str(e)[:150]
             
             # Cancela anexo com ESC
             try:
@@ -356,6 +656,11 @@ async def send_image_with_caption(
                 await asyncio.sleep(4)
             else:
                 print(" ❌ FALHA FINAL\n")
-                return False
     
-    return False
\ No newline at end of file
+    return SendResult(
+        ok=False,
+        status="not_sent",
+        attempts=max_retries,
+        total_seconds=time.monotonic() - started,
+        error=last_error,
+    )
\ No newline at end of file
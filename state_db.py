@@ -0,0 +1,378 @@
+"""
+Estado persistente do bot em SQLite (modo WAL).
+
+Tabelas indexadas para last-seen por source, janela de dedup (exata, por
+MinHash da legenda e por dHash da imagem), cache de afiliados (links gerados e URLs
+resolvidas) e histórico de envios. Cada
+leitura/escrita toca uma linha; WAL + busy_timeout deixam mais de uma
+instância do bot compartilhar o mesmo arquivo.
+
+Na primeira abertura importa os arquivos antigos (state_last_seen.txt,
+dedup_cache.txt, affiliate_cache.json). Os arquivos não são apagados.
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from config import STATE_DB_PATH
+
+# Arquivos das versões anteriores (importados uma única vez)
+LEGACY_LAST_SEEN_FILE = Path("state_last_seen.txt")
+LEGACY_DEDUP_FILE = Path("dedup_cache.txt")
+LEGACY_AFFILIATE_CACHE_FILE = Path("affiliate_cache.json")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS last_seen (
+    source TEXT PRIMARY KEY,
+    msg_id TEXT NOT NULL,
+    preview TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dedup (
+    target TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    PRIMARY KEY (target, content_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_dedup_sent_at ON dedup (sent_at);
+CREATE TABLE IF NOT EXISTS near_dedup (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    product_id TEXT,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_near_dedup_sent_at ON near_dedup (sent_at);
+CREATE TABLE IF NOT EXISTS image_hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL,
+    dhash INTEGER NOT NULL,
+    product_id TEXT,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_image_hashes_sent_at ON image_hashes (sent_at);
+CREATE TABLE IF NOT EXISTS affiliate_links (
+    product_key TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    link TEXT NOT NULL,
+    product_url TEXT NOT NULL DEFAULT '',
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (product_key, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_affiliate_links_expires ON affiliate_links (expires_at);
+CREATE TABLE IF NOT EXISTS resolved_urls (
+    short_url TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_resolved_urls_expires ON resolved_urls (expires_at);
+CREATE TABLE IF NOT EXISTS send_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    msg_id TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    preview TEXT NOT NULL DEFAULT '',
+    sent_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT '',
+    upload_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS idx_send_history_target ON send_history (target, sent_at);
+"""
+
+_conn: sqlite3.Connection | None = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is not None:
+        return _conn
+
+    # Autocommit: cada escrita é uma transação curta (lock do WAL dura pouco)
+    conn = sqlite3.connect(STATE_DB_PATH, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript(_SCHEMA)
+    _add_missing_columns(conn)
+    _conn = conn
+    _migrate_legacy_files(conn)
+    return conn
+
+
+def _add_missing_columns(conn: sqlite3.Connection):
+    """Colunas novas em tabelas de bancos criados por versões anteriores."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(send_history)")}
+    if "status" not in columns:
+        conn.execute("ALTER TABLE send_history ADD COLUMN status TEXT NOT NULL DEFAULT ''")
+    if "upload_seconds" not in columns:
+        conn.execute("ALTER TABLE send_history ADD COLUMN upload_seconds REAL")
+
+
+def close():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+# ============================================
+# MIGRAÇÃO DOS ARQUIVOS ANTIGOS
+# ============================================
+
+def _is_migrated(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM meta WHERE key = ?", (f"migrated:{name}",)).fetchone()
+    return row is not None
+
+
+def _mark_migrated(conn: sqlite3.Connection, name: str):
+    conn.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        (f"migrated:{name}", str(time.time())),
+    )
+
+
+def _migrate_legacy_files(conn: sqlite3.Connection):
+    migrations = [
+        (LEGACY_LAST_SEEN_FILE, _import_last_seen),
+        (LEGACY_DEDUP_FILE, _import_dedup),
+        (LEGACY_AFFILIATE_CACHE_FILE, _import_affiliate_cache),
+    ]
+    for path, importer in migrations:
+        if not path.exists() or _is_migrated(conn, path.name):
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Outra instância pode ter migrado enquanto esperávamos o lock
+            if _is_migrated(conn, path.name):
+                conn.execute("COMMIT")
+                continue
+            count = importer(conn, path)
+            _mark_migrated(conn, path.name)
+            conn.execute("COMMIT")
+            print(f"📦 Migrado {path.name} → {STATE_DB_PATH} ({count} registros)")
+        except Exception as e:
+            conn.execute("ROLLBACK")
+            print(f"⚠️ Erro ao migrar {path.name}: {e}")
+
+
+def _import_last_seen(conn: sqlite3.Connection, path: Path) -> int:
+    count = 0
+    now = time.time()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if "|" not in line:
+                continue
+            # rsplit: o ID nunca tem "|", o nome do grupo pode ter
+            source, msg_id = line.rsplit("|", 1)
+            if source and msg_id:
+                conn.execute(
+                    "INSERT OR IGNORE INTO last_seen (source, msg_id, updated_at) VALUES (?, ?, ?)",
+                    (source, msg_id, now),
+                )
+                count += 1
+    return count
+
+
+def _import_dedup(conn: sqlite3.Connection, path: Path) -> int:
+    count = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().rsplit("|", 2)
+            if len(parts) != 3:
+                continue
+            target, content_hash, sent_at = parts
+            try:
+                sent_at = float(sent_at)
+            except ValueError:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO dedup (target, content_hash, sent_at) VALUES (?, ?, ?)",
+                (target, content_hash, sent_at),
+            )
+            count += 1
+    return count
+
+
+def _import_affiliate_cache(conn: sqlite3.Connection, path: Path) -> int:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f) or {}
+    count = 0
+    for key, entry in (data.get("links") or {}).items():
+        product_key, _, tag = key.partition("|")
+        if product_key and tag and entry.get("link"):
+            conn.execute(
+                "INSERT OR REPLACE INTO affiliate_links (product_key, tag, link, product_url, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (product_key, tag, entry["link"], entry.get("product_url", ""), entry.get("expires_at", 0)),
+            )
+            count += 1
+    for short_url, entry in (data.get("resolved") or {}).items():
+        if entry.get("url"):
+            conn.execute(
+                "INSERT OR REPLACE INTO resolved_urls (short_url, url, expires_at) VALUES (?, ?, ?)",
+                (short_url, entry["url"], entry.get("expires_at", 0)),
+            )
+            count += 1
+    return count
+
+
+# ============================================
+# LAST-SEEN
+# ============================================
+
+def get_last_seen(source: str) -> str:
+    row = _connect().execute("SELECT msg_id FROM last_seen WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else ""
+
+
+def set_last_seen(source: str, msg_id: str, preview: str = ""):
+    _connect().execute(
+        """
+        INSERT INTO last_seen (source, msg_id, preview, updated_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT (source) DO UPDATE SET
+            msg_id = excluded.msg_id, preview = excluded.preview, updated_at = excluded.updated_at
+        """,
+        (source, msg_id, preview, time.time()),
+    )
+
+
+# ============================================
+# DEDUP
+# ============================================
+
+def dedup_load(since: float) -> list[tuple[str, str, float]]:
+    """Todas as entradas (target, hash, sent_at) enviadas depois de `since`."""
+    return _connect().execute(
+        "SELECT target, content_hash, sent_at FROM dedup WHERE sent_at >= ?",
+        (since,),
+    ).fetchall()
+
+
+def dedup_get(target: str, content_hash: str) -> float | None:
+    """Horário do último envio de (target, hash), ou None. Busca pela chave primária."""
+    row = _connect().execute(
+        "SELECT sent_at FROM dedup WHERE target = ? AND content_hash = ?",
+        (target, content_hash),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def dedup_put(target: str, content_hash: str, sent_at: float | None = None):
+    _connect().execute(
+        "INSERT OR REPLACE INTO dedup (target, content_hash, sent_at) VALUES (?, ?, ?)",
+        (target, content_hash, sent_at or time.time()),
+    )
+
+
+def dedup_purge(older_than: float) -> int:
+    """Remove entradas enviadas antes de `older_than`. RETORNA: nº removido."""
+    return _connect().execute("DELETE FROM dedup WHERE sent_at < ?", (older_than,)).rowcount
+
+
+def near_dedup_load(since: float) -> list[tuple[str, bytes, str | None, float]]:
+    """Entradas (target, assinatura, product_id, sent_at) enviadas depois de `since`."""
+    return _connect().execute(
+        "SELECT target, signature, product_id, sent_at FROM near_dedup WHERE sent_at >= ?",
+        (since,),
+    ).fetchall()
+
+
+def near_dedup_put(target: str, signature: bytes, product_id: str | None, sent_at: float):
+    _connect().execute(
+        "INSERT INTO near_dedup (target, signature, product_id, sent_at) VALUES (?, ?, ?, ?)",
+        (target, signature, product_id, sent_at),
+    )
+
+
+def near_dedup_purge(older_than: float) -> int:
+    return _connect().execute("DELETE FROM near_dedup WHERE sent_at < ?", (older_than,)).rowcount
+
+
+def image_hashes_load(since: float) -> list[tuple[str, int, str | None, float]]:
+    """Entradas (target, dhash, product_id, sent_at) enviadas depois de `since`."""
+    return _connect().execute(
+        "SELECT target, dhash, product_id, sent_at FROM image_hashes WHERE sent_at >= ?",
+        (since,),
+    ).fetchall()
+
+
+def image_hashes_put(target: str, dhash: int, product_id: str | None, sent_at: float):
+    _connect().execute(
+        "INSERT INTO image_hashes (target, dhash, product_id, sent_at) VALUES (?, ?, ?, ?)",
+        (target, dhash, product_id, sent_at),
+    )
+
+
+def image_hashes_purge(older_than: float) -> int:
+    return _connect().execute("DELETE FROM image_hashes WHERE sent_at < ?", (older_than,)).rowcount
+
+
+# ============================================
+# CACHE DE AFILIADOS
+# ============================================
+
+def link_get(product_key: str, tag: str) -> tuple[str, str] | None:
+    row = _connect().execute(
+        "SELECT link, product_url FROM affiliate_links WHERE product_key = ? AND tag = ? AND expires_at > ?",
+        (product_key, tag, time.time()),
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def link_put(product_key: str, tag: str, link: str, product_url: str, expires_at: float):
+    _connect().execute(
+        "INSERT OR REPLACE INTO affiliate_links (product_key, tag, link, product_url, expires_at) VALUES (?, ?, ?, ?, ?)",
+        (product_key, tag, link, product_url, expires_at),
+    )
+
+
+def resolved_get(short_url: str) -> str | None:
+    row = _connect().execute(
+        "SELECT url FROM resolved_urls WHERE short_url = ? AND expires_at > ?",
+        (short_url, time.time()),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def resolved_put(short_url: str, url: str, expires_at: float):
+    _connect().execute(
+        "INSERT OR REPLACE INTO resolved_urls (short_url, url, expires_at) VALUES (?, ?, ?)",
+        (short_url, url, expires_at),
+    )
+
+
+def purge_expired() -> int:
+    """Remove links/resoluções expirados. RETORNA: nº de linhas removidas."""
+    conn = _connect()
+    now = time.time()
+    removed = conn.execute("DELETE FROM affiliate_links WHERE expires_at <= ?", (now,)).rowcount
+    removed += conn.execute("DELETE FROM resolved_urls WHERE expires_at <= ?", (now,)).rowcount
+    return removed
+
+
+# ============================================
+# HISTÓRICO DE ENVIOS
+# ============================================
+
+def record_send(
+    source: str,
+    target: str,
+    msg_id: str,
+    ok: bool,
+    preview: str = "",
+    status: str = "",
+    upload_seconds: float | None = None,
+):
+    _connect().execute(
+        "INSERT INTO send_history (source, target, msg_id, ok, preview, sent_at, status, upload_seconds) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (source, target, msg_id, 1 if ok else 0, (preview or "")[:100], time.time(), status, upload_seconds),
+    )
+
@@ -0,0 +1,60 @@
+"""Smoke test do snapshot dos bubbles com um resultado de evaluate falso."""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import watcher  # noqa: E402
+
+
+class FakePage:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def evaluate(self, script, arg=None):
+        self.calls.append(arg)
+        return self.result
+
+
+def test_snapshot_last_bubbles_builds_snapshots():
+    page = FakePage([
+        {
+            "data_id": "false_123@g.us_AAA",
+            "outgoing": False,
+            "raw_text": "Oferta *boa*\nhttps://mercadolivre.com/sec/abc",
+            "hrefs": ["https://mercadolivre.com/sec/abc", "https://mercadolivre.com/sec/abc", ""],
+            "image": {"src": "blob:https://web.whatsapp.com/x", "kind": "blob", "selector": "img[src^='blob:']"},
+            "has_thumb": False,
+            "timestamp": "10:00",
+        },
+        {
+            "data_id": "false_123@g.us_BBB",
+            "outgoing": False,
+            "raw_text": "Só texto",
+            "hrefs": [],
+            "image": None,
+            "has_thumb": True,
+            "timestamp": "10:01",
+        },
+    ])
+
+    snaps = asyncio.run(watcher.snapshot_last_bubbles(page, 2))
+
+    assert page.calls == [{"limit": 2, "imgSelectors": watcher.BUBBLE_IMG_SELECTORS}]
+    assert [s.data_id for s in snaps] == ["false_123@g.us_AAA", "false_123@g.us_BBB"]
+    assert snaps[0].hrefs == ["https://mercadolivre.com/sec/abc"]
+    assert snaps[0].image["src"].startswith("blob:")
+    assert snaps[0].has_image
+    assert snaps[1].image is None
+    assert snaps[1].has_image  # miniatura _1JVSX ainda carregando
+
+
+def test_snapshot_last_bubbles_evaluate_error_returns_empty():
+    class BrokenPage:
+        async def evaluate(self, script, arg=None):
+            raise RuntimeError("page closed")
+
+    assert asyncio.run(watcher.snapshot_last_bubbles(BrokenPage(), 3)) == []
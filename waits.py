@@ -0,0 +1,185 @@
+"""
+Esperas por condição no lugar de wait_for_timeout fixo.
+
+Cada função espera uma condição (seletor num estado, DOM sem mutações,
+rede ociosa) com `timeout_ms` igual à pausa fixa que substitui: no pior
+caso o fluxo fica como era, no caso comum termina assim que a página
+está pronta. Nenhuma levanta exceção - retornam True/False e quem chama
+decide. Todas respeitam o piso de segurança (WAIT_SAFETY_FLOOR_MS): o
+tempo total nunca fica abaixo de um mínimo aleatório, para o ritmo
+continuar parecendo humano.
+"""
+
+import asyncio
+import random
+import time
+
+from config import (
+    CONDITION_WAITS_ENABLED,
+    WAIT_SAFETY_FLOOR_MS,
+    DOM_STABLE_QUIET_MS,
+    NETWORK_IDLE_MS,
+)
+
+# Resolve quando `root` passa `quietMs` sem mudanças na árvore (true) ou no
+# prazo (false). Dos atributos só `src` conta: a foto de um bubble chega
+# trocando o src da <img>; hover/presença mudam o resto o tempo todo.
+_DOM_STABLE_JS = """
+({root, quietMs, timeoutMs}) => new Promise((resolve) => {
+    const el = document.querySelector(root);
+    if (!el) { resolve(false); return; }
+    let quiet = null;
+    let deadline = null;
+    let observer = null;
+    const done = (ok) => {
+        if (observer) observer.disconnect();
+        clearTimeout(quiet);
+        clearTimeout(deadline);
+        resolve(ok);
+    };
+    observer = new MutationObserver(() => {
+        clearTimeout(quiet);
+        quiet = setTimeout(() => done(true), quietMs);
+    });
+    observer.observe(el, {
+        childList: true, subtree: true, characterData: true,
+        attributes: true, attributeFilter: ['src'],
+    });
+    quiet = setTimeout(() => done(true), quietMs);
+    deadline = setTimeout(() => done(false), timeoutMs);
+})
+"""
+
+
+def _floor_seconds(floor_ms) -> float:
+    if floor_ms is None:
+        floor_ms = WAIT_SAFETY_FLOOR_MS
+    if isinstance(floor_ms, (tuple, list)):
+        return random.uniform(*floor_ms) / 1000
+    return max(0, floor_ms) / 1000
+
+
+async def _respect_floor(started: float, floor_ms):
+    remaining = _floor_seconds(floor_ms) - (time.monotonic() - started)
+    if remaining > 0:
+        await asyncio.sleep(remaining)
+
+
+async def pause(floor_ms=None):
+    """Só o piso de segurança (substitui pausas que não esperam nada específico)."""
+    await asyncio.sleep(_floor_seconds(floor_ms))
+
+
+async def wait_for_state(
+    page,
+    target,
+    state: str = "visible",
+    timeout_ms: int = 5000,
+    floor_ms=None,
+) -> bool:
+    """
+    Espera um seletor (str) ou Locator chegar em `state`
+    (attached | detached | visible | hidden).
+    """
+    started = time.monotonic()
+    if not CONDITION_WAITS_ENABLED:
+        await asyncio.sleep(timeout_ms / 1000)
+        return True
+    locator = page.locator(target).first if isinstance(target, str) else target
+    try:
+        await locator.wait_for(state=state, timeout=timeout_ms)
+        ok = True
+    except Exception:
+        ok = False
+    await _respect_floor(started, floor_ms)
+    return ok
+
+
+async def wait_for_dom_stable(
+    page,
+    root: str = "body",
+    quiet_ms: int = DOM_STABLE_QUIET_MS,
+    timeout_ms: int = 3000,
+    floor_ms=None,
+) -> bool:
+    """Espera `root` existir e ficar `quiet_ms` sem mutações."""
+    started = time.monotonic()
+    if not CONDITION_WAITS_ENABLED:
+        await asyncio.sleep(timeout_ms / 1000)
+        return True
+    try:
+        await page.locator(root).first.wait_for(state="attached", timeout=timeout_ms)
+        left_ms = max(quiet_ms, timeout_ms - int((time.monotonic() - started) * 1000))
+        ok = bool(await page.evaluate(
+            _DOM_STABLE_JS, {"root": root, "quietMs": quiet_ms, "timeoutMs": left_ms}
+        ))
+    except Exception:
+        ok = False
+    await _respect_floor(started, floor_ms)
+    return ok
+
+
+async def wait_for_condition(
+    page,
+    expression: str,
+    arg=None,
+    timeout_ms: int = 3000,
+    floor_ms=None,
+) -> bool:
+    """Espera a função JS `expression(arg)` ficar verdadeira."""
+    started = time.monotonic()
+    if not CONDITION_WAITS_ENABLED:
+        await asyncio.sleep(timeout_ms / 1000)
+        return True
+    try:
+        await page.wait_for_function(expression, arg=arg, timeout=timeout_ms)
+        ok = True
+    except Exception:
+        ok = False
+    await _respect_floor(started, floor_ms)
+    return ok
+
+
+async def wait_for_network_idle(
+    page,
+    idle_ms: int = NETWORK_IDLE_MS,
+    timeout_ms: int = 5000,
+    floor_ms=None,
+) -> bool:
+    """
+    Espera `idle_ms` sem requisições em andamento (vistas a partir da
+    chamada). WebSockets não contam, então o WhatsApp também fica ocioso.
+    """
+    started = time.monotonic()
+    if not CONDITION_WAITS_ENABLED:
+        await asyncio.sleep(timeout_ms / 1000)
+        return True
+
+    inflight = set()
+    last_activity = [time.monotonic()]
+
+    def on_request(request):
+        inflight.add(request)
+        last_activity[0] = time.monotonic()
+
+    def on_done(request):
+        inflight.discard(request)
+        last_activity[0] = time.monotonic()
+
+    page.on("request", on_request)
+    page.on("requestfinished", on_done)
+    page.on("requestfailed", on_done)
+    ok = False
+    try:
+        deadline = started + timeout_ms / 1000
+        while time.monotonic() < deadline:
+            if not inflight and time.monotonic() - last_activity[0] >= idle_ms / 1000:
+                ok = True
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        page.remove_listener("request", on_request)
+        page.remove_listener("requestfinished", on_done)
+        page.remove_listener("requestfailed", on_done)
+    await _respect_floor(started, floor_ms)
+    return ok
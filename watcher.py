@@ -1,11 +1,33 @@
 import re
+import json
+import asyncio
 import hashlib
 import base64
 import uuid
-import os
-from pathlib import Path
 from datetime import datetime
+from dataclasses import dataclass
 from playwright.async_api import Page, Locator
+from waits import pause, wait_for_state, wait_for_dom_stable, wait_for_condition
+
+# O #main só é do chat pedido quando o cabeçalho mostra o nome dele: logo
+# após o clique o painel do chat anterior ainda está na tela e pode parecer
+# "estável" para o wait_for_dom_stable.
+_CHAT_HEADER_JS = """
+(name) => {
+    const header = document.querySelector('#main header');
+    if (!header) return false;
+    if (header.querySelector(`span[title="${CSS.escape(name)}"]`)) return true;
+    return (header.innerText || '').split('\\n').some(line => line.trim() === name);
+}
+"""
+
+
+async def _wait_chat_shown(page: Page, chat_name: str, timeout_ms: int):
+    """Espera o #main trocar para `chat_name` e então parar de renderizar."""
+    if not await wait_for_condition(page, _CHAT_HEADER_JS, chat_name, timeout_ms=timeout_ms, floor_ms=0):
+        print(f"   ⚠️ Cabeçalho de '{chat_name}' não apareceu no painel")
+    await wait_for_dom_stable(page, "#main", timeout_ms=timeout_ms)
+
 
 # --- FUNÇÃO DE ABERTURA DE CHAT (MANTIDA) ---
 async def open_chat(page: Page, chat_name: str):
@@ -18,7 +40,7 @@ async def open_chat(page: Page, chat_name: str):
         chat_locator = page.locator(f"span[title='{chat_name}']").first
         if await chat_locator.is_visible(timeout=2000):
             await chat_locator.click()
-            await page.wait_for_timeout(500)
+            await _wait_chat_shown(page, chat_name, timeout_ms=500)
             return True
     except Exception:
         pass
@@ -26,90 +48,322 @@ async def open_chat(page: Page, chat_name: str):
     try:
         search_box = page.locator('div[contenteditable="true"][data-tab="3"]')
         await search_box.click()
-        await page.wait_for_timeout(300)
+        await pause()
         
         await search_box.press("Control+A")
         await search_box.press("Backspace")
         
         await search_box.fill(chat_name)
-        await page.wait_for_timeout(2000)
 
         chat_locator = page.locator(f"span[title='{chat_name}']").first
+        # Resultado da busca aparece sem rede: basta esperar o título
+        await wait_for_state(page, chat_locator, "visible", timeout_ms=2000)
         await chat_locator.click()
 
         await page.keyboard.press("Escape")
-        await page.wait_for_timeout(1000)
+        await _wait_chat_shown(page, chat_name, timeout_ms=1000)
         return True
 
     except Exception as e:
         raise Exception(f"❌ Não foi possível encontrar o chat '{chat_name}'. Erro: {e}")
 
 
-# --- FUNÇÕES DE EXTRAÇÃO (ATUALIZADAS PARA CORTAR AMAZON TAMBÉM) ---
+# --- DETECÇÃO POR EVENTOS (MutationObserver NA LISTA DE CHATS) ---
 
-async def get_last_message_bubble(page: Page) -> Locator | None:
-    bubbles = page.locator("div.message-in, div.message-out")
-    count = await bubbles.count()
-    if count == 0:
-        return None
-    return bubbles.nth(count - 1)
+CHAT_ACTIVITY_BINDING = "__botChatActivity"
 
-async def extract_last_message_text_and_urls(page) -> tuple[str, list[str]]:
-    last = await get_last_message_bubble(page)
-    if last is None:
-        return "", []
-    
-    hrefs = []
-    try:
-        hrefs = await last.locator("a[href^='http']").evaluate_all(
-            "els => els.map(a => a.getAttribute('href')).filter(Boolean)",
-            timeout=5000,
-        )
-        hrefs = [h.strip() for h in hrefs if isinstance(h, str) and h.strip()]
-    except Exception:
-        pass
-    
-    raw_text = ""
+# Leitura de uma linha da lista lateral: título, contador de não lidas e
+# assinatura (prévia + horário). Compartilhada pelo observer e pelo scan.
+_CHAT_ROW_READER_JS = """
+(row) => {
+    const titleEl = row.querySelector('span[title]');
+    if (!titleEl) return null;
+    const title = titleEl.getAttribute('title') || '';
+    let unread = 0;
+    for (const el of row.querySelectorAll('span[aria-label]')) {
+        const label = (el.getAttribute('aria-label') || '').toLowerCase();
+        if (label.includes('não lida') || label.includes('nao lida') || label.includes('unread')) {
+            unread = parseInt((el.textContent || '').trim(), 10) || 1;
+            break;
+        }
+    }
+    const lines = (row.innerText || '').split('\\n').map(s => s.trim()).filter(Boolean);
+    // Ignora o título e o badge numérico (abrir o chat zera o badge sem mensagem nova)
+    const signature = lines.filter(s => s !== title && !/^\\d{1,4}$/.test(s)).join(' | ');
+    return { title, unread, signature };
+}
+"""
+
+# Observer injetado no WhatsApp Web. Acompanha as linhas da lista lateral
+# (#pane-side) dos grupos monitorados e avisa o Python via binding quando a
+# prévia/horário/contador de não lidas de um deles muda.
+_CHAT_OBSERVER_JS = """
+(names) => {
+    const existing = window.__botChatObserver;
+    if (existing) {
+        existing.names = new Set(names);
+        return true;
+    }
+    const state = { names: new Set(names), last: {}, pane: null, observer: null, timer: null };
+    window.__botChatObserver = state;
+
+    const readRow = """ + _CHAT_ROW_READER_JS + """;
+
+    const scan = () => {
+        state.timer = null;
+        const pane = document.querySelector('#pane-side');
+        if (!pane) return;
+        for (const row of pane.querySelectorAll('div[role="listitem"], div[role="row"]')) {
+            const info = readRow(row);
+            if (!info || !state.names.has(info.title)) continue;
+            const prev = state.last[info.title];
+            state.last[info.title] = info;
+            if (!prev) continue;
+            if (info.unread > prev.unread || info.signature !== prev.signature) {
+                try {
+                    window.__botChatActivity(info);
+                } catch (e) {}
+            }
+        }
+    };
+
+    const schedule = () => {
+        if (state.timer === null) state.timer = setTimeout(scan, 300);
+    };
+
+    const attach = () => {
+        const pane = document.querySelector('#pane-side');
+        if (!pane || pane === state.pane) return;
+        if (state.observer) state.observer.disconnect();
+        state.pane = pane;
+        state.observer = new MutationObserver(schedule);
+        state.observer.observe(pane, { childList: true, subtree: true, characterData: true });
+        scan();
+    };
+
+    attach();
+    setInterval(attach, 2000);
+    return true;
+}
+"""
+
+
+# Pré-passo: lê de uma vez as linhas dos sources na lista lateral.
+# Chats fora da parte renderizada (lista virtualizada) não aparecem.
+_CHAT_LIST_SCAN_JS = """
+(names) => {
+    const readRow = """ + _CHAT_ROW_READER_JS + """;
+    const pane = document.querySelector('#pane-side');
+    if (!pane) return null;
+    const wanted = new Set(names);
+    const found = {};
+    for (const row of pane.querySelectorAll('div[role="listitem"], div[role="row"]')) {
+        const info = readRow(row);
+        if (info && wanted.has(info.title) && !found[info.title]) found[info.title] = info;
+    }
+    return found;
+}
+"""
+
+
+@dataclass
+class ChatRowState:
+    """Estado de um chat na lista lateral (sem abrir o chat)."""
+
+    title: str
+    unread: int
+    signature: str  # prévia + horário da última mensagem
+
+
+async def scan_chat_list(page: Page, chat_names: list[str]) -> dict[str, ChatRowState] | None:
+    """
+    Lê contador de não lidas e prévia/horário dos chats pedidos num único
+    page.evaluate. RETORNA: {título: ChatRowState} (só os visíveis) ou None
+    se a lista lateral não estiver disponível.
+    """
     try:
-        copyable = last.locator("span.copyable-text").first
-        raw_text = await copyable.evaluate(
-            """
-            el => {
-                let text = '';
-                function extract(node) {
-                    if (node.nodeType === 3) {
-                        text += node.textContent;
-                    } else if (node.nodeType === 1) {
-                        const tag = node.tagName;
-                        if (tag === 'IMG' && node.classList.contains('emoji')) {
-                            text += node.alt || '';
-                        } else if (tag === 'STRONG') {
-                            text += '*';
-                            node.childNodes.forEach(extract);
-                            text += '*';
-                        } else if (tag === 'EM') {
-                            text += '_';
-                            node.childNodes.forEach(extract);
-                            text += '_';
-                        } else if (tag === 'BR') {
-                            text += '\\n';
-                        } else {
-                            node.childNodes.forEach(extract);
-                        }
-                    }
+        rows = await page.evaluate(_CHAT_LIST_SCAN_JS, list(chat_names))
+    except Exception as e:
+        print(f"   ⚠️ Erro ao ler lista de chats: {e}")
+        return None
+    if rows is None:
+        return None
+    return {
+        title: ChatRowState(title=title, unread=int(info.get("unread") or 0), signature=info.get("signature") or "")
+        for title, info in rows.items()
+    }
+
+
+class ChatActivityWatcher:
+    """
+    Detecção push de mensagens novas: um MutationObserver na lista de chats
+    reporta (via page.expose_binding) quais grupos source tiveram atividade.
+    Só esses chats precisam ser abertos no próximo ciclo.
+    """
+
+    def __init__(self, chat_names: list[str]):
+        self._names = list(chat_names)
+        self._pending: set[str] = set()
+        self._event = asyncio.Event()
+        self.installed = False
+
+    def _on_activity(self, source, info):
+        title = (info or {}).get("title") if isinstance(info, dict) else None
+        if not title or title not in self._names:
+            return
+        if title not in self._pending:
+            print(f"   🔔 Atividade detectada em: {title} (não lidas: {info.get('unread', 0)})")
+        self._pending.add(title)
+        self._event.set()
+
+    async def install(self, page: Page) -> bool:
+        """Injeta o observer (uma vez por page; o init script cobre reloads)."""
+        try:
+            await page.expose_binding(CHAT_ACTIVITY_BINDING, self._on_activity)
+            names_json = json.dumps(self._names, ensure_ascii=False)
+            await page.add_init_script(script=f"({_CHAT_OBSERVER_JS})({names_json});")
+            await page.evaluate(_CHAT_OBSERVER_JS, self._names)
+            self.installed = True
+        except Exception as e:
+            print(f"   ⚠️ Não foi possível instalar observer da lista de chats: {e}")
+            self.installed = False
+        return self.installed
+
+    async def wait(self, timeout: float) -> bool:
+        """Aguarda atividade até `timeout` segundos. True se houve atividade."""
+        if self._pending:
+            return True
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=max(0.0, timeout))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def drain(self) -> set[str]:
+        """Retorna e limpa os chats com atividade pendente."""
+        pending = set(self._pending)
+        self._pending.clear()
+        self._event.clear()
+        return pending
+
+
+# --- SNAPSHOT DOS BUBBLES (UM ÚNICO page.evaluate) ---
+
+# Candidatos à foto do bubble em ORDEM DE PRIORIDADE (o original vem antes
+# da prévia): não são alternativas equivalentes, então ficam fora do
+# registro de seletores e nunca são reordenados por taxa de acerto
+# Só blob:/data:/mmg.whatsapp.net contam como foto: https genérico pega
+# miniatura de link e foto de perfil
+BUBBLE_IMG_SELECTORS = [
+    "img[src^='blob:']",
+    "img[data-plain-src]",
+    "img[src*='mmg.whatsapp.net']",
+    "img[src^='data:']",
+]
+
+# Lê os últimos N bubbles de uma vez: data-id, texto com *negrito*/_itálico_/
+# emoji, hrefs, imagem (src/tipo/dimensões) e timestamp. Tudo que vem depois
+# lê deste snapshot, então imagem e legenda sempre são do mesmo bubble.
+_BUBBLE_SNAPSHOT_JS = """
+({limit, imgSelectors}) => {
+    const extract = (root) => {
+        let text = '';
+        const walk = (node) => {
+            if (node.nodeType === 3) {
+                text += node.textContent;
+            } else if (node.nodeType === 1) {
+                const tag = node.tagName;
+                if (tag === 'IMG' && node.classList.contains('emoji')) {
+                    text += node.alt || '';
+                } else if (tag === 'STRONG') {
+                    text += '*';
+                    node.childNodes.forEach(walk);
+                    text += '*';
+                } else if (tag === 'EM') {
+                    text += '_';
+                    node.childNodes.forEach(walk);
+                    text += '_';
+                } else if (tag === 'BR') {
+                    text += '\\n';
+                } else {
+                    node.childNodes.forEach(walk);
                 }
-                extract(el);
-                return text;
             }
-            """,
-            timeout=8000,
-        )
-    except Exception:
-        try:
-            raw_text = await last.inner_text(timeout=5000)
-        except Exception:
-            pass
+        };
+        walk(root);
+        return text;
+    };
+
+    // Prévia de link (card clicável) e avatar não são a foto da oferta
+    const isPreview = (el) => !!el.closest('a[href], [data-testid*="link-preview"], [data-testid*="avatar"]');
+    const isPhotoSrc = (src) => src.startsWith('blob:') || src.startsWith('data:') || src.includes('mmg.whatsapp.net');
+
+    const bubbles = Array.from(document.querySelectorAll('div.message-in, div.message-out'));
+    return bubbles.slice(-Math.max(1, limit)).map((b) => {
+        const holder = b.closest('[data-id]') || b.querySelector('[data-id]');
+        const copyable = b.querySelector('span.copyable-text');
+        const pre = b.querySelector('[data-pre-plain-text]');
+
+        let image = null;
+        for (const sel of imgSelectors) {
+            // Emojis do texto também são <img>, não contam como foto
+            const img = Array.from(b.querySelectorAll(sel)).find(el =>
+                !el.classList.contains('emoji') && !isPreview(el)
+                && isPhotoSrc(el.getAttribute('src') || el.getAttribute('data-plain-src') || ''));
+            if (!img) continue;
+            const src = img.getAttribute('src') || img.getAttribute('data-plain-src') || '';
+            image = {
+                src,
+                kind: src.startsWith('blob:') ? 'blob' : (src.startsWith('data:') ? 'data' : 'https'),
+                width: img.naturalWidth || img.width || 0,
+                height: img.naturalHeight || img.height || 0,
+                selector: sel,
+            };
+            break;
+        }
+
+        return {
+            data_id: holder ? (holder.getAttribute('data-id') || '') : '',
+            outgoing: b.classList.contains('message-out'),
+            raw_text: copyable ? extract(copyable) : (b.innerText || ''),
+            hrefs: Array.from(b.querySelectorAll("a[href^='http']"))
+                .map(a => a.getAttribute('href'))
+                .filter(Boolean),
+            image,
+            has_thumb: Array.from(b.querySelectorAll('div._1JVSX')).some(el => !isPreview(el)),
+            timestamp: pre ? (pre.getAttribute('data-pre-plain-text') || '') : '',
+        };
+    });
+}
+"""
 
+
+@dataclass
+class BubbleSnapshot:
+    """Estado de um bubble lido em um único roundtrip."""
+
+    data_id: str
+    outgoing: bool
+    text: str  # já limpo (sem metadados) e cortado após o link
+    hrefs: list[str]
+    image: dict | None  # {"src", "kind": blob|data|https, "width", "height"}
+    has_image: bool
+    timestamp: str  # data-pre-plain-text, ex: "[10:32, 18/10/2026] Fulano: "
+
+    def locator(self, page: Page) -> Locator:
+        """Locator do bubble (para screenshot de fallback)."""
+        if self.data_id:
+            safe_id = self.data_id.replace('"', '\\"')
+            sel = f'[data-id="{safe_id}"]'
+            return page.locator(
+                f"{sel} div.message-in, {sel} div.message-out, "
+                f"div.message-in:has({sel}), div.message-out:has({sel})"
+            ).first
+        return page.locator("div.message-in, div.message-out").last
+
+
+def _clean_message_text(raw_text: str) -> str:
+    """Remove metadados de tempo/encaminhamento e corta após o link."""
     raw_text = (raw_text or "").strip()
     
     # Remove metadados de tempo/encaminhamento
@@ -142,15 +396,60 @@ async def extract_last_message_text_and_urls(page) -> tuple[str, list[str]]:
     raw_text = "\n".join(cleaned_lines).strip()
     
     # 🔥 AQUI ESTÁ A MUDANÇA: Usa a nova função genérica
-    text = cut_text_after_link(raw_text)
-    
-    seen = set()
-    urls: list[str] = []
-    for u in hrefs:
-        if u not in seen:
-            seen.add(u)
-            urls.append(u)
-    return text, urls
+    return cut_text_after_link(raw_text)
+
+
+async def snapshot_last_bubbles(page: Page, limit: int = 1) -> list[BubbleSnapshot]:
+    """Snapshot dos últimos `limit` bubbles do chat aberto (mais antigo primeiro)."""
+    try:
+        raw = await page.evaluate(
+            _BUBBLE_SNAPSHOT_JS, {"limit": limit, "imgSelectors": BUBBLE_IMG_SELECTORS}
+        )
+    except Exception as e:
+        print(f"   ⚠️ Erro ao ler bubbles: {e}")
+        return []
+
+    snaps = []
+    for item in raw or []:
+        seen = set()
+        urls: list[str] = []
+        for u in item.get("hrefs") or []:
+            u = u.strip() if isinstance(u, str) else ""
+            if u and u not in seen:
+                seen.add(u)
+                urls.append(u)
+        image = item.get("image")
+        snaps.append(
+            BubbleSnapshot(
+                data_id=item.get("data_id") or "",
+                outgoing=bool(item.get("outgoing")),
+                text=_clean_message_text(item.get("raw_text") or ""),
+                hrefs=urls,
+                image=image,
+                has_image=bool(image) or bool(item.get("has_thumb")),
+                timestamp=item.get("timestamp") or "",
+            )
+        )
+    return snaps
+
+
+async def get_last_bubble_snapshot(page: Page) -> BubbleSnapshot | None:
+    snaps = await snapshot_last_bubbles(page, 1)
+    return snaps[-1] if snaps else None
+
+
+async def get_last_message_bubble(page: Page) -> Locator | None:
+    bubbles = page.locator("div.message-in, div.message-out")
+    count = await bubbles.count()
+    if count == 0:
+        return None
+    return bubbles.nth(count - 1)
+
+async def extract_last_message_text_and_urls(page) -> tuple[str, list[str]]:
+    snap = await get_last_bubble_snapshot(page)
+    if snap is None:
+        return "", []
+    return snap.text, snap.hrefs
 
 def cut_text_after_link(text: str) -> str:
     """
@@ -216,212 +515,184 @@ def compute_msg_id(text: str, urls: list[str]) -> str:
     combined = f"{text}||{'|'.join(urls)}"
     return hashlib.sha256(combined.encode("utf-8")).hexdigest()
 
-async def has_image(bubble: Locator | None) -> bool:
+async def has_image(bubble: "BubbleSnapshot | Locator | None") -> bool:
     if bubble is None:
         return False
-    img = bubble.locator("img[src^='blob:'], img[src^='data:'], div._1JVSX")
+    if isinstance(bubble, BubbleSnapshot):
+        return bubble.has_image
+    img = bubble.locator(
+        "img[src^='blob:']:not(a[href] img), img[src^='data:']:not(a[href] img), "
+        "img[src*='mmg.whatsapp.net']:not(a[href] img), div._1JVSX:not(a[href] div)"
+    )
     count = await img.count()
     return count > 0
 
 
-async def download_image_from_bubble(page: Page, bubble: Locator, download_dir: str, source_name: str = "") -> str | None:
+MIME_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+
+def _image_payload(data: bytes, mime_type: str, source_name: str = "", prefix: str = "img") -> dict:
+    """
+    Monta o payload em memória aceito por set_files/file_chooser.set_files:
+    {"name", "mimeType", "buffer"}. Nada é gravado em disco.
+    """
+    mime_type = (mime_type or "image/jpeg").split(";")[0].strip().lower()
+    ext = MIME_EXTENSIONS.get(mime_type, "jpg")
+    safe_source = re.sub(r'[^\w\-]', '_', source_name) if source_name else "unknown"
+    timestamp = datetime.now().strftime("%H%M%S")
+    unique_id = str(uuid.uuid4())[:8]
+    return {
+        "name": f"{prefix}_{safe_source}_{timestamp}_{unique_id}.{ext}",
+        "mimeType": mime_type,
+        "buffer": data,
+    }
+
+
+# O blob é lido UMA vez (o MIME vem do mesmo fetch) e volta do próprio
+# page.evaluate como base64 (ArrayBuffer em pedaços, sem FileReader/data
+# URL). Nada passa pela rede da página: o service worker do WhatsApp não
+# intercepta e nenhuma rota do Playwright é necessária.
+_BLOB_BASE64_JS = """
+async (blobUrl) => {
+    const blob = await (await fetch(blobUrl)).blob();
+    const bytes = new Uint8Array(await blob.arrayBuffer());
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return {type: blob.type || '', size: blob.size, data: btoa(binary)};
+}
+"""
+
+
+async def _read_blob_bytes(page: Page, blob_url: str) -> tuple[bytes, str] | None:
+    """Lê um blob: da página (bytes + MIME). None = quem chama cai no screenshot."""
+    result = await page.evaluate(_BLOB_BASE64_JS, blob_url)
+    if not result or not result.get("data"):
+        return None
+    data = base64.b64decode(result["data"])
+    if len(data) != result.get("size", len(data)):
+        return None
+    return data, result.get("type") or "image/jpeg"
+
+
+async def _read_image_from_src(page: Page, img_url: str) -> tuple[bytes, str] | None:
+    """Lê os bytes (e o MIME) da imagem apontada por `img_url` (blob:/https://)."""
+    if img_url.startswith("blob:"):
+        print(f"   → Lendo blob da imagem original...")
+        return await _read_blob_bytes(page, img_url)
+    if img_url.startswith("https://"):
+        response = await page.context.request.get(img_url)
+        if response.status == 200:
+            return await response.body(), response.headers.get("content-type", "image/jpeg")
+    return None
+
+
+async def download_image_from_bubble(page: Page, bubble: "BubbleSnapshot | None", source_name: str = "") -> dict | None:
     """
-    Baixa a imagem de um bubble ESPECÍFICO (garante que imagem e texto vêm da mesma mensagem).
+    Lê a imagem de um bubble ESPECÍFICO (garante que imagem e texto vêm da mesma mensagem).
+    Usa o src já lido no snapshot: nenhuma sondagem extra de seletores.
+    RETORNA: payload {"name", "mimeType", "buffer"} para o upload, ou None.
     """
     if bubble is None:
         return None
+    locator = bubble.locator(page)
+    img_url = (bubble.image or {}).get("src")
+    if not img_url:
+        if bubble.has_image:
+            return await _screenshot_bubble_image(locator, source_name)
+        print("   ⚠️ Não encontrei imagem no bubble")
+        return None
+
+    print(f"   ✓ Imagem encontrada: {bubble.image.get('kind')} ({img_url[:50]}...)")
     try:
-        img_selectors = [
-            "img[src^='blob:']",
-            "img[src^='https://']",
-            "img[data-plain-src]",
-            "img[src*='mmg.whatsapp.net']",
-            "img[src^='data:']",
-        ]
-        img_element = None
-        img_url = None
-        for selector in img_selectors:
-            try:
-                elem = bubble.locator(selector).first
-                if await elem.count() > 0:
-                    img_url = await elem.get_attribute("src")
-                    if not img_url:
-                        img_url = await elem.get_attribute("data-plain-src")
-                    if img_url:
-                        img_element = elem
-                        print(f"   ✓ Imagem encontrada: {selector} ({img_url[:50]}...)")
-                        break
-            except Exception:
-                continue
-        if not img_element or not img_url:
-            print("   ⚠️ Não encontrei imagem no bubble")
-            return None
-        
-        Path(download_dir).mkdir(parents=True, exist_ok=True)
-        safe_source = re.sub(r'[^\w\-]', '_', source_name) if source_name else "unknown"
-        timestamp = datetime.now().strftime("%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"img_{safe_source}_{timestamp}_{unique_id}.jpg"
-        path = f"{download_dir}/{filename}"
-
-        if img_url.startswith("blob:"):
-            print(f"   → Convertendo blob em imagem real...")
-            try:
-                base64_data = await page.evaluate(
-                    """
-                    async (blobUrl) => {
-                        const response = await fetch(blobUrl);
-                        const blob = await response.blob();
-                        return new Promise((resolve) => {
-                            const reader = new FileReader();
-                            reader.onloadend = () => resolve(reader.result);
-                            reader.readAsDataURL(blob);
-                        });
-                    }
-                    """,
-                    img_url
-                )
-                if base64_data and "base64," in base64_data:
-                    base64_str = base64_data.split("base64,")[1]
-                    image_bytes = base64.b64decode(base64_str)
-                    with open(path, "wb") as f:
-                        f.write(image_bytes)
-                    print(f"   ✓ Imagem ORIGINAL do WhatsApp salva: {filename}")
-                    return path
-                else:
-                    return await _screenshot_bubble_image(bubble, download_dir, source_name)
-            except Exception:
-                return await _screenshot_bubble_image(bubble, download_dir, source_name)
-        elif img_url.startswith("https://"):
-            response = await page.context.request.get(img_url)
-            if response.status == 200:
-                image_data = await response.body()
-                with open(path, "wb") as f:
-                    f.write(image_data)
-                return path
-            else:
-                return await _screenshot_bubble_image(bubble, download_dir, source_name)
-        else:
-            return await _screenshot_bubble_image(bubble, download_dir, source_name)
+        result = await _read_image_from_src(page, img_url)
+        if result:
+            data, mime_type = result
+            payload = _image_payload(data, mime_type, source_name)
+            print(f"   ✓ Imagem ORIGINAL do WhatsApp em memória: {payload['name']} ({len(data) // 1024} KB)")
+            return payload
     except Exception:
-        return await _screenshot_bubble_image(bubble, download_dir, source_name)
+        pass
+    return await _screenshot_bubble_image(locator, source_name)
 
 
-async def _screenshot_bubble_image(bubble: Locator, download_dir: str, source_name: str = "") -> str | None:
-    """Faz screenshot da imagem de um bubble específico como fallback."""
+async def _screenshot_bubble_image(bubble: Locator, source_name: str = "") -> dict | None:
+    """Faz screenshot (em memória) da imagem de um bubble específico como fallback."""
     if bubble is None:
         return None
     img = bubble.locator("img[src^='blob:'], img[src^='data:']").first
     try:
-        Path(download_dir).mkdir(parents=True, exist_ok=True)
-        safe_source = re.sub(r'[^\w\-]', '_', source_name) if source_name else "unknown"
-        timestamp = datetime.now().strftime("%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"screenshot_{safe_source}_{timestamp}_{unique_id}.jpg"
-        path = f"{download_dir}/{filename}"
-        await img.screenshot(path=path, type="jpeg", quality=90)
-        print(f"   ✓ Screenshot salvo: {filename}")
-        return path
+        data = await img.screenshot(type="jpeg", quality=90)
+        payload = _image_payload(data, "image/jpeg", source_name, prefix="screenshot")
+        print(f"   ✓ Screenshot capturado: {payload['name']}")
+        return payload
     except Exception as e:
         print(f"   ⚠️ Erro ao fazer screenshot do bubble: {e}")
         return None
 
 
-async def download_last_image(page: Page, download_dir: str, source_name: str = "") -> str | None:
-    last = await get_last_message_bubble(page)
-    if last is None:
+# dHash 9x8 em tons de cinza no canvas da página: reaproveita o <img> já
+# carregado (blob: é same-origin, o canvas não fica "tainted")
+_IMAGE_DHASH_JS = """
+async (src) => {
+    let source = Array.from(document.querySelectorAll('img')).find(i => i.src === src);
+    if (!source || !source.complete || !source.naturalWidth) {
+        const blob = await (await fetch(src)).blob();
+        source = await createImageBitmap(blob);
+    }
+    const canvas = document.createElement('canvas');
+    canvas.width = 9;
+    canvas.height = 8;
+    const ctx = canvas.getContext('2d', { willReadFrequently: true });
+    ctx.imageSmoothingEnabled = true;
+    ctx.imageSmoothingQuality = 'high';
+    ctx.drawImage(source, 0, 0, 9, 8);
+    const data = ctx.getImageData(0, 0, 9, 8).data;
+    const gray = [];
+    for (let i = 0; i < 72; i++) {
+        gray.push(0.299 * data[i * 4] + 0.587 * data[i * 4 + 1] + 0.114 * data[i * 4 + 2]);
+    }
+    let bits = '';
+    for (let y = 0; y < 8; y++) {
+        for (let x = 0; x < 8; x++) {
+            bits += gray[y * 9 + x] > gray[y * 9 + x + 1] ? '1' : '0';
+        }
+    }
+    return bits;
+}
+"""
+
+
+async def compute_image_dhash(page: Page, bubble: "BubbleSnapshot | None") -> int | None:
+    """
+    Hash perceptual (dHash, 64 bits) da imagem do bubble, calculado na página.
+    RETORNA: inteiro de 64 bits ou None (sem src legível).
+    """
+    src = ((bubble.image or {}).get("src") if bubble else None) or ""
+    if not src.startswith(("blob:", "data:")):
         return None
     try:
-        img_selectors = [
-            "img[src^='blob:']",
-            "img[src^='https://']",
-            "img[data-plain-src]",
-            "img[src*='mmg.whatsapp.net']",
-            "img[src^='data:']",
-        ]
-        img_element = None
-        img_url = None
-        for selector in img_selectors:
-            try:
-                elem = last.locator(selector).first
-                if await elem.count() > 0:
-                    img_url = await elem.get_attribute("src")
-                    if not img_url:
-                        img_url = await elem.get_attribute("data-plain-src")
-                    if img_url:
-                        img_element = elem
-                        print(f"   ✓ Imagem encontrada: {selector} ({img_url[:50]}...)")
-                        break
-            except Exception:
-                continue
-        if not img_element or not img_url:
-            print("   ⚠️ Não encontrei imagem")
-            return None
-        
-        Path(download_dir).mkdir(parents=True, exist_ok=True)
-        safe_source = re.sub(r'[^\w\-]', '_', source_name) if source_name else "unknown"
-        timestamp = datetime.now().strftime("%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"img_{safe_source}_{timestamp}_{unique_id}.jpg"
-        path = f"{download_dir}/{filename}"
-
-        if img_url.startswith("blob:"):
-            print(f"   → Convertendo blob em imagem real...")
-            try:
-                base64_data = await page.evaluate(
-                    """
-                    async (blobUrl) => {
-                        const response = await fetch(blobUrl);
-                        const blob = await response.blob();
-                        return new Promise((resolve) => {
-                            const reader = new FileReader();
-                            reader.onloadend = () => resolve(reader.result);
-                            reader.readAsDataURL(blob);
-                        });
-                    }
-                    """,
-                    img_url
-                )
-                if base64_data and "base64," in base64_data:
-                    base64_str = base64_data.split("base64,")[1]
-                    image_bytes = base64.b64decode(base64_str)
-                    with open(path, "wb") as f:
-                        f.write(image_bytes)
-                    print(f"   ✓ Imagem ORIGINAL do WhatsApp salva: {filename}")
-                    return path
-                else:
-                    return await screenshot_last_image(page, download_dir, source_name)
-            except Exception:
-                return await screenshot_last_image(page, download_dir, source_name)
-        elif img_url.startswith("https://"):
-            response = await page.context.request.get(img_url)
-            if response.status == 200:
-                image_data = await response.body()
-                with open(path, "wb") as f:
-                    f.write(image_data)
-                return path
-            else:
-                return await screenshot_last_image(page, download_dir, source_name)
-        else:
-            return await screenshot_last_image(page, download_dir, source_name)
-    except Exception:
-        return await screenshot_last_image(page, download_dir, source_name)
+        bits = await page.evaluate(_IMAGE_DHASH_JS, src)
+        return int(bits, 2) if bits else None
+    except Exception as e:
+        print(f"   ⚠️ Erro ao calcular hash da imagem: {e}")
+        return None
+
 
-async def screenshot_last_image(page: Page, download_dir: str, source_name: str = "") -> str | None:
+async def download_last_image(page: Page, source_name: str = "") -> dict | None:
+    last = await get_last_bubble_snapshot(page)
+    if last is None:
+        return None
+    return await download_image_from_bubble(page, last, source_name)
+
+async def screenshot_last_image(page: Page, source_name: str = "") -> dict | None:
     last = await get_last_message_bubble(page)
     if last is None:
         return None
-    img = last.locator("img[src^='blob:'], img[src^='data:']").first
-    try:
-        Path(download_dir).mkdir(parents=True, exist_ok=True)
-        safe_source = re.sub(r'[^\w\-]', '_', source_name) if source_name else "unknown"
-        timestamp = datetime.now().strftime("%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"screenshot_{safe_source}_{timestamp}_{unique_id}.jpg"
-        path = f"{download_dir}/{filename}"
-        await img.screenshot(path=path, type="jpeg", quality=90)
-        print(f"   ✓ Screenshot salvo: {filename}")
-        return path
-    except Exception as e:
-        print(f"   ⚠️ Erro ao tirar screenshot: {e}")
-        return None
\ No newline at end of file
+    return await _screenshot_bubble_image(last, source_name)